@@ -133,6 +133,7 @@ class CRABClient(object):
             self.parser.print_help()
             sys.exit(-1)
         self.cmd = sub_cmd(self.logger, args[1:])  # the crab command to be executed
+        self.cmd.returnDictUsed = False
 
         # Every command returns a dictionary which MUST contain the "commandStatus" key.
         # Any value other then "SUCCESS" for this key indicates command failure
@@ -20,6 +20,7 @@ import sys
 import pickle
 import subprocess
 import traceback
+from multiprocessing.pool import ThreadPool
 if sys.version_info >= (3, 0):
     from urllib.parse import urlparse  # pylint: disable=E0611
 if sys.version_info < (3, 0):
@@ -53,6 +54,9 @@ BOOTSTRAP_CFGFILE_PKL = 'PSet.pkl'
 RUCIO_QUOTA_WARNING_GB = 10  # when available Rucio quota is less than this, warn users
 RUCIO_QUOTA_MINIMUM_GB = 1  # when available Rucio quota is less thatn this, refuse submission
 
+# max number of threads used to run independent external calls (dasgoclient, curl...) in parallel
+MAX_CONCURRENT_CALLS = 8
+
 class colors:  # pylint: disable=no-init
     colordict = {
                 'RED':'\033[91m',
@@ -190,6 +194,84 @@ def removeLoggerHandlers(logger):
         logger.removeHandler(h)
 
 
+# long listings go to the loggers this many lines at a time
+TABLE_PAGE_ROWS = 1000
+
+def logLines(logger, lines, level=logging.INFO, pageRows=TABLE_PAGE_ROWS):
+    """
+    log the lines of the iterable lines (e.g. a generator), pageRows lines per log record:
+    a long listing shows on the console while it is produced, and it is never built as one
+    string which the handlers and logfilter would have to go through
+    """
+    page = []
+    for line in lines:
+        page.append(line)
+        if len(page) >= pageRows:
+            logger.log(level, "\n".join(page))
+            page = []
+    if page:
+        logger.log(level, "\n".join(page))
+
+
+class TableWriter(object):
+    """
+    Write a table to a logger one page of rows at a time (see logLines), e.g.
+        writer = TableWriter(logger, [('job', 'Job', '%4s'), ('state', 'State', '%-12s')], title='Jobs:')
+        for row in rows:
+            writer.write(row)  # row['job'], row['state']
+        writer.close()
+    columns: (key, title, format) of the columns, only the keys in selected (in that order) are
+    written if given. With repeatHeader the header line starts every page.
+    """
+
+    def __init__(self, logger, columns, selected=None, title=None, level=logging.INFO,
+                 pageRows=TABLE_PAGE_ROWS, repeatHeader=False):
+        if selected:
+            columnsByKey = dict((column[0], column) for column in columns)
+            columns = [columnsByKey[key] for key in selected]
+        self.logger = logger
+        self.keys = [key for key, _, _ in columns]
+        self.rowFormat = " ".join(rowFormat for _, _, rowFormat in columns)
+        self.header = self.rowFormat % tuple(title for _, title, _ in columns)
+        self.level = level
+        self.pageRows = pageRows
+        self.repeatHeader = repeatHeader
+        self.page = [title, self.header] if title is not None else [self.header]
+        self.numRows = 0
+
+    def write(self, row):
+        """ add the values of the columns in the mapping row to the table """
+        self.page.append(self.rowFormat % tuple(row[key] for key in self.keys))
+        self.numRows += 1
+        if len(self.page) >= self.pageRows:
+            self.flush()
+
+    def writerows(self, rows):
+        """ write all the rows of the iterable rows """
+        for row in rows:
+            self.write(row)
+
+    def flush(self):
+        """ log the rows written so far """
+        if self.page:
+            self.logger.log(self.level, "\n".join(self.page))
+        self.page = [self.header] if self.repeatHeader else []
+
+    def close(self):
+        """ log the last rows """
+        if len(self.page) > 1 or not self.repeatHeader:
+            self.flush()
+        self.page = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        return False
+
+
 def getColumn(dictresult, columnName):
     columnIndex = dictresult['desc']['columns'].index(columnName)
     value = dictresult['result'][columnIndex]
@@ -449,6 +531,29 @@ def loadCache(mydir, logger):
     return pickle.load(loadfile), logfile
 
 
+def getCrabCacheDir(subdir=None):
+    """
+    Return (creating it if needed) the directory where CRAB Client keeps local caches
+    which are not specific to a project directory, e.g. DBS query results.
+    It is $CRAB3_CACHE_DIR if set, otherwise $XDG_CACHE_HOME/crab3 or ~/.cache/crab3
+    """
+    if os.environ.get('CRAB3_CACHE_DIR'):
+        cacheDir = os.environ['CRAB3_CACHE_DIR']
+    else:
+        xdgCache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        cacheDir = os.path.join(xdgCache, 'crab3')
+    if subdir:
+        cacheDir = os.path.join(cacheDir, subdir)
+    if not os.path.isdir(cacheDir):
+        try:
+            os.makedirs(cacheDir)
+        except OSError:
+            # another process may have created it in the meanwhile
+            if not os.path.isdir(cacheDir):
+                raise
+    return cacheDir
+
+
 def getUserProxy():
     """
     Retrieve the user proxy filename
@@ -587,23 +692,39 @@ def compareJobids(a, b):
         jobs (>1), then tail jobs (>1-*).
         Return value as expected from python2 cmp() builtin:
         cmp(x,y)  return value is negative if x < y, zero if x == y and strictly positive if x > y
+        To sort job IDs use jobidSortKey or sortJobids instead.
     """
-    aa = [int(x) for x in a.split('-')]
-    bb = [int(x) for x in b.split('-')]
-    if len(aa) < len(bb):
-        if bb[0] == 0:
-            return 1
-        return -1
-    elif len(aa) > len(bb):
-        if aa[0] == 0:
-            return -1
-        return 1
-    elif aa[0] == bb[0]:
-        if aa[1] == bb[1]:
-            return 0
-        else:
-            return 1 if aa[1] > bb[1] else -1
-    return 1 if aa[0] > bb[0] else -1
+    aa = jobidSortKey(a)
+    bb = jobidSortKey(b)
+    return (aa > bb) - (aa < bb)
+
+
+def jobidSortKey(jobid):
+    """ Sort key for a job ID giving the same order as compareJobids: probe jobs (0-*)
+        first, then processing jobs, then tail jobs, e.g. sorted(jobids, key=jobidSortKey)
+    """
+    parts = jobid.split('-')
+    if len(parts) == 1:
+        return (1, int(parts[0]), 0)
+    first = int(parts[0])
+    return (0 if first == 0 else 2, first, int(parts[1]))
+
+
+class JobidSortKeys(dict):
+    """ {jobid: jobidSortKey(jobid)}, each key computed the first time it is looked up.
+        Keep one around to sort the same job IDs several times.
+    """
+
+    def __missing__(self, jobid):
+        key = self[jobid] = jobidSortKey(jobid)
+        return key
+
+
+def sortJobids(jobids, sortKeys=None):
+    """ Return the list of job IDs sorted as compareJobids would do,
+        with the keys taken from the JobidSortKeys sortKeys if given.
+    """
+    return sorted(jobids, key=jobidSortKey if sortKeys is None else sortKeys.__getitem__)
 
 
 def validateJobids(jobids, allowLists=True):
@@ -834,6 +955,62 @@ def execute_command(command=None, logger=None, timeout=None, redirect=True):
 
     return stdout, stderr, rc
 
+def runInThreadPool(function, argsList, maxWorkers=MAX_CONCURRENT_CALLS):
+    """
+    call function(*args) for each args tuple in argsList using a bounded pool of threads.
+    Meant for functions which spend their time waiting on external commands or the network,
+    e.g. execute_command, so that those waits overlap.
+    Returns the list of return values in the same order as argsList.
+    An exception raised by one of the calls is re-raised here.
+    """
+    argsList = list(argsList)
+    if not argsList:
+        return []
+    if len(argsList) == 1 or maxWorkers <= 1:
+        return [function(*args) for args in argsList]
+    pool = ThreadPool(min(maxWorkers, len(argsList)))
+    try:
+        results = pool.map(lambda args: function(*args), argsList)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+class BackgroundCalls(object):
+    """
+    start function calls in a bounded pool of threads without waiting for them, to run
+    downloads and server queries whose results are only needed later, e.g.
+        with BackgroundCalls() as calls:
+            pending = calls.start(function, arg1, key=value)
+            ...
+            result = pending.get()
+    get() waits for the call and returns its return value, or re-raises its exception.
+    Calls whose results are not asked for are not waited for when leaving the with block.
+    """
+
+    def __init__(self, maxWorkers=MAX_CONCURRENT_CALLS):
+        self.maxWorkers = maxWorkers
+        self.pool = None
+
+    def start(self, function, *args, **kwargs):
+        """ call function(*args, **kwargs) in a thread of the pool, return its pending result """
+        if self.pool is None:
+            self.pool = ThreadPool(self.maxWorkers)
+        return self.pool.apply_async(function, args, kwargs)
+
+    def close(self):
+        """ let the threads of the pool exit after the calls already started """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
 def getRucioClientFromLFN(origClient, lfn, logger):
     """
     Get appropriate Rucio client with account parsing from LFN.
@@ -229,6 +229,9 @@ class SubCommand(ConfigCommand):
             self.name = self.__class__.__name__
 
         ConfigCommand.__init__(self)
+        # False when run by the crab command line, which only looks at 'commandStatus' in the returned
+        # dictionary: the commands can then leave out what is only there for the scripts using CRABAPI
+        self.returnDictUsed = True
         # The command logger.
         self.logger = logger
         self.logfile = self.logger.logfile
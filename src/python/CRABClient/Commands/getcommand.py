@@ -15,7 +15,7 @@ from CRABClient.Commands.remote_copy import remote_copy
 from CRABClient.Commands.SubCommand import SubCommand
 from CRABClient.ClientExceptions import ConfigurationException, RESTCommunicationException,\
     ClientException
-from CRABClient.ClientUtilities import validateJobids, colors
+from CRABClient.ClientUtilities import validateJobids, colors, logLines
 from CRABClient.UserUtilities import getMutedStatusInfo
 
 class getcommand(SubCommand):
@@ -112,22 +112,11 @@ class getcommand(SubCommand):
             if self.options.xroot:
                 self.logger.debug("XRootD urls are requested")
                 xrootlfn = ["root://cms-xrd-global.cern.ch/%s" % link['lfn'] for link in fileInfoList]
-                self.logger.info("\n".join(xrootlfn))
+                logLines(self.logger, xrootlfn)
                 returndict = {'xrootd': xrootlfn}
             elif self.options.dump:
                 jobid_pfn_lfn_list = sorted(map(lambda x: (x['jobid'], x['pfn'], x['lfn']), fileInfoList)) # pylint: disable=deprecated-lambda
-                lastjobid = -1
-                filecounter = 1
-                msg = ""
-                for jobid, pfn, lfn in jobid_pfn_lfn_list:
-                    if jobid != lastjobid:
-                        msg += "%s=== Files from job %s:" % ('\n' if lastjobid != -1 else '', jobid)
-                        lastjobid = jobid
-                        filecounter = 1
-                    msg += "\n%d) PFN: %s" % (filecounter, pfn)
-                    msg += "\n%s  LFN: %s" % (' '*(len(str(filecounter))), lfn)
-                    filecounter += 1
-                self.logger.info(msg)
+                logLines(self.logger, dumpLines(jobid_pfn_lfn_list))
                 returndict = {'pfn': [pfn for _, pfn, _ in jobid_pfn_lfn_list], 'lfn': [lfn for _, _, lfn in jobid_pfn_lfn_list]}
             else:
                 self.logger.info("Retrieving %s files" % (totalfiles))
@@ -307,3 +296,17 @@ class getcommand(SubCommand):
                 msg = "You specified to use %s checksum. Only lowercase yes/no is accepted to turn ADLER32 checksum" % self.options.checksum
                 ex = ConfigurationException(msg)
                 raise ex
+
+
+def dumpLines(jobid_pfn_lfn_list):
+    """ the lines printed by --dump for the sorted (jobid, pfn, lfn) of the files, grouped by job """
+    lastjobid = -1
+    filecounter = 1
+    for jobid, pfn, lfn in jobid_pfn_lfn_list:
+        if jobid != lastjobid:
+            yield "=== Files from job %s:" % jobid
+            lastjobid = jobid
+            filecounter = 1
+        yield "%d) PFN: %s" % (filecounter, pfn)
+        yield "%s  LFN: %s" % (' '*(len(str(filecounter))), lfn)
+        filecounter += 1
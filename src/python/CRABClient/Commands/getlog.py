@@ -2,7 +2,7 @@ from __future__ import print_function
 from __future__ import division
 
 from CRABClient.ClientUtilities import colors, validateJobids, getColumn
-from CRABClient.UserUtilities import curlGetFileFromURL
+from CRABClient.UserUtilities import getWebDirFetcher
 from CRABClient.Commands.getcommand import getcommand
 from CRABClient.ClientExceptions import RESTCommunicationException, MissingOptionException
 
@@ -92,6 +92,8 @@ class getlog(getcommand):
 
     def retrieveShortLogs(self, webdir, proxyfilename):
         self.logger.info("Retrieving...")
+        # the logs are small and all in the same webdir, read them over one kept open connection
+        fetcher = getWebDirFetcher(proxyfilename)
         success = []
         failed = []
         for _, jobid in self.options.jobids:
@@ -103,8 +105,14 @@ class getlog(getcommand):
             while succeded:
                 filename = 'job_out.%s.%s.txt' % (jobid, retry)
                 url = webdir + '/' + filename
-                httpCode = curlGetFileFromURL(url, self.dest + '/' + filename, proxyfilename, logger=self.logger)
+                try:
+                    httpCode, content, _ = fetcher.get(url, logger=self.logger)
+                except Exception as ex:  # pylint: disable=broad-except
+                    self.logger.debug("Failed to retrieve %s: %s", url, ex)
+                    httpCode = None
                 if httpCode == 200:
+                    with open(self.dest + '/' + filename, 'wb') as fd:
+                        fd.write(content)
                     self.logger.info('Retrieved %s' % (filename))
                     success.append(filename)
                     retry += 1  # To retrieve retried job log, if there is any.
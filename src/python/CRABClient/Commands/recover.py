@@ -24,14 +24,13 @@ from CRABClient.ClientExceptions import MissingOptionException, ConfigurationExc
 
 # step kill
 from CRABClient.Commands.kill import kill
-from CRABClient.UserUtilities import getUsername
+from CRABClient.UserUtilities import getUsername, getStatusInfo
 
 # step report
 from CRABClient.Commands.report import report
 from CRABClient.JobType.BasicJobType import BasicJobType
 
 # step status
-from CRABClient.Commands.status import status
 from CRABClient.ClientUtilities import LOGLEVEL_MUTE
 
 # step getsandbox
@@ -281,34 +280,13 @@ class recover(SubCommand):
         side effects: none
         """
 
-        cmdargs = []
-        cmdargs.append("-d")
-        cmdargs.append(str(self.crabProjDir))
-        if "instance" in self.options.__dict__.keys():
-            cmdargs.append("--instance")
-            cmdargs.append(self.options.__dict__["instance"])
-        if "proxy" in self.options.__dict__.keys():
-            cmdargs.append("--proxy")
-            cmdargs.append(self.options.__dict__["proxy"])
-        self.logger.debug("stepStatus() - status, cmdargs: %s", cmdargs)
-        statusCmd = status(logger=self.logger, cmdargs=cmdargs)
+        # the status information is kept by getStatusInfo, so that the report step
+        # later on does not need to compute it again
         self.logger.debug("stepStatus() - handlers %s", self.logger.handlers)
-
-        ## old
-        # handlerLevels = []
-        # for h in self.logger.handlers:
-        #     handlerLevels.append(h.level)
-        #     h.setLevel(LOGLEVEL_MUTE)
-        # retval = statusCmd()
-        # self.failingTaskStatus = retval
-        # for idx, h in enumerate(self.logger.handlers):
-        #     h.setLevel(handlerLevels[idx])
-        # self.logger.debug("stepStatus() - handlers %s", self.logger.handlers)
-        # self.logger.debug("stepStatus() - handlers %s", handlerLevels)
-
-        ## new
         with SilenceLogging(self.logger, "status") as _:
-            retval = statusCmd()
+            retval = getStatusInfo(logger=self.logger, projdir=str(self.crabProjDir),
+                                   proxy=self.options.__dict__.get("proxy"),
+                                   instance=self.options.__dict__.get("instance"))
         self.failingTaskStatus = retval
 
         self.logger.debug("stepStatus() - status, retval: %s", retval)
@@ -10,7 +10,9 @@
 from __future__ import print_function, division
 
 import os
+import gzip
 import json
+import time
 import tempfile
 import tarfile
 import shutil
@@ -24,13 +26,114 @@ except Exception:  # pylint: disable=broad-except
 
 from ServerUtilities import downloadFromS3
 
-from CRABClient.ClientUtilities import colors, execute_command
+from CRABClient.ClientUtilities import colors, execute_command, runInThreadPool
 from CRABClient.Commands.SubCommand import SubCommand
-from CRABClient.JobType.BasicJobType import BasicJobType
+from CRABClient.JobType.BasicJobType import BasicJobType, LumiRangeAccumulator, LumiOverlapFinder
 from CRABClient.UserUtilities import getMutedStatusInfo
 from CRABClient.ClientExceptions import (ConfigurationException,
                                          UnknownOptionException, CommandFailedException)
 
+def iterJSONArray(text):
+    """
+    iterate over the elements of a JSON array given as string (e.g. dasgoclient --json output)
+    decoding them one at a time, rather than building the full list of records first
+    """
+    decoder = json.JSONDecoder()
+    pos = text.index('[') + 1
+    end = len(text)
+    while pos < end:
+        while pos < end and text[pos] in ' \t\r\n,':
+            pos += 1
+        if pos >= end or text[pos] == ']':
+            return
+        obj, pos = decoder.raw_decode(text, pos)
+        yield obj
+
+
+class IncrementalJSONWriter(object):
+    """
+    Write a JSON object one key at a time, so that the full dictionary never needs
+    to be in memory. The file content is the same as from json.dump of the dictionary.
+    Data go to a temporary file which commit() renames to the final name and abort()
+    removes. No file is created if nothing was added.
+    With compress=True the object is written in compact form (no blanks) and gzipped,
+    and '.gz' is appended to the file name.
+    """
+
+    def __init__(self, filename, compress=False):
+        self.compress = compress
+        self.filename = filename + '.gz' if compress else filename
+        self.tmpFilename = "%s.tmp.%s" % (self.filename, os.getpid())
+        self.separators = (',', ':') if compress else (', ', ': ')
+        self.fd = None
+        self.count = 0
+        self.elapsed = 0.
+
+    def add(self, key, value):
+        """ write one key:value pair """
+        start = time.time()
+        if self.fd is None:
+            if self.compress:
+                self.fd = gzip.open(self.tmpFilename, 'wt')
+            else:
+                self.fd = open(self.tmpFilename, 'w')
+            self.fd.write('{')
+        else:
+            self.fd.write(self.separators[0])
+        self.fd.write(json.dumps(str(key)) + self.separators[1] + json.dumps(value, separators=self.separators))
+        self.count += 1
+        self.elapsed += time.time() - start
+
+    def commit(self):
+        """ complete the file and give it its final name """
+        if self.fd is None:
+            return
+        start = time.time()
+        self.fd.write('}\n')
+        self.fd.close()
+        self.fd = None
+        os.rename(self.tmpFilename, self.filename)
+        self.elapsed += time.time() - start
+
+    def abort(self):
+        """ drop what was written so far """
+        if self.fd is None:
+            return
+        self.fd.close()
+        self.fd = None
+        os.remove(self.tmpFilename)
+
+
+def writeJSONArtifacts(directory, artifacts, logger, maxWorkers=4):
+    """
+    Write each (filename, data) in the artifacts list as a JSON file in directory.
+    Files are written by a pool of threads, so that the slow parts (write, close and
+    rename on network file systems like AFS or EOS fuse) overlap. Each file is first
+    written to a temporary name and renamed when complete, so that a file with the
+    final name is never partial. The time spent on each file goes to the log file.
+    """
+    def writeArtifact(filename, data):
+        start = time.time()
+        path = os.path.join(directory, filename)
+        tmpPath = "%s.tmp.%s" % (path, os.getpid())
+        try:
+            with open(tmpPath, 'w') as jsonFile:
+                json.dump(data, jsonFile)
+                jsonFile.write("\n")
+            os.rename(tmpPath, path)
+        except Exception:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            raise
+        return filename, os.path.getsize(path), time.time() - start
+
+    start = time.time()
+    for filename, size, elapsed in runInThreadPool(writeArtifact, artifacts, maxWorkers):
+        logger.debug("Wrote %s (%d bytes) in %.3f seconds" % (filename, size, elapsed))
+    if artifacts:
+        logger.debug("Wrote %d report files in %.3f seconds" % (len(artifacts), time.time() - start))
+
+
 class report(SubCommand):
     """
     Important: the __call__ method is almost identical to the old report.
@@ -69,154 +172,6 @@ class report(SubCommand):
             msg += " but it is not compatible with automatic splitting"
             raise ConfigurationException(msg)
 
-        onlyDBSSummary = False
-        if not reportData['lumisToProcess'] or not reportData['processedRunsAndLumis']:
-            msg = "%sError%s:" % (colors.RED, colors.NORMAL)
-            msg += " Cannot get all the needed information for the report. Maybe no job has completed yet ?"
-            msg += "\n Notice, if your task has been submitted more than 30 days ago, then everything has been cleaned."
-            self.logger.info(msg)
-            if not reportData['publication']:
-                raise CommandFailedException(msg)
-            onlyDBSSummary = True
-
-        def _getNumFiles(jobs, fileType):
-            files = set()
-            for _, reports in jobs.items():
-                for rep in reports:
-                    if rep['type'] == fileType:
-                        # the split is done to remove the jobnumber at the end of the input file lfn
-                        files.add('_'.join(rep['lfn'].split('_')[:-1]))
-            return len(files)
-
-        def _getNumEvents(jobs, fileType):
-            numEvents = 0
-            for _, reports in jobs.items():
-                for rep in reports:
-                    if rep['type'] == fileType:
-                        numEvents += rep['events']
-            return numEvents
-
-        # Extract the reports of the input files.
-        poolInOnlyRes = {}
-        for jobid, reports in reportData['processedRunsAndLumis'].items():
-            poolInOnlyRes[jobid] = [rep for rep in reports if rep['type'] == 'POOLIN']
-
-        # Calculate how many input files have been processed.
-        numFilesProcessed = _getNumFiles(reportData['processedRunsAndLumis'], 'POOLIN')
-        returndict['numFilesProcessed'] = numFilesProcessed
-
-        # Calculate how many events have been read.
-        numEventsRead = _getNumEvents(reportData['processedRunsAndLumis'], 'POOLIN')
-        returndict['numEventsRead'] = numEventsRead
-
-        # Calculate how many events have been written.
-        numEventsWritten = {}
-        for filetype in ['EDM', 'TFile', 'FAKE']:
-            numEventsWritten[filetype] = _getNumEvents(reportData['processedRunsAndLumis'], filetype)
-        returndict['numEventsWritten'] = numEventsWritten
-
-        # Get the lumis in the input dataset.
-        returndict['inputDatasetLumis'] = reportData['inputDatasetLumis']
-
-        # Get the lumis split across files in the input dataset.
-        returndict['inputDatasetDuplicateLumis'] = reportData['inputDatasetDuplicateLumis']
-
-        # Get the lumis that the jobs had to process. This must be a subset of input
-        # dataset lumis & lumi-mask.
-        lumisToProcessPerJob = reportData['lumisToProcess']
-        lumisToProcess = {}
-        for jobid in lumisToProcessPerJob.keys():
-            for run, lumiRanges in lumisToProcessPerJob[jobid].items():
-                if run not in lumisToProcess:
-                    lumisToProcess[run] = []
-                for lumiRange in lumiRanges:
-                    lumisToProcess[run].extend(range(int(lumiRange[0]), int(lumiRange[1])+1))
-        lumisToProcess = LumiList(runsAndLumis=lumisToProcess).getCompactList()
-        returndict['lumisToProcess'] = lumisToProcess
-
-        # Get the lumis that have been processed.
-        processedLumis = BasicJobType.mergeLumis(poolInOnlyRes)
-        returndict['processedLumis'] = processedLumis
-
-
-
-        outputDatasetsLumis = {}
-        outputDatasetsNumEvents = {}
-        if reportData['publication']:
-            # Get the run-lumi and number of events information about the output datasets.
-            outputDatasetsInfo = reportData['outputDatasetsInfo']['outputDatasets']
-            for dataset in outputDatasetsInfo:
-                if outputDatasetsInfo[dataset]['lumis']:
-                    outputDatasetsLumis[dataset] = outputDatasetsInfo[dataset]['lumis']
-                outputDatasetsNumEvents[dataset] = outputDatasetsInfo[dataset]['numEvents']
-        returndict['outputDatasetsLumis'] = outputDatasetsLumis
-        returndict['outputDatasetsNumEvents'] = outputDatasetsNumEvents
-        numOutputDatasets = len(reportData['outputDatasetsInfo']) if 'outputDatasetsInfo' in reportData else 0
-
-
-        # Get the duplicate runs-lumis in the output files. Use for this the run-lumi
-        # information of the input files. Why not to use directly the output files?
-        # Because not all types of output files have run-lumi information in their
-        # filemetadata (note: the run-lumi information in the filemetadata is a copy
-        # of the corresponding information in the FJR). For example, output files
-        # produced by TFileService do not have run-lumi information in the FJR. On the
-        # other hand, input files always have run-lumi information in the FJR, which
-        # lists the runs-lumis in the input file that have been processed by the
-        # corresponding job. And of course, the run-lumi information of an output file
-        # produced by job X should be the (set made out of the) union of the run-lumi
-        # information of the input files to job X.
-        outputFilesLumis = {}
-        for jobid, reports in poolInOnlyRes.items():
-            if jobid.startswith('0-'):  # skip probe-jobs
-                continue
-            lumiDict = {}
-            for rep in reports:
-                for run, lumis in literal_eval(rep['runlumi']).items():
-                    lumiDict.setdefault(str(run), []).extend(map(int, lumis))
-            for run, lumis in lumiDict.items():
-                outputFilesLumis.setdefault(run, []).extend(list(set(lumis)))
-        outputFilesDuplicateLumis = BasicJobType.getDuplicateLumis(outputFilesLumis)
-        returndict['outputFilesDuplicateLumis'] = outputFilesDuplicateLumis
-
-        # Calculate the not processed runs-lumis in one of three ways:
-        # 1) The lumis that were supposed to be processed by all jobs minus the lumis
-        #    that were processed by finished (but not necessarily published) jobs.
-        # 2) The lumis that were supposed to be processed by all jobs minus the lumis
-        #    published in all the output datasets.
-        # 3) The lumis that were supposed to be processed by jobs whose status is
-        #    'failed'.
-        notProcessedLumis = {}
-        notProcLumisCalcMethMsg = "The '%s' lumis were calculated as:" % (self.options.recovery)
-        if self.options.recovery == 'notFinished':
-            notProcessedLumis = BasicJobType.subtractLumis(lumisToProcess, processedLumis)
-            notProcLumisCalcMethMsg += " the lumis to process minus the processed lumis."
-        elif self.options.recovery == 'notPublished':
-            publishedLumis = {}
-            firstdataset = True
-            for dataset in outputDatasetsLumis.keys():
-                if firstdataset:
-                    publishedLumis = outputDatasetsLumis[dataset]
-                    firstdataset = False
-                else:
-                    publishedLumis = BasicJobType.intersectLumis(publishedLumis, outputDatasetsLumis[dataset])
-            notProcessedLumis = BasicJobType.subtractLumis(lumisToProcess, publishedLumis)
-            notProcLumisCalcMethMsg += " the lumis to process"
-            if numOutputDatasets > 1:
-                notProcLumisCalcMethMsg += " minus the lumis published in all the output datasets."
-            else:
-                notProcLumisCalcMethMsg += " minus the lumis published in the output dataset."
-        elif self.options.recovery == 'failed':
-            for status, jobid in reportData['jobList']:
-                if status in ['failed']:
-                    for run, lumiRanges in lumisToProcessPerJob[jobid].items():
-                        if run not in notProcessedLumis:
-                            notProcessedLumis[run] = []
-                        for lumiRange in lumiRanges:
-                            notProcessedLumis[run].extend(range(lumiRange[0], lumiRange[1]+1))
-            notProcessedLumis = LumiList(runsAndLumis=notProcessedLumis).getCompactList()
-            notProcLumisCalcMethMsg += " the lumis to process by jobs in status 'failed'."
-        returndict['notProcessedLumis'] = notProcessedLumis
-
         # Create the output directory if it doesn't exists.
         if self.options.outdir:
             jsonFileDir = self.options.outdir
@@ -227,7 +182,130 @@ class report(SubCommand):
             self.logger.debug("Creating directory %s" % (jsonFileDir))
             os.makedirs(jsonFileDir)
 
-        # Create the report JSON files and print a report summary:
+        # Stream the per-job information through the report pipeline. The per-job file lists
+        # are written to temporary files while streaming, and only renamed to their final
+        # names once the report is known to succeed.
+        fileWriters = {}
+        for name in ['filesToProcess', 'processedFiles', 'failedFiles']:
+            fileWriters[name] = IncrementalJSONWriter(os.path.join(jsonFileDir, name + '.json'),
+                                                      compress=self.options.compress)
+        # Everything up to the final commit of the file lists is inside one try, so that a
+        # failure anywhere (or a report with nothing to write) leaves no temporary file behind.
+        try:
+            jobsData = self.processJobs(reportData, fileWriters)
+
+            onlyDBSSummary = False
+            if not jobsData['lumisToProcess'] or not jobsData['numFinishedJobs']:
+                msg = "%sError%s:" % (colors.RED, colors.NORMAL)
+                msg += " Cannot get all the needed information for the report. Maybe no job has completed yet ?"
+                msg += "\n Notice, if your task has been submitted more than 30 days ago, then everything has been cleaned."
+                self.logger.info(msg)
+                if not reportData['publication']:
+                    raise CommandFailedException(msg)
+                onlyDBSSummary = True
+
+            numFilesProcessed = jobsData['numFilesProcessed']
+            returndict['numFilesProcessed'] = numFilesProcessed
+            numEventsRead = jobsData['numEventsRead']
+            returndict['numEventsRead'] = numEventsRead
+            numEventsWritten = jobsData['numEventsWritten']
+            returndict['numEventsWritten'] = numEventsWritten
+
+            # Get the lumis in the input dataset.
+            returndict['inputDatasetLumis'] = reportData['inputDatasetLumis']
+
+            # Get the lumis split across files in the input dataset.
+            returndict['inputDatasetDuplicateLumis'] = reportData['inputDatasetDuplicateLumis']
+
+            # Get the lumis that the jobs had to process. This must be a subset of input
+            # dataset lumis & lumi-mask.
+            lumisToProcess = jobsData['lumisToProcess']
+            returndict['lumisToProcess'] = lumisToProcess
+
+            # Get the lumis that have been processed.
+            processedLumis = jobsData['processedLumis']
+            returndict['processedLumis'] = processedLumis
+
+            outputDatasetsLumis = {}
+            outputDatasetsNumEvents = {}
+            if reportData['publication']:
+                # Get the run-lumi and number of events information about the output datasets.
+                outputDatasetsInfo = reportData['outputDatasetsInfo']['outputDatasets']
+                for dataset in outputDatasetsInfo:
+                    if outputDatasetsInfo[dataset]['lumis']:
+                        outputDatasetsLumis[dataset] = outputDatasetsInfo[dataset]['lumis']
+                    outputDatasetsNumEvents[dataset] = outputDatasetsInfo[dataset]['numEvents']
+            returndict['outputDatasetsLumis'] = outputDatasetsLumis
+            returndict['outputDatasetsNumEvents'] = outputDatasetsNumEvents
+            numOutputDatasets = len(reportData['outputDatasetsInfo']) if 'outputDatasetsInfo' in reportData else 0
+
+            # Get the duplicate runs-lumis in the output files, computed in processJobs from the
+            # run-lumi information of the input files.
+            outputFilesDuplicateLumis = jobsData['outputFilesDuplicateLumis']
+            returndict['outputFilesDuplicateLumis'] = outputFilesDuplicateLumis
+
+            # Calculate the not processed runs-lumis in one of three ways:
+            # 1) The lumis that were supposed to be processed by all jobs minus the lumis
+            #    that were processed by finished (but not necessarily published) jobs.
+            # 2) The lumis that were supposed to be processed by all jobs minus the lumis
+            #    published in all the output datasets.
+            # 3) The lumis that were supposed to be processed by jobs whose status is
+            #    'failed'.
+            notProcessedLumis = {}
+            notProcLumisCalcMethMsg = "The '%s' lumis were calculated as:" % (self.options.recovery)
+            if self.options.recovery == 'notFinished':
+                notProcessedLumis = BasicJobType.subtractLumis(lumisToProcess, processedLumis)
+                notProcLumisCalcMethMsg += " the lumis to process minus the processed lumis."
+            elif self.options.recovery == 'notPublished':
+                publishedLumis = {}
+                firstdataset = True
+                for dataset in outputDatasetsLumis.keys():
+                    if firstdataset:
+                        publishedLumis = outputDatasetsLumis[dataset]
+                        firstdataset = False
+                    else:
+                        publishedLumis = BasicJobType.intersectLumis(publishedLumis, outputDatasetsLumis[dataset])
+                notProcessedLumis = BasicJobType.subtractLumis(lumisToProcess, publishedLumis)
+                notProcLumisCalcMethMsg += " the lumis to process"
+                if numOutputDatasets > 1:
+                    notProcLumisCalcMethMsg += " minus the lumis published in all the output datasets."
+                else:
+                    notProcLumisCalcMethMsg += " minus the lumis published in the output dataset."
+            elif self.options.recovery == 'failed':
+                notProcessedLumis = jobsData['failedLumisToProcess']
+                notProcLumisCalcMethMsg += " the lumis to process by jobs in status 'failed'."
+            returndict['notProcessedLumis'] = notProcessedLumis
+
+            # Write all the other report JSON files at once
+            artifacts = []
+            if not onlyDBSSummary:
+                if processedLumis:
+                    artifacts.append(('processedLumis.json', processedLumis))
+                if notProcessedLumis:
+                    artifacts.append((self.options.recovery + "Lumis.json", notProcessedLumis))
+                if outputFilesDuplicateLumis:
+                    artifacts.append(('outputFilesDuplicateLumis.json', outputFilesDuplicateLumis))
+            if reportData['publication'] and reportData['outputDatasets'] and outputDatasetsLumis:
+                artifacts.append(('outputDatasetsLumis.json', outputDatasetsLumis))
+            if reportData['inputDatasetLumis']:
+                artifacts.append(('inputDatasetLumis.json', reportData['inputDatasetLumis']))
+            if reportData['inputDatasetDuplicateLumis']:
+                artifacts.append(('inputDatasetDuplicateLumis.json', reportData['inputDatasetDuplicateLumis']))
+            if lumisToProcess:
+                artifacts.append(('lumisToProcess.json', lumisToProcess))
+            writeJSONArtifacts(jsonFileDir, artifacts, self.logger)
+
+            # The per-job file lists are complete, give them their final names
+            for writer in fileWriters.values():
+                writer.commit()
+                if writer.count:
+                    self.logger.debug("Wrote %s (%d jobs) in %.3f seconds" % (os.path.basename(writer.filename), writer.count, writer.elapsed))
+        except Exception:
+            for writer in fileWriters.values():
+                writer.abort()
+            raise
+
+        # Print a report summary, telling which report JSON files were written:
         # 1) First the summary that depends solely on successfully finished jobs (and
         #    other general information about the task, but not on failed/running jobs).
         if not onlyDBSSummary:
@@ -239,22 +317,13 @@ class report(SubCommand):
             msg += "\n  Number of events written in other type of files: %d" % (numEventsWritten.get('FAKE', 0))
             self.logger.info(msg)
             if processedLumis:
-                with open(os.path.join(jsonFileDir, 'processedLumis.json'), 'w') as jsonFile:
-                    json.dump(processedLumis, jsonFile)
-                    jsonFile.write("\n")
-                    self.logger.info("  Processed lumis written to processedLumis.json")
+                self.logger.info("  Processed lumis written to processedLumis.json")
             if notProcessedLumis:
                 filename = self.options.recovery + "Lumis.json"
-                with open(os.path.join(jsonFileDir, filename), 'w') as jsonFile:
-                    json.dump(notProcessedLumis, jsonFile)
-                    jsonFile.write("\n")
-                    self.logger.info("  %sWarning%s: '%s' lumis written to %s" % (colors.RED, colors.NORMAL, self.options.recovery, filename))
+                self.logger.info("  %sWarning%s: '%s' lumis written to %s" % (colors.RED, colors.NORMAL, self.options.recovery, filename))
                 self.logger.info("           %s" % (notProcLumisCalcMethMsg))
             if outputFilesDuplicateLumis:
-                with open(os.path.join(jsonFileDir, 'outputFilesDuplicateLumis.json'), 'w') as jsonFile:
-                    json.dump(outputFilesDuplicateLumis, jsonFile)
-                    jsonFile.write("\n")
-                    self.logger.info("  %sWarning%s: Duplicate lumis in output files written to outputFilesDuplicateLumis.json" % (colors.RED, colors.NORMAL))
+                self.logger.info("  %sWarning%s: Duplicate lumis in output files written to outputFilesDuplicateLumis.json" % (colors.RED, colors.NORMAL))
 
         # 2) Then the summary about output datasets in DBS. For this, publication must
         #    be True and the output files must be publishable.
@@ -268,46 +337,25 @@ class report(SubCommand):
                     msg += "\n    %s: %d" % (dataset, numEvents)
                 self.logger.info(msg)
             if outputDatasetsLumis:
-                with open(os.path.join(jsonFileDir, 'outputDatasetsLumis.json'), 'w') as jsonFile:
-                    json.dump(outputDatasetsLumis, jsonFile)
-                    jsonFile.write("\n")
-                    self.logger.info("  Output datasets lumis written to outputDatasetsLumis.json")
-
-        # 3) Then the file summaries
-        if reportData['filesToProcess']:
-            with open(os.path.join(jsonFileDir, 'filesToProcess.json'), 'w') as jsonFile:
-                json.dump(reportData['filesToProcess'], jsonFile)
-                jsonFile.write("\n")
-                self.logger.info("  Files to process written to filesToProcess.json")
-        if reportData['processedFiles']:
-            with open(os.path.join(jsonFileDir, 'processedFiles.json'), 'w') as jsonFile:
-                json.dump(reportData['processedFiles'], jsonFile)
-                jsonFile.write("\n")
-                self.logger.info("  Files processed by successful jobs written to processedFiles.json")
-        if reportData['failedFiles']:
-            with open(os.path.join(jsonFileDir, 'failedFiles.json'), 'w') as jsonFile:
-                json.dump(reportData['failedFiles'], jsonFile)
-                jsonFile.write("\n")
-                self.logger.info("  Files processed by failed jobs written to failedFiles.json")
+                self.logger.info("  Output datasets lumis written to outputDatasetsLumis.json")
+
+        # 3) Then the file summaries, already written while streaming the jobs
+        if fileWriters['filesToProcess'].count:
+            self.logger.info("  Files to process written to %s" % os.path.basename(fileWriters['filesToProcess'].filename))
+        if fileWriters['processedFiles'].count:
+            self.logger.info("  Files processed by successful jobs written to %s" % os.path.basename(fileWriters['processedFiles'].filename))
+        if fileWriters['failedFiles'].count:
+            self.logger.info("  Files processed by failed jobs written to %s" % os.path.basename(fileWriters['failedFiles'].filename))
 
         # 4) Finally additional files that can be useful for debugging.
         if reportData['inputDatasetLumis'] or reportData['inputDatasetDuplicateLumis'] or lumisToProcess:
             self.logger.info("Additional report lumi files:")
         if reportData['inputDatasetLumis']:
-            with open(os.path.join(jsonFileDir, 'inputDatasetLumis.json'), 'w') as jsonFile:
-                json.dump(reportData['inputDatasetLumis'], jsonFile)
-                jsonFile.write("\n")
-                self.logger.info("  Input dataset lumis (from DBS, at task submission time) written to inputDatasetLumis.json")
+            self.logger.info("  Input dataset lumis (from DBS, at task submission time) written to inputDatasetLumis.json")
         if reportData['inputDatasetDuplicateLumis']:
-            with open(os.path.join(jsonFileDir, 'inputDatasetDuplicateLumis.json'), 'w') as jsonFile:
-                json.dump(reportData['inputDatasetDuplicateLumis'], jsonFile)
-                jsonFile.write("\n")
-                self.logger.info("  Input dataset duplicate lumis (from DBS, at task submission time) written to inputDatasetDuplicateLumis.json")
+            self.logger.info("  Input dataset duplicate lumis (from DBS, at task submission time) written to inputDatasetDuplicateLumis.json")
         if lumisToProcess:
-            with open(os.path.join(jsonFileDir, 'lumisToProcess.json'), 'w') as jsonFile:
-                json.dump(lumisToProcess, jsonFile)
-                jsonFile.write("\n")
-                self.logger.info("  Lumis to process written to lumisToProcess.json")
+            self.logger.info("  Lumis to process written to lumisToProcess.json")
 
         # all methods called before raise if something goes wrong. Getting here means success
         returndict['commandStatus'] = 'SUCCESS'
@@ -316,6 +364,7 @@ class report(SubCommand):
     def collectReportData(self):
         """
         Gather information from the server, status2, DBS and files in S3 that is needed for the report.
+        Per-job information is not processed here, but streamed later by processJobs
         """
         reportData = {}
 
@@ -325,7 +374,11 @@ class report(SubCommand):
 
         # Query server for information from the taskdb, intput/output file metadata from metadatadb
         dictresult, status, _ = server.get(api=self.defaultApi, data={'workflow': self.cachedinfo['RequestName'], 'subresource': 'report2'})
-        self.logger.debug("Result: %s" % dictresult)
+        self.logger.debug("Result: report2 information for %d jobs" % len(dictresult['result'][0]['runsAndLumis'] or {}))
+        # keep only what is needed, the per-job records are consumed (and released) by processJobs
+        reportData['runsAndLumis'] = dictresult['result'][0]['runsAndLumis'] or {}
+        reportData['outputDatasets'] = dictresult['result'][0]['taskDBInfo']['outputDatasets']
+        del dictresult
 
         # query more info about task from taskdb
         output, status, _ =  server.get(api='task', data={'workflow': self.cachedinfo['RequestName'], 'subresource': 'status'})
@@ -340,44 +393,21 @@ class report(SubCommand):
             # Can happen when the task is very new / old and the files necessary for status2
             # are unavailable.
             return None
-        reportData['jobList'] = [(s, j) for (s, j) in statusDict['jobList'] if not j.startswith('0-')]
-
-        reportData['processedRunsAndLumis'] = {}
-        reportData['processedFiles'] = {}
-        reportData['failedFiles'] = {}
 
         # Transform status joblist (tuples of job status and job id) into a dictionary
-        jobStatusDict = {}
-        for status, jobId in reportData['jobList']:
-            jobStatusDict[jobId] = status
-
-        # Filter output/input file metadata by finished job state
-        if dictresult['result'][0]['runsAndLumis']:
-            for jobId in jobStatusDict:
-                if jobStatusDict.get(jobId) in ['finished']:
-                    reportData['processedRunsAndLumis'][jobId] = dictresult['result'][0]['runsAndLumis'][jobId]
+        # of all jobs, probe jobs are ignored when processing the jobs
+        reportData['jobStatus'] = dict((j, s) for (s, j) in statusDict['jobList'])
 
         reportData['publication'] = statusDict['publicationEnabled']
-        jobs = [j for (s, j) in statusDict['jobList']]
 
         # download needed files from S3 tarball an place them in result directory
         self.downloadInputFiles(taskname=self.cachedinfo['RequestName'])
 
-        # extract information about what needed to be processed
-
-        (reportData['lumisToProcess'], reportData['filesToProcess'] ) = self.getFilesAndLumisToProcess(jobs)
         reportData['inputDataset'] = statusDict['inputDataset']
 
-        for jobId in jobStatusDict:
-            if jobStatusDict[jobId] == 'finished':
-                reportData['processedFiles'][jobId] =reportData['filesToProcess'][jobId]
-            if jobStatusDict[jobId] == 'failed':
-                reportData['failedFiles'][jobId] = reportData['filesToProcess'][jobId]
-
         inputDatasetInfo = self.getInputDatasetLumis(reportData['inputDataset'])
         reportData['inputDatasetLumis'] = inputDatasetInfo['lumis']
         reportData['inputDatasetDuplicateLumis'] = inputDatasetInfo['duplicateLumis']
-        reportData['outputDatasets'] = dictresult['result'][0]['taskDBInfo']['outputDatasets']
 
         if reportData['publication']:
             repDGO = self.getDBSPublicationInfo_viaDasGoclient(reportData['outputDatasets'])
@@ -385,6 +415,95 @@ class report(SubCommand):
 
         return reportData
 
+    def processJobs(self, reportData, fileWriters):
+        """
+        Stream the per-job information through the report pipeline:
+          - the FJR reports of finished jobs are filtered out of reportData['runsAndLumis'],
+            which is emptied in the process, their POOLIN lumis are folded into lumi ranges
+          - the lumis to process by each job are read from run_and_lumis.tar.gz and folded
+            into lumi ranges
+          - the files to process by each job are read from input_files.tar.gz and written
+            to the fileWriters (filesToProcess, processedFiles, failedFiles) as they come
+        Only accumulators are kept in memory, not the per-job records.
+        Returns a dictionary with the counters and the compact lumi lists.
+        """
+        jobStatus = reportData['jobStatus']
+
+        numFinishedJobs = 0
+        inputFiles = set()
+        numEventsRead = 0
+        numEventsWritten = {'EDM': 0, 'TFile': 0, 'FAKE': 0}
+        processedLumis = LumiRangeAccumulator()
+        outputFilesLumis = LumiOverlapFinder()
+        for jobid, reports in self.iterFinishedJobReports(reportData['runsAndLumis'], jobStatus):
+            numFinishedJobs += 1
+            jobLumis = LumiRangeAccumulator()
+            for rep in reports:
+                if rep['type'] in numEventsWritten:
+                    numEventsWritten[rep['type']] += rep['events']
+                if rep['type'] != 'POOLIN':
+                    continue
+                # the split is done to remove the jobnumber at the end of the input file lfn
+                inputFiles.add('_'.join(rep['lfn'].split('_')[:-1]))
+                numEventsRead += rep['events']
+                for run, lumis in literal_eval(rep['runlumi']).items():
+                    if isinstance(run, bytes):
+                        run = run.decode(encoding='UTF-8')
+                    processedLumis.addLumis(run, lumis)
+                    jobLumis.addLumis(run, lumis)
+            # Get the duplicate runs-lumis in the output files. Use for this the run-lumi
+            # information of the input files. Why not to use directly the output files?
+            # Because not all types of output files have run-lumi information in their
+            # filemetadata (note: the run-lumi information in the filemetadata is a copy
+            # of the corresponding information in the FJR). For example, output files
+            # produced by TFileService do not have run-lumi information in the FJR. On the
+            # other hand, input files always have run-lumi information in the FJR, which
+            # lists the runs-lumis in the input file that have been processed by the
+            # corresponding job. And of course, the run-lumi information of an output file
+            # produced by job X should be the (set made out of the) union of the run-lumi
+            # information of the input files to job X.
+            outputFilesLumis.addCompactList(jobLumis.getCompactList())
+
+        lumisToProcess = LumiRangeAccumulator()
+        failedLumisToProcess = LumiRangeAccumulator()
+        for jobid, jobLumis in self.iterJobLumisToProcess(jobStatus):
+            lumisToProcess.addCompactList(jobLumis)
+            if jobStatus[jobid] == 'failed' and not jobid.startswith('0-'):
+                failedLumisToProcess.addCompactList(jobLumis)
+
+        for jobid, jobFiles in self.iterJobFilesToProcess(jobStatus):
+            fileWriters['filesToProcess'].add(jobid, jobFiles)
+            if jobid.startswith('0-'):
+                continue
+            if jobStatus[jobid] == 'finished':
+                fileWriters['processedFiles'].add(jobid, jobFiles)
+            if jobStatus[jobid] == 'failed':
+                fileWriters['failedFiles'].add(jobid, jobFiles)
+
+        jobsData = {}
+        jobsData['numFinishedJobs'] = numFinishedJobs
+        jobsData['numFilesProcessed'] = len(inputFiles)
+        jobsData['numEventsRead'] = numEventsRead
+        jobsData['numEventsWritten'] = numEventsWritten
+        jobsData['processedLumis'] = processedLumis.getCompactList()
+        jobsData['outputFilesDuplicateLumis'] = outputFilesLumis.getCompactList()
+        jobsData['lumisToProcess'] = lumisToProcess.getCompactList()
+        jobsData['failedLumisToProcess'] = failedLumisToProcess.getCompactList()
+        return jobsData
+
+    @staticmethod
+    def iterFinishedJobReports(runsAndLumis, jobStatus):
+        """
+        yield (jobid, reports) for the finished (non probe) jobs, removing every job
+        from runsAndLumis as it goes, so that memory is released while streaming
+        """
+        for jobid in list(runsAndLumis.keys()):
+            reports = runsAndLumis.pop(jobid)
+            if jobid.startswith('0-'):  # skip probe-jobs
+                continue
+            if jobStatus.get(jobid) == 'finished':
+                yield jobid, reports
+
     def downloadInputFiles(self, taskname):
         """
         pulls big tarball from S3 into /tmp and extract in "/results" the files which we need
@@ -424,64 +543,62 @@ class report(SubCommand):
                 fd.write('{}')
         shutil.rmtree(tmpDir)
 
-    def getFilesAndLumisToProcess(self, jobs):
+    def iterTarballJobFiles(self, tarFilename, filePattern, jobids):
         """
-        What each job was requested to process
-        Get the lumis and files to process by each job in the workflow.
-        Returns two dictionaries
-           {'jobid': {'run':[list of lumi ranges],... } e.g. {"1": [[419, 419]]}
-           {'jobid': ['file',...,'file'], ...}
+        yield (jobid, file object) for the files in the tarball whose names match
+        filePattern % jobid, for jobid in jobids. The tarball is read sequentially once,
+        rather than looking each job file up by name
         """
-        lumis = {}
-        files = {}
-
-
-        tarFilename = os.path.join(self.resultsDir, 'run_and_lumis.tar.gz')
-        with tarfile.open(tarFilename) as tarball:
-            for jobid in jobs:
-                filename = "job_lumis_%s.json" % (jobid)
-                try:
-                    member = tarball.getmember(filename)
-                except KeyError:
-                    self.logger.warning("File %s not found in run_and_lumis.tar.gz" % filename)
-                else:
+        wanted = dict((filePattern % jobid, jobid) for jobid in jobids)
+        with tarfile.open(tarFilename, mode='r:*') as tarball:
+            member = tarball.next()
+            while member is not None:
+                jobid = wanted.pop(member.name, None)
+                if jobid is not None:
                     fd = tarball.extractfile(member)
                     try:
-                        lumis[str(jobid)] = json.load(fd)
+                        yield jobid, fd
                     finally:
                         fd.close()
+                # do not let tarfile keep the list of all members seen so far
+                tarball.members = []
+                member = tarball.next()
+        for filename in sorted(wanted):
+            self.logger.warning("File %s not found in %s" % (filename, os.path.basename(tarFilename)))
 
-        tarFilename = os.path.join(self.resultsDir, 'input_files.tar.gz')
-        with tarfile.open(tarFilename) as tarball:
-            for jobid in jobs:
-                filename = "job_input_file_list_%s.txt" % (jobid)
-                try:
-                    member = tarball.getmember(filename)
-                except KeyError:
-                    self.logger.warning("File %s not found in input_files.tar.gz" % filename)
-                else:
-                    fd = tarball.extractfile(member)
-                    try:
-                        jobFiles = json.load(fd)
-                        # inputFile can have three formats depending on wether secondary input files are used:
-                        # 1. a single LFN as a string : "/store/.....root"
-                        # 2. a list of LFNs : ["/store/.....root", "/store/....root", ...]
-                        # 3. a list of dictionaries (one per file) with keys: 'lfn' and 'parents'
-                        #   value for 'lfn' is a string, value for 'parents' is a list of {'lfn':lfn} dictionaries
-                        #   [{'lfn':inputlfn, 'parents':[{'lfn':parentlfn1},{'lfn':parentlfn2}], ....]},...]
-                        if isinstance(jobFiles, str):
-                            files[str(jobid)] = [jobFiles]
-                        if isinstance(jobFiles, list):
-                            files[str(jobid)] = []
-                            for f in jobFiles:
-                                if isinstance(f, str):
-                                    files[str(jobid)].append(f)
-                                if isinstance(f, dict):
-                                    files[str(jobid)].append(f['lfn'])
-                    finally:
-                        fd.close()
+    def iterJobLumisToProcess(self, jobids):
+        """
+        What each job was requested to process
+        yield (jobid, lumis) with lumis in the form {'run':[list of lumi ranges],... } e.g. {"1": [[419, 419]]}
+        """
+        tarFilename = os.path.join(self.resultsDir, 'run_and_lumis.tar.gz')
+        for jobid, fd in self.iterTarballJobFiles(tarFilename, "job_lumis_%s.json", jobids):
+            yield str(jobid), json.load(fd)
 
-        return lumis, files
+    def iterJobFilesToProcess(self, jobids):
+        """
+        What each job was requested to process
+        yield (jobid, ['file',...,'file'])
+        """
+        tarFilename = os.path.join(self.resultsDir, 'input_files.tar.gz')
+        for jobid, fd in self.iterTarballJobFiles(tarFilename, "job_input_file_list_%s.txt", jobids):
+            jobFiles = json.load(fd)
+            # inputFile can have three formats depending on wether secondary input files are used:
+            # 1. a single LFN as a string : "/store/.....root"
+            # 2. a list of LFNs : ["/store/.....root", "/store/....root", ...]
+            # 3. a list of dictionaries (one per file) with keys: 'lfn' and 'parents'
+            #   value for 'lfn' is a string, value for 'parents' is a list of {'lfn':lfn} dictionaries
+            #   [{'lfn':inputlfn, 'parents':[{'lfn':parentlfn1},{'lfn':parentlfn2}], ....]},...]
+            files = []
+            if isinstance(jobFiles, str):
+                files = [jobFiles]
+            if isinstance(jobFiles, list):
+                for f in jobFiles:
+                    if isinstance(f, str):
+                        files.append(f)
+                    if isinstance(f, dict):
+                        files.append(f['lfn'])
+            yield str(jobid), files
 
     def getInputDatasetLumis(self, inputDataset):
         """
@@ -508,36 +625,12 @@ class report(SubCommand):
         """
         reimplemenation of getDBSPublicationInfo with dasgoclient. Remove dependencey from DBS
         Get the lumis and number of events in the published output datasets.
+        The run,lumi and summary queries for all datasets are run concurrently
         """
-        res = {}
-        res['outputDatasets'] = {}
-        for outputDataset in outputDatasets:
-            res['outputDatasets'][outputDataset] = {'lumis': {}, 'numEvents': 0}
-            dbsInstance = "instance=prod/phys03"
-            query = "'run,lumi dataset=%s %s'" % (outputDataset, dbsInstance)
-            dasgo = "dasgoclient --query " + query + " --json"
+        dbsInstance = "instance=prod/phys03"
 
-            runlumilist = {}
-            stdout, stderr, returncode = execute_command(command=dasgo, logger=self.logger)
-            if returncode or not stdout:
-                self.logger.error('Failed running command %s. Exitcode is %s' % (dasgo, returncode))
-                if stdout:
-                    self.logger.error('  Stdout:\n    %s' % str(stdout).replace('\n', '\n    '))
-                if stderr:
-                    self.logger.error('  Stderr:\n    %s' % str(stderr).replace('\n', '\n    '))
-            else:
-                result = json.loads(stdout)
-                for record in result:
-                    run = record['run'][0]['run_number']
-                    lumis = record['lumi'][0]['number']
-                    runlumilist.setdefault(str(run), []).extend(lumis)
-
-            # convert to a LumiList object
-            outputDatasetLumis = LumiList(runsAndLumis=runlumilist).getCompactList()
-            res['outputDatasets'][outputDataset]['lumis'] = outputDatasetLumis
-
-            # get total events in dataset
-            query = "'summary dataset=%s %s'" % (outputDataset, dbsInstance)
+        def runDasgoclient(outputDataset, queryType):
+            query = "'%s dataset=%s %s'" % (queryType, outputDataset, dbsInstance)
             dasgo = "dasgoclient --query " + query + " --json"
             stdout, stderr, returncode = execute_command(command=dasgo, logger=self.logger)
             if returncode or not stdout:
@@ -546,14 +639,36 @@ class report(SubCommand):
                     self.logger.error('  Stdout:\n    %s' % str(stdout).replace('\n', '\n    '))
                 if stderr:
                     self.logger.error('  Stderr:\n    %s' % str(stderr).replace('\n', '\n    '))
-                total_events = 0
+                return None
+            return stdout
+
+        queries = []
+        for outputDataset in outputDatasets:
+            queries.append((outputDataset, 'run,lumi'))
+            queries.append((outputDataset, 'summary'))
+        outputs = runInThreadPool(runDasgoclient, queries)
+
+        res = {}
+        res['outputDatasets'] = {}
+        for (outputDataset, queryType), stdout in zip(queries, outputs):
+            datasetInfo = res['outputDatasets'].setdefault(outputDataset, {'lumis': {}, 'numEvents': 0})
+            if queryType == 'run,lumi':
+                # fold each record into lumi ranges as soon as it is decoded
+                runlumis = LumiRangeAccumulator()
+                if stdout:
+                    for record in iterJSONArray(stdout):
+                        run = record['run'][0]['run_number']
+                        lumis = record['lumi'][0]['number']
+                        runlumis.addLumis(run, lumis)
+                datasetInfo['lumis'] = runlumis.getCompactList()
             else:
-                result = json.loads(stdout)
-                if result:
-                    total_events = result[0]['summary'][0]['nevents']
-                else:
-                    total_events = 0
-            res['outputDatasets'][outputDataset]['numEvents'] = total_events
+                # get total events in dataset
+                total_events = 0
+                if stdout:
+                    result = json.loads(stdout)
+                    if result:
+                        total_events = result[0]['summary'][0]['nevents']
+                datasetInfo['numEvents'] = total_events
 
         return res
 
@@ -575,6 +690,13 @@ class report(SubCommand):
                                help="Strategy to calculate not processed lumis: notFinished," + \
                                       " notPublished or failed [default: %default].")
 
+        self.parser.add_option("--compress",
+                               dest="compress",
+                               default=False,
+                               action="store_true",
+                               help="Write the per-job file lists (filesToProcess, processedFiles, failedFiles)" + \
+                                      " as compact gzipped JSON (.json.gz).")
+
         self.parser.add_option("--dbs",
                                dest="usedbs",
                                default=None,
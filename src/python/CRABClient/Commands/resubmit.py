@@ -2,6 +2,8 @@ from __future__ import print_function, division
 
 import re
 import sys
+import math
+from ast import literal_eval
 if sys.version_info >= (3, 0):
     from urllib.parse import urlencode, quote  # pylint: disable=E0611
 if sys.version_info < (3, 0):
@@ -10,8 +12,30 @@ if sys.version_info < (3, 0):
 ## CRAB dependencies.
 from CRABClient.Commands.SubCommand import SubCommand
 from CRABClient.ClientExceptions import ConfigurationException
+from CRABClient.ClientMapping import parametersMapping
 from CRABClient.UserUtilities import getMutedStatusInfo, getColumn
 from CRABClient.ClientUtilities import validateJobids, colors
+from CRABClient.StatusCacheTable import StatusCacheTable
+from CRABClient.Commands.status import analyzeSites, percentile, SITE_FAILED_STATES, to_hms
+
+## crab resubmit --auto-tune: the requested memory and runtime are this percentile of the
+## runs of the task plus a margin, rounded up. Jobs which failed for too much memory (50660)
+## or runtime (50664) get the current value times AUTOTUNE_GROWTH if that is more.
+AUTOTUNE_PERCENTILE = 0.99
+AUTOTUNE_MARGIN = 1.2
+AUTOTUNE_GROWTH = 1.5
+AUTOTUNE_MEMORY_STEP = 100  # MB
+AUTOTUNE_RUNTIME_STEP = 30  # minutes
+MEMORY_EXIT_CODE = 50660
+RUNTIME_EXIT_CODE = 50664
+## limits of --maxmemory (MB) and --maxjobruntime (minutes)
+MAXMEMORY_RANGE = (30, 1024*30)
+MAXJOBRUNTIME_RANGE = (60, 336*60)
+## sites with at least this many ended runs are blacklisted if this fraction of them failed,
+## or if their median wall time is this many times the median of all sites
+AUTOTUNE_MIN_SITE_RUNS = 10
+AUTOTUNE_MAX_FAILURE_RATE = 0.5
+AUTOTUNE_SLOW_FACTOR = 2.0
 
 class resubmit(SubCommand):
     """
@@ -26,6 +50,11 @@ class resubmit(SubCommand):
         self.jobids        = None
         self.sitewhitelist = None
         self.siteblacklist = None
+        ## Parameters of the task, set in validateOptions(), used by --auto-tune.
+        self.maxMemory = None
+        self.maxJobRuntime = None
+        self.numCores = None
+        self.taskSiteBlacklist = None
 
         SubCommand.__init__(self, logger, cmdargs)
 
@@ -64,6 +93,11 @@ class resubmit(SubCommand):
 
         self.jobids = self.processJobIds(jobList)
 
+        if self.options.autoTune:
+            tuning = self.autoTune(statusDict['jobs'])
+            if not self.options.apply:
+                return {'status': 'SUCCESS', 'commandStatus': 'SUCCESS', 'autoTune': tuning}
+
         configreq = self.getQueryParams()
         self.logger.info("Sending resubmit request to the server.")
         self.logger.debug("Submitting %s " % str(configreq))
@@ -85,6 +119,41 @@ class resubmit(SubCommand):
 
         return returndict
 
+    def autoTune(self, jobs):
+        """
+        Print the maxmemory, maxjobruntime and siteblacklist recommended by recommendResubmitParameters
+        for the jobs to resubmit, and use them unless the user gave these options.
+        jobs is the {jobid: info} job table returned by crab status.
+        """
+        table = StatusCacheTable(jobs)
+        tuning = recommendResubmitParameters(table, self.jobids, self.maxMemory, self.maxJobRuntime, self.numCores,
+                                             self.taskSiteBlacklist)
+        lines = ["Recommended parameters to resubmit %d jobs, from the %d runs of the jobs of the task:" %
+                 (len(self.jobids), tuning['numRuns'])]
+        for option, reason in tuning['reasons']:
+            value = tuning[option]
+            lines.append("  --%s=%s\n      %s" % (option, ",".join(value) if isinstance(value, list) else value, reason))
+        if not tuning['reasons']:
+            lines.append("  none, the current parameters of the task fit its jobs")
+        for option in ['maxmemory', 'maxjobruntime', 'siteblacklist']:
+            if tuning[option] is None:
+                continue
+            if option == 'siteblacklist':
+                if self.options.siteblacklist is None:
+                    self.siteblacklist = tuning[option]
+                else:
+                    lines.append("  --siteblacklist is given, the recommended one is not used")
+            elif getattr(self.options, option) is None:
+                setattr(self.options, option, tuning[option])
+            else:
+                lines.append("  --%s is given, the recommended value is not used" % option)
+        if tuning['siteblacklist'] is not None and self.taskSiteBlacklist is None:
+            lines.append("  the site blacklist of the task could not be read, the recommended one replaces it")
+        if not self.options.apply:
+            lines.append("This is a dry run, no job was resubmitted. Add --apply to resubmit with these parameters.")
+        self.logger.info("\n".join(lines))
+        return tuning
+
     ## TODO: This method is shared with submit. Put it in a common place.
     def _encodeRequest(self, configreq):
         """
@@ -236,6 +305,21 @@ class resubmit(SubCommand):
                                action='store_true',
                                help="Resubmit only the failed publications (no jobs).")
 
+        self.parser.add_option('--auto-tune',
+                               dest='autoTune',
+                               default=False,
+                               action='store_true',
+                               help="Print the maxmemory, maxjobruntime and siteblacklist recommended for the jobs" + \
+                                      " to resubmit, from the memory, runtime and failures of the jobs on each site." + \
+                                      " Nothing is resubmitted unless --apply is given as well.")
+
+        self.parser.add_option('--apply',
+                               dest='apply',
+                               default=False,
+                               action='store_true',
+                               help="With --auto-tune, resubmit the jobs with the recommended parameters." + \
+                                      " Parameters given with their own option are used instead of the recommended ones.")
+
 
     def validateOptions(self):
         """
@@ -246,6 +330,16 @@ class resubmit(SubCommand):
 
         crabDBInfo, _, _ = self.crabserver.get(api='task', data={'subresource': 'search', 'workflow': self.cachedinfo['RequestName']})
         self.splitting = getColumn(crabDBInfo, 'tm_split_algo')
+        if self.options.autoTune:
+            self.maxMemory = getTaskParameter(crabDBInfo, 'tm_maxmemory', 'maxmemory')
+            self.maxJobRuntime = getTaskParameter(crabDBInfo, 'tm_maxjobruntime', 'maxjobruntime')
+            self.numCores = getTaskParameter(crabDBInfo, 'tm_numcores', 'numcores')
+            self.taskSiteBlacklist = getTaskSiteBlacklist(crabDBInfo)
+
+        if self.options.apply and not self.options.autoTune:
+            raise ConfigurationException("The option --apply can only be used together with the option --auto-tune.")
+        if self.options.autoTune and self.options.publication:
+            raise ConfigurationException("The option --auto-tune can not be used together with the option --publication.")
 
         if self.options.publication:
             if self.options.sitewhitelist is not None or self.options.siteblacklist is not None or \
@@ -324,3 +418,113 @@ class resubmit(SubCommand):
             if self.options.priority < 1:
                 msg = "The requested priority (%d) must be greater than 0." % (self.options.priority)
                 raise ConfigurationException(msg)
+
+
+def getTaskSiteBlacklist(crabDBInfo):
+    """ the site blacklist of the task, None if it can not be read """
+    try:
+        blacklist = getColumn(crabDBInfo, 'tm_site_blacklist')
+    except ValueError:
+        return None
+    if not blacklist:
+        return []
+    try:
+        blacklist = literal_eval(blacklist)
+    except (ValueError, SyntaxError):
+        blacklist = blacklist.split(',')
+    return [str(site) for site in blacklist] if isinstance(blacklist, (list, tuple)) else None
+
+
+def getTaskParameter(crabDBInfo, column, parameter):
+    """ the integer value of column in the task information, the default of parameter
+        (e.g. 'maxmemory') if it is missing or not set
+    """
+    try:
+        return int(getColumn(crabDBInfo, column))
+    except (TypeError, ValueError):
+        return parametersMapping['on-server'][parameter]['default']
+
+
+def roundUp(value, step, limits):
+    """ value rounded up to a multiple of step, within the (min, max) limits """
+    return int(min(max(math.ceil(value / step) * step, limits[0]), limits[1]))
+
+
+def recommendResubmitParameters(table, jobids, maxMemory, maxJobRuntime, numCores=1, taskSiteBlacklist=None):
+    """
+    Recommend resubmission parameters for the jobs jobids from the runs (retries included) of
+    the jobs of the task in the StatusCacheTable table, with the current maxMemory (MB) and
+    maxJobRuntime (minutes) of the task:
+        maxmemory, maxjobruntime: AUTOTUNE_PERCENTILE of the memory and wall time of the runs plus
+            AUTOTUNE_MARGIN, or more if jobs to resubmit failed because of too much memory or runtime
+        siteblacklist: taskSiteBlacklist plus the sites where many runs failed or which are slow
+    Returns a dictionary with these keys, None where the value of the task should be kept,
+    reasons: [(option, why)] for each recommended value, and numRuns: the runs looked at.
+    """
+    memories = []
+    walls = []
+    for i, site in enumerate(table.sites):
+        if site >= 0 and table.stateNames[table.states[i]] in SITE_FAILED_STATES + ['finished', 'transferring']:
+            if table.rss[i] >= 0:
+                memories.append(table.rss[i] / 1024.)
+            if table.walls[i] >= 0:
+                walls.append(table.walls[i])
+    memories.extend(rss / 1024. for rss in table.prevRss if rss >= 0)
+    walls.extend(wall for wall in table.prevWalls if wall >= 0)
+    memories.sort()
+    walls.sort()
+    exitCodes = set()
+    for jobid in jobids:
+        error = table.errors[table.index[jobid]] if jobid in table else -1
+        if error >= 0:
+            exitCodes.add(table.errorValues[error][0])
+
+    tuning = {'maxmemory': None, 'maxjobruntime': None, 'siteblacklist': None, 'reasons': [],
+              'numRuns': max(len(memories), len(walls))}
+    value = None
+    memory = percentile(memories, AUTOTUNE_PERCENTILE)
+    if MEMORY_EXIT_CODE in exitCodes:
+        value = roundUp(max(memory or 0, maxMemory * AUTOTUNE_GROWTH), AUTOTUNE_MEMORY_STEP, MAXMEMORY_RANGE)
+        reason = "jobs to resubmit used too much memory (exit code %d), the task requested %d MB" % \
+                 (MEMORY_EXIT_CODE, maxMemory)
+    elif memory is not None:
+        value = roundUp(memory * AUTOTUNE_MARGIN, AUTOTUNE_MEMORY_STEP, MAXMEMORY_RANGE)
+        reason = "%.0f%% of the runs used less than %.0f MB, the task requested %d MB" % \
+                 (AUTOTUNE_PERCENTILE * 100, memory, maxMemory)
+    if value is not None and value != maxMemory:
+        tuning['maxmemory'] = value
+        tuning['reasons'].append(('maxmemory', reason))
+
+    value = None
+    wall = percentile(walls, AUTOTUNE_PERCENTILE)
+    if RUNTIME_EXIT_CODE in exitCodes:
+        value = roundUp(max((wall or 0) / 60., maxJobRuntime * AUTOTUNE_GROWTH), AUTOTUNE_RUNTIME_STEP, MAXJOBRUNTIME_RANGE)
+        reason = "jobs to resubmit ran for too long (exit code %d), the task requested %d minutes" % \
+                 (RUNTIME_EXIT_CODE, maxJobRuntime)
+    elif wall is not None:
+        value = roundUp(wall / 60. * AUTOTUNE_MARGIN, AUTOTUNE_RUNTIME_STEP, MAXJOBRUNTIME_RANGE)
+        reason = "%.0f%% of the runs ended within %s, the task requested %d minutes" % \
+                 (AUTOTUNE_PERCENTILE * 100, to_hms(wall), maxJobRuntime)
+    if value is not None and value != maxJobRuntime:
+        tuning['maxjobruntime'] = value
+        tuning['reasons'].append(('maxjobruntime', reason))
+
+    sites = analyzeSites(table, numCores)
+    siteWalls = sorted(info['wallP50'] for info in sites.values() if info['wallP50'] is not None)
+    medianWall = percentile(siteWalls, 0.5)
+    badSites = {}
+    for site, info in sites.items():
+        if info['runs'] < AUTOTUNE_MIN_SITE_RUNS:
+            continue
+        if info['failureRate'] >= AUTOTUNE_MAX_FAILURE_RATE:
+            badSites[site] = "%.0f%% of %d runs failed" % (info['failureRate'] * 100, info['runs'])
+        elif medianWall and info['wallP50'] is not None and info['wallP50'] > AUTOTUNE_SLOW_FACTOR * medianWall:
+            badSites[site] = "median wall time %s, %.1f times the one of all sites" % \
+                             (to_hms(info['wallP50']), info['wallP50'] / medianWall)
+    # keep somewhere to run
+    if badSites and len(badSites) < len(sites):
+        blacklist = list(taskSiteBlacklist or [])
+        blacklist += sorted(site for site in badSites if site not in blacklist)
+        tuning['siteblacklist'] = blacklist
+        tuning['reasons'].append(('siteblacklist', "; ".join("%s: %s" % (site, badSites[site]) for site in sorted(badSites))))
+    return tuning
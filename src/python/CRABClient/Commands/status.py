@@ -2,33 +2,98 @@ from __future__ import division # I want floating points
 from __future__ import print_function
 
 import os
+import re
+import glob
 import pickle
 import sys
 import math
+import itertools
 import json
 import logging
 import time
 import calendar
-import tempfile
+from array import array
 from ast import literal_eval
 from datetime import datetime
-from functools import cmp_to_key
+from collections import Counter
+try:
+    from collections.abc import Mapping
+except ImportError:  # python2
+    from collections import Mapping
 
 if sys.version_info >= (3, 0):
     from urllib.parse import quote  # pylint: disable=E0611
 if sys.version_info < (3, 0):
     from urllib import quote
 
-from CRABClient.ClientUtilities import (colors, getRucioClientFromLFN, validateJobids, compareJobids)
-from CRABClient.ClientUtilities import PKL_R_MODE
-from CRABClient.UserUtilities import curlGetFileFromURL, getColumn
+import CRABClient.Emulator
+from CRABClient.ClientUtilities import (colors, getRucioClientFromLFN, validateJobids, JobidSortKeys, sortJobids)
+from CRABClient.ClientUtilities import PKL_R_MODE, getWorkArea, runInThreadPool, BackgroundCalls, logLines, TableWriter
+from CRABClient.UserUtilities import getWebDirFetcher, getColumn
 from CRABClient.Commands.SubCommand import SubCommand
 from CRABClient.ClientExceptions import ConfigurationException
 from CRABClient.ClientMapping import parametersMapping
+from CRABClient.StatusCacheTable import StatusCacheTable, MAIN, PROBE, TAIL
+from CRABClient.StatusCacheFile import STATUS_CACHE_FILES, decodeStatusCache
+from CRABClient.StatusHistory import StatusHistory, StatusRecord, estimateProgress, HISTORY_RATE_WINDOW
+from CRABClient.StatusExport import exportStatusTable, canExport
 
 from ServerUtilities import (getEpochFromDBTime, TASKDBSTATUSES_TMP, TASKLIFETIME,
                              FEEDBACKMAIL, getProxiedWebDir, isEnoughRucioQuota)
 
+# name of the local copy of a status_cache file in the project directory
+STATUS_CACHE_LOCAL_COPY = '.%s'
+# name of the StatusHistory file in the project directory, and how many of its records --history prints
+STATUS_HISTORY_FILE = '.status_history'
+HISTORY_MAX_ROWS = 50
+
+# crab status --watch: default, minimum and maximum time (in seconds) between updates
+# and how much the time grows after each update where nothing changed
+WATCH_DEFAULT_INTERVAL = 120
+WATCH_MIN_INTERVAL = 30
+WATCH_MAX_INTERVAL = 1800
+WATCH_BACKOFF = 1.5
+# stop watching when the task reaches one of these status on the scheduler
+WATCH_FINAL_DAG_STATES = ['COMPLETED', 'FAILED', 'FAILED (KILLED)']
+# how many job ids to list for each kind of state transition
+WATCH_MAX_JOBIDS = 20
+# the content of status_cache goes to the log file only for tasks up to this size
+STATUS_CACHE_LOG_MAX_JOBS = 1000
+# the publication status is only asked in advance for tasks submitted at least this long ago (in seconds):
+# before, no job can have gone through bootstrap, scheduling, run and stageout yet
+PUBLICATION_PREFETCH_MIN_AGE = 600
+
+# how --normalizeErrors makes similar error messages identical, applied in this order
+ERROR_NORMALIZATIONS = [
+    (re.compile(r"\b[a-zA-Z][a-zA-Z0-9+.-]*://[^\s'\"<>]+"), '<URL>'),
+    (re.compile(r"(?<![\w<])(?:/[\w.+=@%~:-]+)+/?"), '<FILE>'),
+    (re.compile(r"\b[\w.+-]+\.(?:root|py|txt|log|json|tar\.gz|tgz|pkl|xml|db|so)\b"), '<FILE>'),
+    (re.compile(r"\b[0-9a-fA-F]{8}(?:-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}\b"), '<ID>'),
+    (re.compile(r"\b0x[0-9a-fA-F]+\b"), '<N>'),
+    (re.compile(r"(?<![\w<])[-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?"), '<N>'),
+]
+
+# what crab status --sort can sort the jobs by, and how each column is printed when sorting by several
+SORT_KEYS = ["state", "site", "runtime", "memory", "cpu", "retries", "waste", "exitcode"]
+# columns of the extended job status table of --long, which --columns can select
+DETAILS_COLUMNS = [('job', "Job", "%4s"), ('state', "State", "%-12s"), ('site', "Most Recent Site", "%-20s"),
+                   ('runtime', "Runtime", "%10s"), ('memory', "Mem (MB)", "%9s"), ('cpu', "CPU %", "%5s"),
+                   ('retries', "Retries", "%8s"), ('restarts', "Restarts", "%9s"), ('waste', "Waste", "%10s"),
+                   ('exitcode', "Last ExitCode", "%14s")]
+SORT_COLUMN_FORMATS = {'state': "%-12s", 'site': "%-20s", 'runtime': "%10s", 'memory': "%9s", 'cpu': "%5s",
+                       'retries': "%8s", 'waste': "%10s", 'exitcode': "%14s"}
+
+SITE_SUMMARY_DEFAULT = {"Runtime": 0, "Waste": 0, "Running": 0, "Success": 0, "Failed": 0, "Stageout": 0}
+# the kinds of --summary: jobs per site (the default), and distributions of the job metrics per site
+SUMMARY_KINDS = ['jobs', 'sites']
+# how the runs of the jobs count in the per site summaries, from the state of the job
+SITE_FAILED_STATES = ['failed', 'cooloff', 'held', 'killed']
+SITE_SUCCESS_STATES = ['finished', 'transferring']
+# how many of the most frequent exit codes of each site are printed by --summary=sites
+SITE_TOP_EXIT_CODES = 3
+# options which take an optional value, given as --option or --option value, see splitOptionValues
+OPTIONAL_VALUE_OPTIONS = ['--watch', '--summary']
+
 PUBLICATION_STATES = {
     'not_published': 'idle',
     'publication_failed': 'failed',
@@ -43,13 +108,37 @@ class status(SubCommand):
 
     shortnames = ['st']
 
-    def __init__(self, logger, cmdargs=None):
+    def __init__(self, logger, cmdargs=None, renderOutput=True):
         self.jobids = None
+        self.projdirs = None
         self.proxiedWebDir = None
         self.indentation = '\t\t'
-        SubCommand.__init__(self, logger, cmdargs)
+        # sort keys of the job ids, kept between the updates of --watch
+        self.jobidSortKeys = JobidSortKeys()
+        # when False, only collect the information for the returned dictionary and skip
+        # the tables and summaries (and the extra downloads) which are only printed
+        self.renderOutput = renderOutput
+        SubCommand.__init__(self, logger, splitOptionValues(expandProjdirPatterns(cmdargs)))
 
     def __call__(self):
+        if self.projdirs:
+            return self.showMultiStatus()
+        if self.options.watch:
+            return self.watchStatus()
+        return self.showStatus()
+
+    def showStatus(self):
+        """ Print the status of the task and return the status dictionary
+        """
+        with BackgroundCalls() as prefetch:
+            return self.showTaskStatus(prefetch)
+
+    def showTaskStatus(self, prefetch):
+        """ Print the status of the task and return the status dictionary. The inputs which
+            do not depend on each other (publication status, Rucio quota, probe jobs log,
+            status_cache) are downloaded concurrently, started with the BackgroundCalls prefetch
+            as soon as what they need is known.
+        """
         # Get all of the columns from the database for a certain task
         taskname = self.cachedinfo['RequestName']
         server = self.crabserver
@@ -76,7 +165,8 @@ class status(SubCommand):
         outDataset = outputDatasetList[0] if outputDatasetList else None # we do not support multiple output datasets anymore
 
         #Print information from the database
-        self.printTaskInfo(crabDBInfo, user)
+        if self.renderOutput:
+            self.printTaskInfo(crabDBInfo, user)
         if not rootDagId:
             failureMsg = "The task has not been submitted to the Grid scheduler yet. Not printing job information."
             self.logger.debug(failureMsg)
@@ -111,6 +201,18 @@ class status(SubCommand):
 
         self.logger.debug("Webdir is located at %s", webdir)
 
+        automaticSplitt = splitting == 'Automatic'
+        usingRucio = outputLfn.startswith('/store/user/rucio') or outputLfn.startswith('/store/group/rucio')
+
+        # these only need the task information, whether they are used is known after reading status_cache.
+        # printPublication asks the publication status itself if some job finished in a younger task
+        pendingPubStatus = None
+        if publicationEnabled and time.time() - submissionTime >= PUBLICATION_PREFETCH_MIN_AGE:
+            pendingPubStatus = prefetch.start(self.publicationStatus, taskname, user)
+        pendingQuota = None
+        if usingRucio and self.renderOutput:
+            pendingQuota = prefetch.start(self.getRucioQuotaInfo, outputLfn, outputDestinationSite)
+
         proxiedWebDir = getProxiedWebDir(crabserver=self.crabserver, task=taskname, logFunction=self.logger.debug)
 
         if not proxiedWebDir:
@@ -122,24 +224,23 @@ class status(SubCommand):
         self.logger.debug("Proxied webdir is located at %s", proxiedWebDir)
         self.proxiedWebDir = proxiedWebDir
 
+        pendingProbeLog = None
+        if automaticSplitt and self.renderOutput:
+            pendingProbeLog = prefetch.start(self.retrieveProbeJobsLog)
+
         # Download status_cache file
-        fh, local_status_cache_txt = tempfile.mkstemp(dir='/tmp', prefix='crab_status-cache-', suffix='.txt')
-        os.close(fh)  # no need for a hanlde, curl will write using file name
-        fh, local_status_cache_pkl = tempfile.mkstemp(dir='/tmp', prefix='crab_status-cache-', suffix='.pkl')
-        os.close(fh)  # no need for a handle, curl will write using file name
         gotPickle = False
         gotTxt = False
-        # first: try pickle version
-        url = self.proxiedWebDir + "/status_cache.pkl"
-        self.logger.debug("Retrieving 'status_cache' file from %s", url)
+        # the columns of the job table, filled while status_cache is decoded
+        statusCacheTable_PKL = None
+        # the {jobid: info} dictionary is only needed for --json, --watch and the returned dictionary:
+        # the crab command line does not use the latter, large tasks are then only kept as columns
+        # (python2 compares it with the one of the text status_cache)
+        keepJobs = self.returnDictUsed or self.options.json or self.options.watch or sys.version_info < (3, 0)
+        maxJobs = None if keepJobs else STATUS_CACHE_LOG_MAX_JOBS
+        # first: try the status_cache.pkl or .jsonl.gz version
         try:
-            httpCode = curlGetFileFromURL(url, local_status_cache_pkl,
-                                                 self.proxyfilename, logger=self.logger)
-            if httpCode != 200:
-                raise Exception("failed to retrieve %s" % url)
-            with open(local_status_cache_pkl, PKL_R_MODE) as fp:
-                statusCache = pickle.load(fp)
-            os.remove(local_status_cache_pkl)
+            _, statusCache, statusCacheTable_PKL = self.retrieveStatusCache(withTable=True, maxJobs=maxJobs)
             if 'bootstrapTime' in statusCache :
                 statusCacheInfo_PKL = None
                 bootstrapMsg_PKL = "Task bootstrapped at %s" % statusCache['bootstrapTime']['date']
@@ -151,7 +252,7 @@ class status(SubCommand):
                 statusCacheInfo_PKL = statusCache['nodes']
             gotPickle = True
         except Exception as e:  # pylint: disable=unused-variable
-            self.logger.debug("%s not found or corrupted. Will use old format file only", url)
+            self.logger.debug("status_cache not found or corrupted in %s. Will use old format file only", self.proxiedWebDir)
             bootstrapMsg_PKL = None
             statusCacheInfo_PKL = None
         # if not running in python3, try also old format
@@ -159,34 +260,10 @@ class status(SubCommand):
             url = self.proxiedWebDir + "/status_cache"
             self.logger.debug("Retrieving 'status_cache' file from %s", url)
             try:
-                httpCode = curlGetFileFromURL(url, local_status_cache_txt,
-                                                     self.proxyfilename, logger=self.logger)
+                httpCode, statusCacheData, _ = getWebDirFetcher(self.proxyfilename).get(url, logger=self.logger)
                 if httpCode != 200:
                     raise Exception("failed to retrieve %s" % url)
-                with open(local_status_cache_txt, 'r') as fp:
-                    statusCacheData = fp.read()
-                os.remove(local_status_cache_txt)
-                # Normally the first two lines of the file contain the checkpoint locations
-                # for the job_log / fjr_parse_results files and are used by the status caching script.
-                # But if the job has just bootstrapped the first lines of the file are:
-                #  line1: a readable message  line2: bootstrap time in seconds from Epoch
-                #  Example:
-                #   # Task bootstrapped at 2021-03-22 16:23:54 UTC
-                #   1616430956
-                # and a dummy, empty, status record follows
-                if statusCacheData.split('\n')[0].startswith('#'):
-                    statusCacheInfo_TXT = None
-                    bootstrapTime = statusCacheData.split('\n')[1]
-                    bootstrapMsg_TXT = statusCacheData.split('\n')[0].lstrip('#').lstrip()
-                    if bootstrapTime:
-                        bootingTime = int(time.time()) - literal_eval(bootstrapTime)
-                    else:
-                        bootingTime = 199
-                    bootstrapMsg_TXT += ". %d seconds ago" % bootingTime
-                else:
-                    bootstrapMsg_TXT = None
-                    # Load the job_report summary
-                    statusCacheInfo_TXT = literal_eval(statusCacheData.split('\n')[2])
+                statusCacheInfo_TXT, bootstrapMsg_TXT, bootingTime = parseTxtStatusCache(statusCacheData)
                 gotTxt = True
             except Exception as ce:
                 self.logger.debug("%s not found or corrupted.", url)
@@ -214,9 +291,11 @@ class status(SubCommand):
         # use old one for py2, pickle for py3
         if sys.version_info >= (3, 0):
             statusCacheInfo = statusCacheInfo_PKL
+            statusCacheTable = statusCacheTable_PKL
             bootstrapMsg = bootstrapMsg_PKL
         if sys.version_info < (3, 0):
             statusCacheInfo = statusCacheInfo_TXT
+            statusCacheTable = None
             bootstrapMsg = bootstrapMsg_TXT
         # now code is common again
         if bootstrapMsg:
@@ -233,17 +312,18 @@ class status(SubCommand):
         if not statusCacheInfo:
             self.logger.error('Format error in status_cache. Empty file ?')
             return {'commandStatus': 'FAILED'}
-        self.logger.debug("Got information from status cache file: %s", statusCacheInfo)
-
-        automaticSplitt = splitting == 'Automatic'
+        if statusCacheTable is None:
+            statusCacheTable = StatusCacheTable(statusCacheInfo)
+        if len(statusCacheTable) <= STATUS_CACHE_LOG_MAX_JOBS:
+            self.logger.debug("Got information from status cache file: %s", statusCacheInfo)
+        else:
+            self.logger.debug("Got information about %d jobs from status cache file (use --json to see it)", len(statusCacheTable))
 
         # If the task is already on the grid, show the dagman status
         combinedStatus = dagStatus = self.printDAGStatus(dbStatus, statusCacheInfo)
 
-        usingRucio = outputLfn.startswith('/store/user/rucio') or outputLfn.startswith('/store/group/rucio')
-
-        if dagStatus != 'COMPLETED' and usingRucio:
-            self.printRucioQuotaInfo(outputLfn, outputDestinationSite)
+        if dagStatus != 'COMPLETED' and usingRucio and self.renderOutput:
+            self.printRucioQuotaInfo(outputDestinationSite, pendingQuota.get())
 
         container = None
         if usingRucio:
@@ -255,47 +335,347 @@ class status(SubCommand):
             if containerInfo['transferRuleID']:
                 container = containerInfo
 
-        shortResult = self.printOverview(statusCacheInfo, automaticSplitt, container)
-        pubStatus = self.printPublication(publicationEnabled, shortResult, taskname, user, crabDBInfo, container=container)
-        self.printErrors(statusCacheInfo, automaticSplitt)
+        # The DagStatus record is no longer necessary, it is not part of the job table returned
+        statusCacheInfo.pop('DagStatus', None)
+        statusCache = statusCacheInfo_PKL = statusCacheInfo_TXT = None
+
+        if self.options.export:
+            numRows = exportStatusTable(statusCacheTable, self.options.export, retries=self.options.exportRetries)
+            self.logger.info("Job table (%d rows) written to %s", numRows, self.options.export)
+
+        # If user correctly passed some jobid CSVs to use in the status --long, self.jobids
+        # will be a list of strings already parsed from the input by the validateOptions()
+        if (self.options.long or self.options.sort) and self.jobids:
+            # Check the format of the jobids option.
+            if self.options.jobids:
+                jobidstuple = validateJobids(self.options.jobids, not automaticSplitt)
+                self.jobids = [str(jobid) for (_, jobid) in jobidstuple]
+            self.checkUserJobids(statusCacheTable, self.jobids)
+
+        # all the information about jobs which is printed is collected here in one go
+        jobsSummary = summarizeJobs(statusCacheTable, automaticSplitt, numCores, allErrors=self.options.long,
+                                    jobids=self.jobids, onlyCounts=not self.renderOutput,
+                                    normalizeErrors=self.options.normalizeErrors)
+
+        if self.renderOutput:
+            # only when the user runs crab status, not for the internal calls from other commands
+            history = self.updateStatusHistory(statusCacheTable)
+            self.printOverview(jobsSummary, automaticSplitt, container, pendingProbeLog)
+            if dagStatus not in WATCH_FINAL_DAG_STATES:
+                self.printProgress(history, jobsSummary)
+        pubStatus = self.printPublication(publicationEnabled, jobsSummary, taskname, user, crabDBInfo, container=container,
+                                          pendingPubStatus=pendingPubStatus)
+        if not self.renderOutput:
+            return self.makeStatusReturnDict(crabDBInfo, combinedStatus, dagStatus,
+                                             '', jobsSummary, statusCacheInfo,
+                                             pubStatus)
+
+        self.printErrors(jobsSummary)
 
         if not self.options.long and not self.options.sort:  # already printed for these options
-            self.printDetails(statusCacheInfo, automaticSplitt, self.jobids, True, maxMemory, maxJobRuntime, numCores)
-
-        if self.options.summary:
-            self.printSummary(statusCacheInfo)
+            self.printDetails(jobsSummary, automaticSplitt, True, maxMemory, maxJobRuntime, numCores)
+
+        siteAnalytics = None
+        if self.options.summary == 'sites':
+            siteAnalytics = analyzeSites(statusCacheTable, numCores)
+            self.printSiteAnalytics(siteAnalytics)
+        elif self.options.summary:
+            self.printSummary(jobsSummary)
         if self.options.long or self.options.sort:
-            # If user correctly passed some jobid CSVs to use in the status --long, self.jobids
-            # will be a list of strings already parsed from the input by the validateOptions()
-            if self.jobids:
-                # Check the format of the jobids option.
-                if self.options.jobids:
-                    jobidstuple = validateJobids(self.options.jobids, not automaticSplitt)
-                    self.jobids = [str(jobid) for (_, jobid) in jobidstuple]
-                self.checkUserJobids(statusCacheInfo, self.jobids)
-            sortdict = self.printDetails(statusCacheInfo, automaticSplitt, self.jobids, not self.options.long, maxMemory, maxJobRuntime, numCores)
+            sortdict = self.printDetails(jobsSummary, automaticSplitt, not self.options.long, maxMemory, maxJobRuntime, numCores)
             if self.options.sort:
-                self.printSort(sortdict, self.options.sort)
+                self.printSort(sortdict, self.options.sort, self.options.top)
+        if self.options.history:
+            self.printHistory()
         if self.options.json:
             self.logger.info(json.dumps(statusCacheInfo))
+            if siteAnalytics is not None:
+                self.logger.info(json.dumps({'siteAnalytics': siteAnalytics}))
 
         statusDict = self.makeStatusReturnDict(crabDBInfo, combinedStatus, dagStatus,
-                                               '', shortResult, statusCacheInfo,
+                                               '', jobsSummary, statusCacheInfo,
                                                pubStatus)
+        if siteAnalytics is not None:
+            statusDict['siteAnalytics'] = siteAnalytics
+
+        return statusDict
 
+    def watchStatus(self):
+        """ Print the full status once, then keep refreshing only the status_cache file and
+            print the jobs which changed state and the updated job counters, until the task
+            is done on the scheduler or the user hits Ctrl-C. The time between updates starts
+            at the --watch interval and grows while nothing changes.
+        """
+        statusDict = self.showStatus()
+        interval = self.options.watch
+        try:
+            while statusDict.get('dagStatus') not in WATCH_FINAL_DAG_STATES:
+                self.logger.debug("Next status update in %d seconds", interval)
+                time.sleep(interval)
+                if not self.proxiedWebDir or not statusDict.get('jobs'):
+                    # the task is not running on the scheduler yet, nothing to compare with
+                    statusDict = self.showStatus()
+                    continue
+                changed = False
+                try:
+                    httpCode, statusCache = self.retrieveStatusCache()
+                except Exception as ex:  # pylint: disable=broad-except
+                    self.logger.warning("Failed to refresh the status information: %s", ex)
+                    httpCode, statusCache = None, {}
+                if httpCode == 200 and 'nodes' in statusCache:
+                    statusCacheInfo = statusCache['nodes']
+                    dagStatus = self.collapseDAGStatus(statusCacheInfo.pop('DagStatus'), statusDict['dbStatus'])
+                    transitions = self.diffJobStates(statusDict['jobs'], statusCacheInfo)
+                    self.updateStatusHistory(StatusCacheTable(statusCacheInfo))
+                    jobsPerStatus = {}
+                    for info in statusCacheInfo.values():
+                        jobsPerStatus[info['State']] = jobsPerStatus.get(info['State'], 0) + 1
+                    if transitions or dagStatus != statusDict['dagStatus']:
+                        changed = True
+                        self.printTransitions(transitions, jobsPerStatus,
+                                              dagStatus if dagStatus != statusDict['dagStatus'] else None)
+                    statusDict['status'] = statusDict['dagStatus'] = dagStatus
+                    statusDict['jobs'] = statusCacheInfo
+                    statusDict['jobsPerStatus'] = jobsPerStatus
+                    statusDict['jobList'] = [[info['State'], jobid] for jobid, info in statusCacheInfo.items()]
+                if changed:
+                    interval = self.options.watch
+                else:
+                    interval = min(int(interval * WATCH_BACKOFF), max(WATCH_MAX_INTERVAL, self.options.watch))
+            self.logger.info("\nTask status on the scheduler is %s, stop watching", statusDict['dagStatus'])
+        except KeyboardInterrupt:
+            self.logger.info("\nStopped watching")
         return statusDict
 
+    def showMultiStatus(self):
+        """ Print one line per task for all the project directories in self.projdirs.
+            All tasks use the proxy of this command and one REST client per CRAB server
+            instance, the information for the different tasks is retrieved concurrently.
+        """
+        tasks = []
+        for projdir in self.projdirs:
+            requestarea, _ = getWorkArea(projdir)
+            with open(os.path.join(requestarea, '.requestcache'), PKL_R_MODE) as fd:
+                cachedinfo = pickle.load(fd)
+            port = ':' + cachedinfo['Port'] if cachedinfo['Port'] else ''
+            tasks.append((projdir, requestarea, cachedinfo['RequestName'],
+                          cachedinfo['Server'] + port, cachedinfo['instance']))
+
+        # one client per server instance, this command's one for its own instance
+        crabRest = CRABClient.Emulator.getEmulator('rest')
+        servers = {(self.serverurl, self.instance): self.crabserver}
+        for _, _, _, serverurl, instance in tasks:
+            if (serverurl, instance) not in servers:
+                servers[(serverurl, instance)] = crabRest(hostname=serverurl, localcert=self.proxyfilename,
+                                                          localkey=self.proxyfilename, retry=2,
+                                                          logger=self.logger, verbose=False)
+                servers[(serverurl, instance)].setDbInstance(instance)
+
+        def taskSummary(projdir, requestarea, taskname, serverurl, instance):
+            try:
+                return self.getTaskSummary(servers[(serverurl, instance)], projdir, requestarea, taskname)
+            except Exception as ex:  # pylint: disable=broad-except
+                self.logger.debug("Failed to get status of task %s", taskname, exc_info=True)
+                return {'projdir': projdir, 'taskname': taskname, 'dbStatus': '', 'dagStatus': '',
+                        'jobsPerStatus': {}, 'error': str(ex).strip().split('\n')[-1]}
+
+        summaries = runInThreadPool(taskSummary, tasks)
+
+        if self.options.json:
+            self.logger.info(json.dumps(summaries))
+        else:
+            width = max(len(summary['projdir']) for summary in summaries)
+            header = "%-*s %-18s %-18s %6s  %s" % (width, "Project directory", "Server status", "Scheduler status", "Jobs", "Jobs per status")
+            self.logger.info(header)
+            for summary in summaries:
+                jobsPerStatus = summary['jobsPerStatus']
+                if summary['error']:
+                    perStatus = "%sError%s: %s" % (colors.RED, colors.NORMAL, summary['error'])
+                else:
+                    perStatus = ", ".join("%s%s%s %d" % (self._stateColor(state), state, colors.NORMAL, jobsPerStatus[state])
+                                          for state in sorted(jobsPerStatus))
+                self.logger.info("%-*s %-18s %-18s %6d  %s" % (width, summary['projdir'], summary['dbStatus'],
+                                                             summary['dagStatus'], sum(jobsPerStatus.values()), perStatus))
+
+        failed = [summary for summary in summaries if summary['error']]
+        return {'commandStatus': 'FAILED' if failed else 'SUCCESS', 'tasks': summaries}
+
+    def getTaskSummary(self, server, projdir, requestarea, taskname):
+        """ Get from server and from the status_cache file the task status, the
+            status on the scheduler and the number of jobs per status for one task
+        """
+        crabDBInfo, _, _ = server.get(api='task', data={'subresource':'search', 'workflow':taskname})
+        summary = {'projdir': projdir, 'taskname': taskname, 'dbStatus': getColumn(crabDBInfo, 'tm_task_status'),
+                   'dagStatus': '', 'jobsPerStatus': {}, 'error': ''}
+        webdir = getColumn(crabDBInfo, 'tm_user_webdir')
+        if not getColumn(crabDBInfo, 'clusterid') or not webdir:
+            return summary
+        proxiedWebDir = getProxiedWebDir(crabserver=server, task=taskname, logFunction=self.logger.debug) or webdir
+        _, statusCache = self.retrieveStatusCache(proxiedWebDir, requestarea)
+        if 'bootstrapTime' in statusCache:
+            summary['dagStatus'] = 'SUBMITTED'
+            return summary
+        statusCacheInfo = statusCache['nodes']
+        summary['dagStatus'] = self.collapseDAGStatus(statusCacheInfo.pop('DagStatus'), summary['dbStatus'])
+        for info in statusCacheInfo.values():
+            summary['jobsPerStatus'][info['State']] = summary['jobsPerStatus'].get(info['State'], 0) + 1
+        return summary
+
+    @staticmethod
+    def diffJobStates(previous, current):
+        """ Compare two status_cache job tables and return a dictionary
+                {(old state, new state): [job ids]}
+            for the jobs whose state changed. Jobs which were not in previous (e.g. new
+            tail jobs in automatic splitting) have old state 'new'.
+        """
+        transitions = {}
+        for jobid, info in current.items():
+            if jobid == 'DagStatus':
+                continue
+            oldState = previous[jobid]['State'] if jobid in previous else 'new'
+            if info['State'] != oldState:
+                transitions.setdefault((oldState, info['State']), []).append(jobid)
+        return transitions
+
+    def printTransitions(self, transitions, jobsPerStatus, dagStatus=None):
+        """ Print the job state transitions found by diffJobStates, the job counters
+            and, if it changed, the status on the scheduler.
+        """
+        msg = "\n%s" % time.strftime('%Y-%m-%d %H:%M:%S')
+        if dagStatus:
+            msg += "\nStatus on the scheduler:\t%s" % dagStatus
+        if transitions:
+            msg += "\n%d jobs changed state:" % sum(len(jobids) for jobids in transitions.values())
+        for (oldState, newState), jobids in sorted(transitions.items()):
+            jobids = sortJobids(jobids, self.jobidSortKeys)
+            msg += "\n  %s -> %s %5d: %s" % (self._printState(oldState, 12), self._printState(newState, 12),
+                                              len(jobids), ", ".join(jobids[:WATCH_MAX_JOBIDS]))
+            if len(jobids) > WATCH_MAX_JOBIDS:
+                msg += " and %d more" % (len(jobids) - WATCH_MAX_JOBIDS)
+        total = sum(jobsPerStatus.values())
+        msg += "\nJobs: " + ", ".join("%s%s%s %d" % (self._stateColor(state), state, colors.NORMAL, jobsPerStatus[state])
+                                      for state in sorted(jobsPerStatus))
+        msg += " (total %d)" % total
+        self.logger.info(msg)
+
+    def updateStatusHistory(self, table):
+        """ Add the status of the jobs in the StatusCacheTable table to the StatusHistory of the task,
+            return the records of the last HISTORY_RATE_WINDOW seconds (empty if the history can not be used)
+        """
+        now = time.time()
+        history = StatusHistory(os.path.join(self.requestarea, STATUS_HISTORY_FILE))
+        try:
+            history.append(StatusRecord.fromTable(table, now))
+            return history.records(since=now - HISTORY_RATE_WINDOW)
+        except (IOError, OSError, ValueError) as ex:
+            self.logger.debug("Can not update the status history %s: %s", history.filename, ex)
+            return []
+
+    def printProgress(self, records, jobsSummary):
+        """ Print the number of jobs done per hour and the estimated time until all jobs are done,
+            from the StatusHistory records and the median runtime of the ended jobs, when known.
+            The median is not pulled up by a few jobs which ran much longer than the others.
+        """
+        runtime = percentile(sorted(jobsSummary['metrics']['runtimes']), 0.5)
+        throughput, eta = estimateProgress(records, time.time(), runtime)
+        msg = ""
+        if throughput is not None:
+            msg += "\nJobs done per hour:\t\t%.1f (in the last %d hours)" % (throughput, HISTORY_RATE_WINDOW // 3600)
+        if eta:
+            msg += "\nEstimated time to completion:\t%s (%s)" % (to_hms(eta), "from the jobs done per hour" if throughput \
+                                                                   else "from the median job runtime, assuming the running jobs keep their slots")
+        if msg:
+            self.logger.info(msg)
+
+    def printHistory(self):
+        """ Print the last HISTORY_MAX_ROWS records of the StatusHistory of the task: number of jobs
+            per state, jobs done per hour since the previous record, wall time and CPU efficiency.
+        """
+        history = StatusHistory(os.path.join(self.requestarea, STATUS_HISTORY_FILE))
+        try:
+            records = history.records(last=HISTORY_MAX_ROWS + 1)
+        except (IOError, OSError, ValueError) as ex:
+            self.logger.info("\nCan not read the status history %s: %s", history.filename, ex)
+            return
+        if not records:
+            self.logger.info("\nNo status history yet")
+            return
+        previous = records[0] if len(records) > HISTORY_MAX_ROWS else None
+        records = records[-HISTORY_MAX_ROWS:]
+        states = [state for state in history.states if any(state in record.counts for record in records)]
+        lineFormat = "%-16s %8s" + "".join(" %%%ds" % max(len(state), 8) for state in states) + " %8s %10s %7s"
+        lines = ["\nStatus history (one line each time the status changed):\n"]
+        lines.append(lineFormat % tuple(["Time", "Jobs"] + states + ["Done/h", "Wall (h)", "CPU %"]))
+        for record in records:
+            donePerHour = ''
+            if previous is not None and record.time > previous.time:
+                donePerHour = "%.1f" % ((record.numDone - previous.numDone) * 3600. / (record.time - previous.time))
+            cpuEff = "%.0f" % (100. * record.cpuTime / record.wallTime) if record.wallTime else ''
+            lines.append(lineFormat % tuple([time.strftime('%Y-%m-%d %H:%M', time.localtime(record.time)), record.numJobs] +
+                                            [record.counts.get(state, 0) for state in states] +
+                                            [donePerHour, "%.1f" % (record.wallTime / 3600.), cpuEff]))
+            previous = record
+        self.logger.info("\n".join(lines))
+
+    def retrieveStatusCache(self, proxiedWebDir=None, requestarea=None, withTable=False, maxJobs=None):
+        """ Get the content of the status_cache file from the proxied webdir, in the first of the
+            STATUS_CACHE_FILES formats found there and which can be read. The file is kept in the
+            project directory and only downloaded again when it changed on the schedd, the format
+            of the local copy is tried first: a schedd which only writes status_cache.jsonl.gz
+            costs one failed request for status_cache.pkl the first time only.
+            Returns (httpCode, statusCache) where httpCode is 200 if the file was downloaded
+            and 304 if the local copy was still good. Raises if the file can not be retrieved or read.
+            With withTable also the StatusCacheTable of the jobs, filled while the file is decoded
+            (one job at a time for status_cache.jsonl.gz), as (httpCode, statusCache, table).
+            The content of the file is not kept. With withTable and maxJobs, the jobs are only
+            kept in statusCache if there are at most maxJobs of them, see decodeStatusCache.
+            Webdir and project directory default to the ones of the task of this command.
+        """
+        proxiedWebDir = proxiedWebDir or self.proxiedWebDir
+        requestarea = requestarea or self.requestarea
+        fetcher = getWebDirFetcher(self.proxyfilename)
+        # the task process writes always the same files: no need to look for the others once one was found
+        files = sorted(STATUS_CACHE_FILES,
+                       key=lambda f: not os.path.isfile(os.path.join(requestarea, STATUS_CACHE_LOCAL_COPY % f[0])))
+        error = None
+        for filename, fileFormat in files:
+            url = proxiedWebDir + "/" + filename
+            self.logger.debug("Retrieving '%s' file from %s", filename, url)
+            localStatusCache = os.path.join(requestarea, STATUS_CACHE_LOCAL_COPY % filename)
+            httpCode, data = fetcher.getIfModified(url, localStatusCache, logger=self.logger)
+            if httpCode == 304:
+                self.logger.debug("%s did not change since last retrieved, using local copy", filename)
+            elif httpCode != 200:
+                error = Exception("failed to retrieve %s" % url)
+                continue
+            try:
+                table = StatusCacheTable({}) if withTable else None
+                statusCache = decodeStatusCache(data, fileFormat, table, maxJobs if withTable else None)
+            except Exception as ex:  # pylint: disable=broad-except
+                # do not trust this copy next time
+                os.remove(localStatusCache)
+                self.logger.debug("Failed to decode %s: %s", filename, ex)
+                error = ex
+                continue
+            if withTable:
+                return httpCode, statusCache, table
+            return httpCode, statusCache
+        raise error
+
     def makeStatusReturnDict(self, crabDBInfo, combinedStatus, dagStatus='',
-                             statusFailureMsg='', shortResult=None,
+                             statusFailureMsg='', jobsSummary=None,
                              statusCacheInfo=None, pubStatus=None):
         """ Create a dictionary which is mostly identical to the dictionary
             that was being returned by the old status (plus a few other keys
             needed by the other client commands). This is to ensure backward
             compatibility after the status2 transition for users relying on
-            this dictionary in their scripts.
+            this dictionary in their scripts. 'jobs' is the {jobid: info} job
+            table of status_cache, a plain dictionary without the DagStatus record.
+            It is empty for the large tasks when run by the crab command line, which
+            does not use this dictionary (see returnDictUsed).
         """
 
-        if shortResult is None: shortResult = {}
+        if jobsSummary is None: jobsSummary = {}
         if statusCacheInfo is None: statusCacheInfo = {}
         if pubStatus is None: pubStatus = {}
 
@@ -320,8 +700,8 @@ class status(SubCommand):
 
         statusDict['statusFailureMsg'] = statusFailureMsg
         statusDict['proxiedWebDir'] = self.proxiedWebDir
-        statusDict['jobsPerStatus'] = shortResult.get('jobsPerStatus', {})
-        statusDict['jobList'] = shortResult.get('jobList', {})
+        statusDict['jobsPerStatus'] = jobsSummary.get('jobsPerStatus', {})
+        statusDict['jobList'] = jobsSummary.get('jobList', {})
         statusDict['publication'] = pubStatus.get('status', {})
         statusDict['publicationFailures'] = pubStatus.get('failure_reasons', {})
         statusDict['jobs'] = statusCacheInfo
@@ -499,116 +879,39 @@ class status(SubCommand):
         """ Checks that the job information taken from the status_cache file on the schedd
             contains all of the jobids passed by the user.
         """
-        wrongJobIds = [uJobid for uJobid in userJobids if uJobid not in statusCacheInfo.keys()]
+        wrongJobIds = [uJobid for uJobid in userJobids if uJobid not in statusCacheInfo]
         if wrongJobIds:
             raise ConfigurationException("The following jobids were not found in the task: %s" % wrongJobIds)
 
-    def printDetails(self, dictresult, automaticSplitt, jobids=None, quiet=False,
+    def printDetails(self, jobsSummary, automaticSplitt, quiet=False,
                      maxMemory=parametersMapping['on-server']['maxmemory']['default'],
                      maxJobRuntime=parametersMapping['on-server']['maxjobruntime']['default'],
                      numCores=parametersMapping['on-server']['numcores']['default']):
-        """ Print detailed information about a task and each job.
+        """ Print detailed information about a task and each job, from the job table
+            and the metrics computed by summarizeJobs.
         """
-        sortdict = {}
-        outputMsg = "\nExtended Job Status Table:\n"
-        outputMsg += "\n%4s %-12s %-20s %10s %9s %5s %8s %9s %10s %14s" \
-                   % ("Job", "State", "Most Recent Site", "Runtime", "Mem (MB)", "CPU %", "Retries", "Restarts", "Waste", "Last ExitCode")
-        mem_cnt = 0
-        mem_min = -1
-        mem_max = 0
-        mem_sum = 0
-        run_cnt = 0
-        run_min = -1
-        run_max = 0
-        run_sum = 0
-        cpu_min = -1
-        cpu_max = 0
-        cpu_sum = 0
-        wall_sum = 0
-
-        def translateJobStatus(jobid):
-            statusToTr = dictresult[jobid]['State']
-            if statusToTr == 'cooloff':
-                statusToTr = 'toRetry'
-            if not automaticSplitt:
-                return statusToTr
-            if jobid.startswith('0-') and statusToTr in ('finished', 'failed'):
-                return 'no output'
-            elif automaticSplitt and '-' not in jobid and statusToTr == 'failed':
-                return 'rescheduled'
-            return statusToTr
-
-        # Chose between the jobids passed by the user or all jobids that are in the task
-        jobidsToUse = jobids if jobids else dictresult.keys()
-        for jobid in sorted(jobidsToUse, key=cmp_to_key(compareJobids)):
-            info = dictresult[str(jobid)]
-            state = translateJobStatus(jobid)
-            jobForMetrics = False
-            if (state not in ['idle', 'running', 'unsubmitted']) and (not jobid.startswith('0-')): # exclude not-run and probe jobs from metric
-                jobForMetrics = True
-            site = ''
-            if info.get('SiteHistory'):
-                site = info['SiteHistory'][-1]
-            wall = 0
-            if info.get('WallDurations'):
-                wall = info['WallDurations'][-1]
-                if (run_min == -1) or (wall < run_min): run_min = wall
-                if jobForMetrics:
-                    if wall > run_max: run_max = wall
-            if jobForMetrics:
-                run_sum += wall
-                run_cnt += 1
-            wall_str = to_hms(wall)
-            waste = 0
-            if info.get('WallDurations'):
-                for run in info['WallDurations'][:-1]:
-                    waste += run
-            if jobForMetrics: wall_sum += waste + wall
-            waste = to_hms(waste)
-            mem = 'Unknown'
-            if info.get('ResidentSetSize'):
-                mem = info['ResidentSetSize'][-1]/1024
-                if (mem_min == -1) or (wall < mem_min): mem_min = mem
-                if jobForMetrics:
-                    if mem > mem_max: mem_max = mem
-                    mem_sum += mem
-                    mem_cnt += 1
-                mem = '%d' % mem
-            cpu = 'Unknown'
-            if (state in ['toRetry', 'failed', 'finished']) and not wall:
-                cpu = 0
-                if (cpu_min == -1) or cpu < cpu_min: cpu_min = cpu
-                if cpu > cpu_max: cpu_max = cpu
-                cpu = "%.0f" % cpu
-            elif wall and ('TotalSysCpuTimeHistory' in info) and ('TotalUserCpuTimeHistory' in info):
-                cpu = info['TotalSysCpuTimeHistory'][-1] + info['TotalUserCpuTimeHistory'][-1]
-                if jobForMetrics: cpu_sum += cpu / float(numCores)
-                cpu = (cpu / float(wall*numCores)) * 100
-                if jobForMetrics:
-                    if (cpu_min == -1) or cpu < cpu_min: cpu_min = cpu
-                    if cpu > cpu_max: cpu_max = cpu
-                cpu = "%.0f" % cpu
-            ec = 'Unknown'
-            if info['State'] in ['finished']:
-                ec = '0'
-            elif 'Error' in info:
-                ec = str(info['Error'][0]) # exit code of this failed job
-            sortdict[str(jobid)] = {'state': state, 'site': site, 'runtime': wall_str, 'memory': mem, 'cpu': cpu, \
-                                    'retries': info.get('Retries', 0), 'restarts': info.get('Restarts', 0), 'waste': waste, 'exitcode': ec}
-            outputMsg += "\n%4s %-12s %-20s %10s %9s %5s %8s %9s %10s %14s" \
-                       % (jobid, state, site, wall_str, mem, cpu, info.get('Retries', 0),
-                          info.get('Restarts', 0), waste, ' Postprocessing failed' if ec == '90000' else ec)
-        if not quiet:
-            self.logger.info(outputMsg)
-
-        # Print (to the log file) a table with the HTCondor cluster id for each job.
-        msg = "\n%4s %-10s" % ("Job", "Cluster Id")
-        for jobid in jobidsToUse:
-            info = dictresult[str(jobid)]
-            clusterid = str(info.get('JobIds', 'Unknown'))
-            msg += "\n%4s %10s" % (jobid, clusterid)
+        sortdict = jobsSummary['details']
         if not quiet:
-            self.logger.debug(msg)
+            # the rows are made and logged a page at a time
+            selected = ['job'] + self.options.columns.split(',') if self.options.columns else None
+            with TableWriter(self.logger, DETAILS_COLUMNS, selected, title="\nExtended Job Status Table:\n") as writer:
+                for jobid in sortJobids(sortdict, sortdict.table.sortKeys):
+                    row = sortdict[jobid]
+                    row['job'] = jobid
+                    if row['exitcode'] == '90000':
+                        row['exitcode'] = ' Postprocessing failed'
+                    writer.write(row)
+
+            # Print (to the log file) a table with the HTCondor cluster id for each job.
+            logLines(self.logger, itertools.chain(["\n%4s %-10s" % ("Job", "Cluster Id")],
+                                                  ("%4s %10s" % (jobid, str(clusterid)) for jobid, clusterid in jobsSummary['clusterIds'])),
+                     level=logging.DEBUG)
+
+        metrics = jobsSummary['metrics']
+        mem_cnt, mem_min, mem_max, mem_sum = metrics['mem_cnt'], metrics['mem_min'], metrics['mem_max'], metrics['mem_sum']
+        run_cnt, run_min, run_max, run_sum = metrics['run_cnt'], metrics['run_min'], metrics['run_max'], metrics['run_sum']
+        cpu_min, cpu_max, cpu_sum = metrics['cpu_min'], metrics['cpu_max'], metrics['cpu_sum']
+        wall_sum = metrics['wall_sum']
 
         if mem_cnt or run_cnt:
             # Print a summary with memory/cpu usage.
@@ -645,49 +948,19 @@ class status(SubCommand):
 
         return sortdict
 
-    def printOverview(self, statusCacheInfo, automaticSplitt, container):
+    def printOverview(self, jobsSummary, automaticSplitt, container, pendingProbeLog=None):
         """ Give a summary of the job statuses, keeping in mind that:
                 - If there is a job with id 0 then this is the probe job for the estimation
                   This is the so called 'Automatic' splitting
                 - Then you have normal jobs
                 - Jobs that are line 1-1, 1-2 and so on are completing
+            The number of jobs per status for probe, main and tail jobs come from summarizeJobs,
+            in dictionaries like {'finished' : 1, 'running' : 3}
+            pendingProbeLog is the pending result of retrieveProbeJobsLog, if already started.
         """
-
-        # This record is no longer necessary and makes parsing more difficult.
-        if 'DagStatus' in statusCacheInfo:
-            del statusCacheInfo['DagStatus']
-
-        jobsPerStatus = {}
-        jobList = []
-        result = {}
-        for job, info in statusCacheInfo.items():
-            jobStatus = info['State']
-            jobsPerStatus.setdefault(jobStatus, 0)
-            jobsPerStatus[jobStatus] += 1
-            jobList.append([jobStatus, job])
-        result['jobsPerStatus'] = jobsPerStatus
-        result['jobList'] = jobList
-
-        # Collect information about probe and tail jobs
-        # Create dictionaries like {'finished' : 1, 'running' : 3}
-        states = {}
-        statesPJ = {}
-        statesTJ = {}
-        failedProcessing = 0
-        for jobid, statusDict in statusCacheInfo.items():
-            jobStatus = statusDict['State'] if statusDict['State'] != 'cooloff' else 'toRetry'
-            if jobid.startswith('0-'):
-                statesPJ[jobStatus] = statesPJ.setdefault(jobStatus, 0) + 1
-            elif '-' in jobid:
-                statesTJ[jobStatus] = statesTJ.setdefault(jobStatus, 0) + 1
-            else:
-                states[jobStatus] = states.setdefault(jobStatus, 0) + 1
-                if jobStatus == 'failed':
-                    failedProcessing += 1
-        result['numProbes'] = sum(statesPJ.values())
-        result['numUnpublishable'] = 0
-        if result['numProbes'] > 0:
-            result['numUnpublishable'] = failedProcessing
+        states = dict(jobsSummary['states'])
+        statesPJ = dict(jobsSummary['statesPJ'])
+        statesTJ = dict(jobsSummary['statesTJ'])
 
         def terminate(states, jobStatus, target='no output'):
             if jobStatus in states:
@@ -719,14 +992,13 @@ class status(SubCommand):
             msg += " the Dagman Log files in:\n%s" % self.proxiedWebDir+"/AutomaticSplitting/"
             self.logger.info(msg)
             self.printSummaryForJobType('Probe Jobs', statesPJ)
-            self.printProbeJobsThroughput()
+            self.printProbeJobsThroughput(pendingProbeLog.get() if pendingProbeLog else self.retrieveProbeJobsLog())
 
 
         for jobtype, currStates in toPrint:
             if currStates:
                 self.printSummaryForJobType(jobtype, currStates)
         self.printRucioInfo(container)
-        return result
 
     def printSummaryForJobType(self, jobtype,states):
         currStates = states
@@ -740,25 +1012,27 @@ class status(SubCommand):
                                                         self._percentageString(jobStatus, currStates[jobStatus],
                                                                                total)))
 
-    def printProbeJobsThroughput(self):
-        """ print evnt/sec and bytes/event from probe jobs"""
+    def retrieveProbeJobsLog(self):
+        """ the content of the log of the probe jobs stage of automatic splitting, None if not available """
+        preDagLogUrl =  self.proxiedWebDir + "/AutomaticSplitting/DagLog0.txt"
+        try:
+            httpCode, content, _ = getWebDirFetcher(self.proxyfilename).get(preDagLogUrl, logger=self.logger)
+        except Exception as ex:  # pylint: disable=broad-except
+            self.logger.debug("Failed to retrieve %s: %s", preDagLogUrl, ex)
+            return None
+        if httpCode != 200:
+            return None
+        return content.decode('utf-8', 'replace')
+
+    def printProbeJobsThroughput(self, content):
+        """ print evnt/sec and bytes/event from probe jobs, content is the log from retrieveProbeJobsLog"""
         msg = "Estimated application throughput from probe jobs"
 
-        preDagLog = 'DagLog0.txt'
-        preDagLogUrl =  self.proxiedWebDir + "/AutomaticSplitting/" + preDagLog
-        tmpDir = tempfile.mkdtemp()
-        preDagLogFile = os.path.join(tmpDir, preDagLog)
-        httpCode = curlGetFileFromURL(url=preDagLogUrl, filename=preDagLogFile,
-                                      proxyfilename=self.proxyfilename, logger=self.logger)
-        logIsAvailable = httpCode == 200
-
-        if not logIsAvailable:
+        if content is None:
             msg += " is not available yet"
             self.logger.info(msg)
         else:
             # grab and print relevant lines from preDag.0.txt (lines 2, 4 and 5)
-            with open(preDagLogFile) as fp:
-                content = fp.read()
             if 'Ended TaskManagerBootstrap with code 4' in content:  # PreDag is waiting for probes to complete
                 msg += " is not available yet"
                 self.logger.info(msg)
@@ -770,127 +1044,45 @@ class status(SubCommand):
                     msg += '\n '+ line.split('PreDAG')[1]
                 self.logger.info(msg)
 
-    def printErrors(self, dictresult, automaticSplitt):
-        """ Iterate over dictresult['jobs'] if present, which is a dictionary like:
-                {'10': {'State': 'running'}, '1': {'State': 'failed', 'Error' : [10,'error message']}, '3': {'State': 'failed', 'Error' : [10,'error message']} ...
-            and group the errors per exit code counting how many jobs exited with a certain exit code, and print the summary
+    def printErrors(self, jobsSummary):
+        """ Print the summary of the errors of failed jobs, counted by summarizeJobs per exit code
+            and error message in a dictionary like
+                {(10, 'error message'): 2, (10, 'other message'): 1, (50664, 'message'): 7}
+            Exit codes are shown from the most frequent one to the less frequent one (or sorted
+            with --sort=exitcode), error messages from the most frequent one.
         """
-        # In general, there are N_{ec}_{em} jobs that failed with exit code ec and
-        # error message em.
-        # Since there may be different error messages for a given exit code, we use a
-        # map containing the exit code as key and as value a list with the different
-        # exit messages. For example:
-        # ec_errors = { '1040' : ["Failed due to bla", "Failed due to blabla"],
-        #              '60302' : ["File X does not exist", "File Y does not exist"]
-        #             }
-        ec_errors = {}
-        # We also want a map containing again the exit code as key, but as value a list
-        # with the lists of job ids that failed with given exit code and error message.
-        # For example:
-        # ec_jobids = { '1040' : [[1, 2, 3, 4, 5], [10, 12, 14]],
-        #              '60302' : [[6, 7, 8, 9, 10], [11, 13, 15]]
-        #             }
-        # where jobs [1, 2, 3, 4, 5] failed with error message "Failed due to bla",
-        # jobs [10, 12, 14] with "Failed due to blabla", jobs [6, 7, 8, 9, 10] with
-        # "File X does not exist" and jobs [11, 13, 15] with "File Y does not exist".
-        ec_jobids = {}
-        # We also want a map containing again the exit code as key, but as value a list
-        # with the numbers N_{ec}_{em}. For example:
-        # ec_numjobs = { '1040' : [N_{1040}_{"Failed due to bla"}, N_{1040}_{"Failed due to blabla"}],
-        #               '60302' : [N_{60302}_{"File X does not exist"}, N_{60302}_{"File Y does not exist"}]
-        #              }
-        # Actually, for later convenience when sorting by most frequent error messages
-        # for each exit code (i.e. sorting by N_{ec}_{em}), we add a second number
-        # representing the position of the error message em in the corresponding list
-        # in ec_errors[ec]. For example:
-        # ec_numjobs = { '1040' : [(N_{1040}_{"Failed due to bla"}, 1), (N_{1040}_{"Failed due to blabla"}, 2)],
-        #               '60302' : [(N_{60302}_{"File X does not exist"}, 1), (N_{60302}_{"File Y does not exist"}, 2)]
-        #              }
-        # We will later sort ec_numjobs[ec], which sorts according to the first number
-        # in the 2-tuples. So the sorted ec_numjobs dictionary could be for example:
-        # ec_numjobs = { '1040' : [(N_{1040}_{"Failed due to bla"}, 1), (N_{1040}_{"Failed due to blabla"}, 2)],
-        #               '60302' : [(N_{60302}_{"File Y does not exist"}, 2), (N_{60302}_{"File X does not exist"}, 1)]
-        #              }
-        # The second number in the 2-tuples allows to get the error message from
-        # ec_errors[ec]: given the sorted ec_numjobs dictionary, for each exit code
-        # (i.e. for each key) ec in the dictionary, the most frequent error messages
-        # are ec_errors[ec][ec_numjobs[ec][0][1]], ec_errors[ec][ec_numjobs[ec][1][1]], etc.
-        ec_numjobs = {}
-        unknown = 0
-        are_failed_jobs = False
-
-        def consider(jobid):
-            if self.options.long:
-                return True
-            if automaticSplitt and (jobid.startswith('0-') or '-' not in jobid):
-                return False
-            return True
-        for jobid, jobStatus in dictresult.items():
-            if jobStatus['State'] == 'failed' and consider(jobid):
-                are_failed_jobs = True
-                if 'Error' in jobStatus:
-                    ec = jobStatus['Error'][0] #exit code of this failed job
-                    em = jobStatus['Error'][1] #exit message of this failed job
-                    if ec not in ec_errors:
-                        ec_errors[ec] = []
-                    if ec not in ec_jobids:
-                        ec_jobids[ec] = []
-                    if ec not in ec_numjobs:
-                        ec_numjobs[ec] = []
-                    if em not in ec_errors[ec]:
-                        ec_numjobs[ec].append((1, len(ec_errors[ec])))
-                        ec_errors[ec].append(em)
-                        ec_jobids[ec].append([jobid])
-                    else:
-                        i = ec_errors[ec].index(em)
-                        ec_jobids[ec][i].append(jobid)
-                        ec_numjobs[ec][i] = (ec_numjobs[ec][i][0] + 1, ec_numjobs[ec][i][1])
-                else:
-                    unknown += 1
-        if are_failed_jobs:
+        errors = jobsSummary['errors']
+        examples = jobsSummary['errorExamples']
+        unknown = jobsSummary['unknownErrors']
+        if jobsSummary['numFailed']:
+            # For each exit code, the list of (number of jobs, position, error message) from the most
+            # frequent error message to the less frequent one, and the total number of jobs.
+            ec_numjobs = {}
+            ec_count = {}
+            for (ec, em), count in errors.items():
+                ec_numjobs.setdefault(ec, []).append((count, len(ec_numjobs[ec]), em))
+                ec_count[ec] = ec_count.get(ec, 0) + count
+            for numjobs in ec_numjobs.values():
+                numjobs.sort(reverse=True)
             # If option --sort=exitcodes was specified, show the error summary with the
             # exit codes sorted. Otherwise show it sorted from most frequent exit code to
             # less frequent.
-            exitCodes = []
-            if self.options.sort == "exitcode":
-                for ec in ec_numjobs.keys():
-                    if ec not in exitCodes:
-                        exitCodes.append(ec)
-                exitCodes.sort()
+            sortKeys = parseSortOption(self.options.sort) if self.options.sort else []
+            if sortKeys and sortKeys[0][0] == 'exitcode':
+                exitCodes = sorted(ec_count, reverse=sortKeys[0][1])
             else:
-                numjobsec = []
-                for ec, numjobs in ec_numjobs.items():
-                    count = 0
-                    for nj, _ in numjobs:
-                        count += nj
-                    numjobsec.append((count, ec))
-                numjobsec.sort()
-                numjobsec.reverse()
-                for _, ec in numjobsec:
-                    if ec not in exitCodes:
-                        exitCodes.append(ec)
-            # Sort the job ids in ec_jobids. Remember that ec_jobids[ec] is a list of lists
-            # of job ids, and that each job id is a string.
-            for ec in ec_jobids.keys():
-                for i in range(len(ec_jobids[ec])):
-                    ec_jobids[ec][i] = [str(y) for y in sorted([x for x in ec_jobids[ec][i]], key=cmp_to_key(compareJobids))]
+                exitCodes = [ec for _, ec in sorted(((count, ec) for ec, count in ec_count.items()), reverse=True)]
             # Error summary header.
             msg = "\nError Summary:"
             if not self.options.verboseErrors:
                 msg += " (use crab status --verboseErrors for details about the errors)"
             # Auxiliary variable for the layout of the error summary messages.
-            totnumjobs = len(dictresult)
+            totnumjobs = jobsSummary['numJobs']
             ndigits = int(math.ceil(math.log(totnumjobs+1, 10)))
             # For each exit code:
-            for i, ec in enumerate(exitCodes):
-                # Sort the error messages for this exit code from most frequent one to less
-                # frequent one.
-                numjobs = sorted(ec_numjobs[ec])
-                numjobs.reverse()
-                # Count the total number of failed jobs with this exit code.
-                count = 0
-                for nj, _ in numjobs:
-                    count += nj
+            for ec in exitCodes:
+                numjobs = ec_numjobs[ec]
+                count = ec_count[ec]
                 # Exit code 90000 means failure in postprocessing stage.
                 if ec == 90000:
                     msg += ("\n\n%" + str(ndigits) + "s jobs failed in postprocessing step%s") \
@@ -901,65 +1093,30 @@ class status(SubCommand):
                 if self.options.verboseErrors:
                     # Costumize the message depending on whether there is only one error message or
                     # more than one.
-                    if len(ec_errors[ec]) == 1:
-                        error_msg = ec_errors[ec][0]
+                    if len(numjobs) > 3:
+                        msg += "\n\t(Showing only the 3 most frequent errors messages for this exit code)"
+                    remainder = count
+                    # Show up to three different error messages.
+                    for nj, _, error_msg in numjobs[:3]:
                         msg += ("\n\n\t%" + str(ndigits) + "s jobs failed with following error message:") % (nj)
-                        msg += " (for example, job %s)" % (ec_jobids[ec][0][0])
+                        msg += " (for example, job %s)" % (examples[(ec, error_msg)])
                         msg += "\n\n\t\t" + "\n\t\t".join([line for line in error_msg.split('\n') if line])
-                    else:
-                        # Show up to three different error messages.
-                        remainder = count
-                        if len(ec_errors[ec]) > 3:
-                            msg += "\n\t(Showing only the 3 most frequent errors messages for this exit code)"
-                        for nj, ne in numjobs[:3]:
-                            error_msg = ec_errors[ec][ne]
-                            msg += ("\n\n\t%" + str(ndigits) + "s jobs failed with following error message:") % (nj)
-                            msg += " (for example, job %s)" % (ec_jobids[ec][ne][0])
-                            msg += "\n\n\t\t" + "\n\t\t".join([line for line in error_msg.split('\n') if line])
-                            remainder -= nj
-                        if remainder > 0:
-                            msg += "\n\n\tFor the error messages of the other %s jobs," % (remainder)
-                            msg += " please have a look at the dashboard task monitoring web page."
+                        remainder -= nj
+                    if remainder > 0:
+                        msg += "\n\n\tFor the error messages of the other %s jobs," % (remainder)
+                        msg += " please have a look at the dashboard task monitoring web page."
             if unknown:
                 msg += "\n\nCould not find exit code details for %s jobs." % (unknown)
             msg += "\n\nHave a look at https://twiki.cern.ch/twiki/bin/viewauth/CMSPublic/JobExitCodes for a description of the exit codes."
             self.logger.info(msg)
 
-    def printSummary(self, dictresult):
-        """ Print the information about jobs on each site:
+    def printSummary(self, jobsSummary):
+        """ Print the information about jobs on each site, as computed by summarizeJobs:
                 - How many jobs are or were running on the site and in which state,
                 - Runtime for each site.
         """
-
-        sites = {}
-        default_info = {"Runtime": 0, "Waste": 0, "Running": 0, "Success": 0, "Failed": 0, "Stageout": 0}
-        siteHistory_retrieved = False
-        for job in dictresult:
-            info = dictresult[job]
-            state = info['State']
-            site_history = info.get("SiteHistory")
-            if not site_history:
-                continue
-            siteHistory_retrieved = True
-            walls = info['WallDurations']
-            cur_site = info['SiteHistory'][-1]
-            cur_info = sites.setdefault(cur_site, dict(default_info))
-            for site, wall in zip(site_history[:-1], walls[:-1]):
-                info = sites.setdefault(site, dict(default_info))
-                info['Failed'] += 1
-                info['Waste'] += wall
-            if state in ['failed', 'cooloff', 'held', 'killed'] or (state == 'idle' and cur_site != 'Unknown'):
-                cur_info['Failed'] += 1
-                cur_info['Waste'] += walls[-1]
-            elif state == 'transferring':
-                cur_info['Stageout'] += 1
-                cur_info['Runtime'] += walls[-1]
-            elif state == 'running':
-                cur_info['Running'] += 1
-                cur_info['Runtime'] += walls[-1]
-            elif state == 'finished':
-                cur_info['Success'] += 1
-                cur_info['Runtime'] += walls[-1]
+        sites = jobsSummary['sites']
+        siteHistory_retrieved = jobsSummary['siteHistoryRetrieved']
 
         # avoid printing header only
         if not siteHistory_retrieved:
@@ -979,82 +1136,88 @@ class status(SubCommand):
 
         self.logger.info("")
 
-    def printSort(self, sortdict, sortby):
-        """ Print information about jobs sorted by a certain attribute.
+    def printSiteAnalytics(self, siteAnalytics):
+        """ Print the distributions of the job metrics on each site, as computed by analyzeSites """
+        if not siteAnalytics:
+            self.logger.info("No SiteHistory retrieved for any job\n")
+            return
+        def optional(formatter, value):
+            return formatter(value) if value is not None else '-'
+        percent = lambda value: "%.0f%%" % value
+        megabytes = lambda value: "%.0fMB" % value
+        lines = ["Site Performance Table (including retries, median and 90th percentile of the ended runs):\n",
+                 "%-20s %7s %7s %6s %10s %10s %8s %8s %8s  %s" % ("Site", "Runs", "Running", "Failed", "Wall p50", "Wall p90",
+                                                                "CPU p50", "Mem p50", "Mem p90", "Top exit codes (jobs, % of runs)")]
+        for site in sorted(siteAnalytics):
+            info = siteAnalytics[site]
+            failureRate = info['failureRate'] * 100 if info['failureRate'] is not None else None
+            exitCodes = sorted(info['exitCodes'].items(), key=lambda item: (-item[1], item[0]))[:SITE_TOP_EXIT_CODES]
+            lines.append("%-20s %7d %7d %6s %10s %10s %8s %8s %8s  %s" %
+                         (site, info['runs'], info['running'], optional(percent, failureRate),
+                          optional(to_hms, info['wallP50']), optional(to_hms, info['wallP90']),
+                          optional(percent, info['cpuEffP50']), optional(megabytes, info['memoryP50']),
+                          optional(megabytes, info['memoryP90']),
+                          " ".join("%s (%d, %.0f%%)" % (exitCode, count, info['exitCodeRates'][exitCode] * 100)
+                                   for exitCode, count in exitCodes)))
+        lines.append("")
+        self.logger.info("\n".join(lines))
+
+    def printSort(self, sortdict, sortby, top=None):
+        """ Print information about jobs sorted by one or more attributes, e.g. 'site,memory'
+            ('-memory' for decreasing memory), only the first top jobs if top is given.
+            Jobs with the same values are in job id order.
         """
-        sortmatrix = []
-        valuedict = {}
+        sortKeys = parseSortOption(sortby)
+        jobids = sortJobids(sortdict, sortdict.table.sortKeys)
+        sortValues = sortdict.sortValues(sortKeys)
+        jobids.sort(key=sortValues.__getitem__)
+        numJobs = len(jobids)
+        if top:
+            jobids = jobids[:top]
+        keys = [key for key, _ in sortKeys]
+        sortby = keys[0]
         self.logger.info('')
-        for jobid in sortdict:
-            if sortby in ['exitcode']:
-                if sortdict[jobid][sortby] != 'Unknown':
-                    value = int(sortdict[jobid][sortby])
-                else:
-                    value = 999999
-                if value not in sortmatrix:
-                    sortmatrix.append(value)
-                sortmatrix.sort()
-                if value not in valuedict:
-                    valuedict[value] = [jobid]
-                else:
-                    valuedict[value].append(jobid)
-            elif sortby in ['state', 'site']:
-                value = sortdict[jobid][sortby]
-                if value not in valuedict:
-                    valuedict[value] = [jobid]
-                else:
-                    valuedict[value].append(jobid)
-            elif sortby in ['memory', 'cpu', 'retries']:
-                if sortdict[jobid][sortby] != 'Unknown':
-                    value = int(sortdict[jobid][sortby])
-                else:
-                    value = 999999
-                sortmatrix.append((value, jobid))
-                sortmatrix.sort()
-            elif sortby in ['runtime', 'waste']:
+        if len(keys) > 1:
+            titles = {'state': 'State', 'site': 'Site', 'runtime': 'Runtime', 'memory': 'Mem (MB)', 'cpu': 'CPU %',
+                      'retries': 'Retries', 'waste': 'Waste', 'exitcode': 'Exit Code'}
+            columns = [('job', "Job", "%4s")] + [(key, titles[key], SORT_COLUMN_FORMATS[key]) for key in keys]
+            with TableWriter(self.logger, columns, title="Jobs sorted by %s:\n" % (", ".join(keys))) as writer:
+                for jobid in jobids:
+                    row = sortdict[jobid]
+                    row['job'] = jobid
+                    writer.write(row)
+        elif sortby in ['exitcode', 'state', 'site']:
+            # one line per value, with all the jobs which have it
+            groups = []
+            for jobid in jobids:
                 value = sortdict[jobid][sortby]
-                realvaluematrix = value.split(':')
-                realvalue = 3600*int(realvaluematrix[0]) + 60*int(realvaluematrix[1]) + int(realvaluematrix[2])
-                sortmatrix.append((realvalue, value, jobid))
-                sortmatrix.sort()
-        if sortby in ['exitcode']:
-            msg = "Jobs sorted by exit code:\n"
-            msg += "\n%-20s %-20s\n" % ('Exit Code', 'Job Id(s)')
-            for value in sortmatrix:
-                if value == 999999:
-                    esignvalue = 'Unknown'
-                else:
-                    esignvalue = str(value)
-                jobids = sorted(valuedict[value], key=cmp_to_key(compareJobids))
-                msg += "\n%-20s %-s" % (esignvalue, ", ".join(jobids))
-            self.logger.info(msg)
-        elif sortby in ['state', 'site']:
-            msg = "Jobs sorted by %s:\n" % (sortby)
-            msg += "\n%-20s %-20s\n" % (sortby.title(), 'Job Id(s)')
-            for value in valuedict:
-                msg += "\n%-20s %-s" % (value, ", ".join(valuedict[value]))
-            self.logger.info(msg)
+                if not groups or groups[-1][0] != value:
+                    groups.append((value, []))
+                groups[-1][1].append(jobid)
+            if sortby == 'exitcode':
+                msg = "Jobs sorted by exit code:\n"
+                msg += "\n%-20s %-20s\n" % ('Exit Code', 'Job Id(s)')
+            else:
+                msg = "Jobs sorted by %s:\n" % (sortby)
+                msg += "\n%-20s %-20s\n" % (sortby.title(), 'Job Id(s)')
+            logLines(self.logger, itertools.chain([msg], ("%-20s %-s" % (value, ", ".join(groupJobids))
+                                                          for value, groupJobids in groups)))
         elif sortby in ['memory', 'cpu', 'retries']:
-            msg = "Jobs sorted by %s used:\n" % (sortby)
+            lines = ["Jobs sorted by %s used:" % (sortby)]
             if sortby == 'memory':
-                msg += "%-10s %-10s\n" % ("Memory (MB)".center(10), "Job Id".center(10))
+                lines.append("%-10s %-10s" % ("Memory (MB)".center(10), "Job Id".center(10)))
             elif sortby == 'cpu':
-                msg += "%-10s %-10s\n" % ("CPU".center(10), "Job Id".center(10))
+                lines.append("%-10s %-10s" % ("CPU".center(10), "Job Id".center(10)))
             elif sortby == 'retries':
-                msg += "%-10s %-10s\n" % ("Retries".center(10), "Job Id".center(10))
-            for value in sortmatrix:
-                if value[0] == 999999:
-                    esignvalue = 'Unknown'
-                else:
-                    esignvalue = value[0]
-                msg += "%10s %10s\n" % (str(esignvalue).center(10), value[1].center(10))
-            self.logger.info(msg)
+                lines.append("%-10s %-10s" % ("Retries".center(10), "Job Id".center(10)))
+            rows = ("%10s %10s" % (str(sortdict[jobid][sortby]).center(10), jobid.center(10)) for jobid in jobids)
+            logLines(self.logger, itertools.chain(lines, rows, [""]))
         elif sortby in ['runtime', 'waste']:
-            msg = "Jobs sorted by %s used:\n" % (sortby)
-            msg += "%-10s %-5s\n" % (sortby.title(), "Job Id")
-            for value in sortmatrix:
-                msg += "%-10s %-5s\n" % (value[1], value[2].center(5))
-            self.logger.info(msg)
+            lines = ["Jobs sorted by %s used:" % (sortby), "%-10s %-5s" % (sortby.title(), "Job Id")]
+            rows = ("%-10s %-5s" % (sortdict[jobid][sortby], jobid.center(5)) for jobid in jobids)
+            logLines(self.logger, itertools.chain(lines, rows, [""]))
+        if top and numJobs > top:
+            self.logger.info("Showing the first %d of %d jobs.", top, numJobs)
 
         self.logger.info('')
 
@@ -1088,29 +1251,24 @@ class status(SubCommand):
 
             self.logger.info(msg)
 
-    def printPublication(self, publicationEnabled, shortResult, taskname, user, crabDBInfo, container=None):
+    def printPublication(self, publicationEnabled, jobsSummary, taskname, user, crabDBInfo, container=None,
+                         pendingPubStatus=None):
         """Print information about the publication of the output files in DBS.
+           pendingPubStatus is the pending result of publicationStatus, if already started.
         """
         # Collecting publication information
         pubStatus = {}
-        jobsPerStatus = shortResult['jobsPerStatus']
-        numProbes = shortResult['numProbes']
-        numUnpublishable = shortResult['numUnpublishable']
-        finishedJobs = jobsPerStatus['finished'] if 'finished' in jobsPerStatus else 0
-        # beware probe jobs in automatic splitting, some may have failed, can't rely on totala in jobsPerStatus
-        # need to explicitely skip probes in counting
-        if numProbes > 0:
-            finishedJobs = 0
-            for job in shortResult['jobList']:  # each job is a list of two strings [status, id]
-                jobId = job[1]
-                if jobId.startswith('0-'):  # probe job
-                    continue
-                if job[0] == 'finished':
-                    finishedJobs += 1
+        jobsPerStatus = jobsSummary['jobsPerStatus']
+        numProbes = jobsSummary['numProbes']
+        numUnpublishable = jobsSummary['numUnpublishable']
+        # beware probe jobs in automatic splitting, some may have failed, can't rely on totals in jobsPerStatus
+        finishedJobs = jobsSummary['numFinished']
         if (publicationEnabled and finishedJobs):
-            pubStatus = self.publicationStatus(taskname, user)
+            pubStatus = pendingPubStatus.get() if pendingPubStatus else self.publicationStatus(taskname, user)
         elif not publicationEnabled:
             pubStatus['status'] = {'disabled': []}
+        if not self.renderOutput:
+            return pubStatus
         pubInfo = {}
         pubInfo['publication'] = pubStatus.get('status', {})
         pubInfo['publicationFailures'] = pubStatus.get('failure_reasons', {})
@@ -1192,16 +1350,22 @@ class status(SubCommand):
 
         return pubStatus
 
-    def printRucioQuotaInfo(self, lfn, site):
+    def getRucioQuotaInfo(self, lfn, site):
+        """ the Rucio quota of the user at the destination site, None if it is not checked """
         if not self.rucio:
-            return
+            return None
         if site == 'T3_CERN_CERNBOX':
-            return
+            return None
         # We need to switch to group account when needed untils CMS Rucio fix
         # the permission issue.
         # See https://mattermost.web.cern.ch/cms-o-and-c/pl/ej7zwkr747rifezzcyyweisx9r
         rucioClient = getRucioClientFromLFN(self.rucio, lfn, self.logger)
-        quotaCheck = isEnoughRucioQuota(rucioClient, site)
+        return isEnoughRucioQuota(rucioClient, site)
+
+    def printRucioQuotaInfo(self, site, quotaCheck):
+        """ print the Rucio quota from getRucioQuotaInfo """
+        if not quotaCheck:
+            return
         self.logger.info("You have %d/%d GBytes available as Rucio quota at site %s" % (quotaCheck['free'], quotaCheck['total'], site))
         if not quotaCheck['isEnough']:
             msg = "%sALARM: Not enough space at ASO destination %s" % (colors.RED, colors.NORMAL)
@@ -1231,22 +1395,67 @@ class status(SubCommand):
         self.parser.add_option("--sort",
                                dest="sort",
                                default=None,
-                               help="Sort failed jobs by 'state', 'site', 'runtime', 'memory', 'cpu', 'retries', 'waste' or 'exitcode'.")
+                               help="Sort jobs by 'state', 'site', 'runtime', 'memory', 'cpu', 'retries', 'waste' or 'exitcode'." + \
+                                    " Several comma separated keys can be given, e.g. --sort=site,memory," + \
+                                    " and a key starting with '-' sorts in decreasing order, e.g. --sort=-memory.")
+        self.parser.add_option("--top",
+                               dest="top",
+                               default=None,
+                               type="int",
+                               help="With --sort, print only the first TOP jobs.")
+        self.parser.add_option("--columns",
+                               dest="columns",
+                               default=None,
+                               help="With --long, print only these columns of the job status table, comma separated" + \
+                                    " among %s." % ", ".join(key for key, _, _ in DETAILS_COLUMNS[1:]))
         self.parser.add_option("--json",
                                dest="json",
                                default=False,
                                action="store_true",
                                help="Print status results in JSON format.")
-        self.parser.add_option("--summary",
-                               dest="summary",
+        self.parser.add_option("--export",
+                               dest="export",
+                               default=None,
+                               help="Write the table of the jobs (state, site, wall and CPU time, memory, retries, exit code)" + \
+                                    " to the file EXPORT: CSV, or Parquet or Arrow for the .parquet and .arrow extensions" + \
+                                    " (these need the pyarrow python module).")
+        self.parser.add_option("--exportRetries",
+                               dest="exportRetries",
                                default=False,
                                action="store_true",
-                               help="Print site summary.")
+                               help="With --export, add one row for each previous retry of the jobs.")
+        self.parser.add_option("--summary",
+                               dest="summary",
+                               default=None,
+                               action="callback",
+                               callback=summaryOptionCallback,
+                               help="Print site summary: the jobs on each site, or with --summary=sites the median" + \
+                                    " and 90th percentile of the wall time, CPU efficiency and memory, the failure rate" + \
+                                    " and the exit codes on each site.")
         self.parser.add_option("--verboseErrors",
                                dest="verboseErrors",
                                default=False,
                                action="store_true",
                                help="Expand error summary, showing error messages for all failed jobs.")
+        self.parser.add_option("--normalizeErrors",
+                               dest="normalizeErrors",
+                               default=False,
+                               action="store_true",
+                               help="In the error summary, count together the error messages which differ only" + \
+                                    " by file names and numbers (use with --verboseErrors).")
+        self.parser.add_option("--watch",
+                               dest="watch",
+                               default=None,
+                               action="callback",
+                               callback=watchOptionCallback,
+                               help="Keep running, and print the jobs which change state every INTERVAL seconds" + \
+                                    " (optional, default %d, the time grows while nothing changes)." % WATCH_DEFAULT_INTERVAL)
+        self.parser.add_option("--history",
+                               dest="history",
+                               default=False,
+                               action="store_true",
+                               help="Print how the number of jobs in each state changed, as seen by the previous crab status" + \
+                                    " commands (the last %d changes)." % HISTORY_MAX_ROWS)
         self.parser.add_option("--jobids",
                                dest="jobids",
                                default=None,
@@ -1258,20 +1467,526 @@ class status(SubCommand):
         SubCommand.validateOptions(self)
 
         if self.options.sort is not None:
-            sortOpts = ["state", "site", "runtime", "memory", "cpu", "retries", "waste", "exitcode"]
-            if self.options.sort not in sortOpts:
+            wrongKeys = [key for key, _ in parseSortOption(self.options.sort) if key not in SORT_KEYS]
+            if wrongKeys or not self.options.sort.strip(', '):
+                msg = "%sError%s:" % (colors.RED, colors.NORMAL)
+                msg += " Only the following values are accepted for --sort option: %s" % (SORT_KEYS)
+                msg += " (comma separated, with '-' in front for decreasing order)"
+                raise ConfigurationException(msg)
+        if self.options.top is not None:
+            if not self.options.sort:
+                raise ConfigurationException("The --top option can only be used with the --sort option.")
+            if self.options.top < 1:
+                raise ConfigurationException("The value of --top must be a positive number of jobs.")
+
+        if self.options.columns is not None:
+            if not self.options.long:
+                raise ConfigurationException("The --columns option can only be used with the --long option.")
+            wrongColumns = [key for key in self.options.columns.split(',') if key not in [k for k, _, _ in DETAILS_COLUMNS[1:]]]
+            if wrongColumns:
                 msg = "%sError%s:" % (colors.RED, colors.NORMAL)
-                msg += " Only the following values are accepted for --sort option: %s" % (sortOpts)
+                msg += " Only the following values are accepted for --columns option: %s" % \
+                       ", ".join(key for key, _, _ in DETAILS_COLUMNS[1:])
                 raise ConfigurationException(msg)
 
+        if self.options.exportRetries and not self.options.export:
+            raise ConfigurationException("The --exportRetries option can only be used with the --export option.")
+        if self.options.export and not canExport(self.options.export):
+            msg = "%sError%s:" % (colors.RED, colors.NORMAL)
+            msg += " Writing %s requires the pyarrow python module, which is not available." % self.options.export
+            msg += " Use a file with the .csv extension instead."
+            raise ConfigurationException(msg)
+
         if self.options.jobids:
             jobidstuple = validateJobids(self.options.jobids)
             self.jobids = [str(jobid) for (_, jobid) in jobidstuple]
 
+        if self.options.watch is not None:
+            if self.options.watch < WATCH_MIN_INTERVAL:
+                msg = "%sError%s:" % (colors.RED, colors.NORMAL)
+                msg += " The --watch interval must be at least %d seconds." % WATCH_MIN_INTERVAL
+                raise ConfigurationException(msg)
+            if self.options.json:
+                raise ConfigurationException("Option --watch can not be used together with --json.")
+
+        if self.args:
+            # more than one project directory, see expandProjdirPatterns
+            self.projdirs = [self.options.projdir]
+            for projdir in self.args:
+                if not os.path.isfile(os.path.join(projdir, '.requestcache')):
+                    msg = "%sError%s:" % (colors.RED, colors.NORMAL)
+                    msg += " %s is not a valid CRAB project directory." % (projdir)
+                    raise ConfigurationException(msg)
+                if projdir not in self.projdirs:
+                    self.projdirs.append(projdir)
+            self.args = []
+            singleTaskOptions = ['long', 'columns', 'sort', 'top', 'summary', 'verboseErrors', 'normalizeErrors', 'history', 'jobids', 'watch',
+                                 'export', 'exportRetries']
+            used = ['--' + option for option in singleTaskOptions if getattr(self.options, option)]
+            if used:
+                msg = "%sError%s:" % (colors.RED, colors.NORMAL)
+                msg += " Option(s) %s can only be used with one project directory." % (", ".join(used))
+                raise ConfigurationException(msg)
+
         if self.options.jobids and not (self.options.long or self.options.sort):
             raise ConfigurationException("Parameter --jobids can only be used in combination "
                                          "with --long or --sort options.")
 
+def parseTxtStatusCache(statusCacheData):
+    """ (statusCacheInfo, bootstrapMsg, bootingTime) from the content of the old text
+        status_cache file: the job table or, while the task bootstraps, None and the message
+        with the time since the bootstrap in seconds.
+    """
+    # Normally the first two lines of the file contain the checkpoint locations
+    # for the job_log / fjr_parse_results files and are used by the status caching script.
+    # But if the job has just bootstrapped the first lines of the file are:
+    #  line1: a readable message  line2: bootstrap time in seconds from Epoch
+    #  Example:
+    #   # Task bootstrapped at 2021-03-22 16:23:54 UTC
+    #   1616430956
+    # and a dummy, empty, status record follows
+    lines = statusCacheData.split('\n')
+    if lines[0].startswith('#'):
+        bootstrapTime = lines[1]
+        bootstrapMsg = lines[0].lstrip('#').lstrip()
+        if bootstrapTime:
+            bootingTime = int(time.time()) - literal_eval(bootstrapTime)
+        else:
+            bootingTime = 199
+        bootstrapMsg += ". %d seconds ago" % bootingTime
+        return None, bootstrapMsg, bootingTime
+    # Load the job_report summary
+    return literal_eval(lines[2]), None, None
+
+
+def expandProjdirPatterns(cmdargs):
+    """ Expand a -d/--dir value with wildcards (e.g. -d 'crab_projects/crab_*') into the matching
+        directories: the first one stays as -d value and the others are added as arguments,
+        which is also what the shell does with an unquoted pattern
+    """
+    if not cmdargs:
+        return cmdargs
+    expanded = []
+    others = []
+    args = list(cmdargs)
+    while args:
+        arg = args.pop(0)
+        pattern = None
+        if arg in ['-d', '--dir'] and args and glob.has_magic(args[0]):
+            pattern = args.pop(0)
+        elif arg.startswith('--dir=') and glob.has_magic(arg[len('--dir='):]):
+            pattern = arg[len('--dir='):]
+        if pattern is None:
+            expanded.append(arg)
+            continue
+        matches = sorted(match for match in glob.glob(pattern) if os.path.isdir(match))
+        # with no match, leave it to the usual check to complain
+        expanded += ['--dir', matches[0] if matches else pattern]
+        others += matches[1:]
+    return expanded + others
+
+def normalizeErrorMessage(message):
+    """ The error message with the file names, URLs, identifiers and numbers replaced by
+        placeholders, so that errors which differ only by them can be counted together
+    """
+    for regex, placeholder in ERROR_NORMALIZATIONS:
+        message = regex.sub(placeholder, message)
+    return message
+
+def parseSortOption(sort):
+    """ [(key, descending)] for the value of --sort, e.g. 'site,-memory' gives
+        [('site', False), ('memory', True)]
+    """
+    sortKeys = []
+    for key in sort.split(','):
+        key = key.strip()
+        if key:
+            sortKeys.append((key.lstrip('-'), key.startswith('-')))
+    return sortKeys
+
+def watchOptionCallback(option, opt_str, value, parser):  # pylint: disable=unused-argument
+    """ --watch takes an optional interval in seconds, i.e. "--watch" or "--watch 60"
+    """
+    interval = WATCH_DEFAULT_INTERVAL
+    if parser.rargs and parser.rargs[0].isdigit():
+        interval = int(parser.rargs.pop(0))
+    setattr(parser.values, option.dest, interval)
+
+def summaryOptionCallback(option, opt_str, value, parser):  # pylint: disable=unused-argument
+    """ --summary takes an optional kind of summary among SUMMARY_KINDS, i.e. "--summary" or "--summary sites"
+    """
+    kind = SUMMARY_KINDS[0]
+    if parser.rargs and parser.rargs[0] in SUMMARY_KINDS:
+        kind = parser.rargs.pop(0)
+    setattr(parser.values, option.dest, kind)
+
+def splitOptionValues(cmdargs):
+    """ Split --option=value into --option value for the OPTIONAL_VALUE_OPTIONS: optparse only
+        accepts the first form for options which always take a value, and crabCommand() uses it
+    """
+    if not cmdargs:
+        return cmdargs
+    args = []
+    for arg in cmdargs:
+        name, equal, value = arg.partition('=')
+        if equal and name in OPTIONAL_VALUE_OPTIONS:
+            args += [name, value]
+        else:
+            args.append(arg)
+    return args
+
+def detailStateName(kind, state, automaticSplitt):
+    """ The state shown in the extended job status table for a job of this kind (MAIN, PROBE or TAIL)
+        and status_cache state: in automatic splitting the failed main jobs are rescheduled as tail jobs
+        and probe jobs do not produce output.
+    """
+    if state == 'cooloff':
+        state = 'toRetry'
+    if automaticSplitt:
+        if kind == PROBE and state in ('finished', 'failed'):
+            return 'no output'
+        if kind == MAIN and state == 'failed':
+            return 'rescheduled'
+    return state
+
+def cpuPercentage(state, wall, cpuTime, numCores):
+    """ CPU efficiency of a job in the extended job status table, None if unknown
+    """
+    if state in ['toRetry', 'failed', 'finished'] and not wall:
+        return 0
+    if wall and cpuTime >= 0:
+        return (cpuTime / float(wall*numCores)) * 100
+    return None
+
+class JobDetails(Mapping):
+    """ Read-only {jobid: row of the extended job status table}, the row of a job is
+        made from the columns of the StatusCacheTable when it is looked up.
+    """
+
+    def __init__(self, table, indexes, automaticSplitt, numCores):
+        self.table = table
+        self.automaticSplitt = automaticSplitt
+        self.numCores = numCores
+        self.indexes = dict((table.jobids[i], i) for i in indexes)
+
+    def __getitem__(self, jobid):
+        table = self.table
+        i = self.indexes[jobid]
+        stateName = table.stateNames[table.states[i]]
+        state = detailStateName(table.kinds[i], stateName, self.automaticSplitt)
+        wall = max(table.walls[i], 0)
+        mem = 'Unknown' if table.rss[i] < 0 else '%d' % (table.rss[i]/1024)
+        cpu = cpuPercentage(state, wall, table.cpuTimes[i], self.numCores)
+        ec = 'Unknown'
+        if stateName == 'finished':
+            ec = '0'
+        elif table.errors[i] >= 0:
+            ec = str(table.errorValues[table.errors[i]][0]) # exit code of this failed job
+        return {'state': state, 'site': table.siteNames[table.sites[i]] if table.sites[i] >= 0 else '',
+                'runtime': to_hms(wall), 'memory': mem, 'cpu': 'Unknown' if cpu is None else "%.0f" % cpu,
+                'retries': table.retries[i], 'restarts': table.restarts[i],
+                'waste': to_hms(table.wastes[i]), 'exitcode': ec}
+
+    def __iter__(self):
+        return iter(self.indexes)
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def sortValues(self, sortKeys):
+        """ {jobid: tuple of numbers} to sort the jobs by the [(key, descending)] sortKeys of --sort,
+            computed from the columns of the table. States and sites are sorted by name, unknown
+            values go last.
+        """
+        table = self.table
+        detailStates = {}
+        for kind, state in set(zip(table.kinds, table.states)):
+            detailStates[(kind, state)] = detailStateName(kind, table.stateNames[state], self.automaticSplitt)
+        stateRanks = dict((name, rank) for rank, name in enumerate(sorted(set(detailStates.values()))))
+        siteRanks = dict((name, rank) for rank, name in enumerate(sorted(table.siteNames)))
+        finished = table.stateCode('finished')
+
+        def sortValue(key, i):
+            """ the value of key for the job at position i of the table, None if unknown """
+            if key == 'state':
+                return stateRanks[detailStates[(table.kinds[i], table.states[i])]]
+            if key == 'site':
+                return siteRanks[table.siteNames[table.sites[i]]] if table.sites[i] >= 0 else None
+            if key == 'runtime':
+                return int(max(table.walls[i], 0))
+            if key == 'waste':
+                return int(table.wastes[i])
+            if key == 'memory':
+                return int(table.rss[i]/1024) if table.rss[i] >= 0 else None
+            if key == 'cpu':
+                state = detailStates[(table.kinds[i], table.states[i])]
+                cpu = cpuPercentage(state, max(table.walls[i], 0), table.cpuTimes[i], self.numCores)
+                return None if cpu is None else int("%.0f" % cpu)
+            if key == 'retries':
+                return table.retries[i]
+            if key == 'exitcode':
+                if table.states[i] == finished:
+                    return 0
+                return int(table.errorValues[table.errors[i]][0]) if table.errors[i] >= 0 else None
+            raise ValueError("Unknown sort key %s" % key)
+
+        values = {}
+        for jobid, i in self.indexes.items():
+            value = []
+            for key, descending in sortKeys:
+                keyValue = sortValue(key, i)
+                if keyValue is None:
+                    value += [1, 0]
+                else:
+                    value += [0, -keyValue if descending else keyValue]
+            values[jobid] = tuple(value)
+        return values
+
+def summarizeJobs(statusCache, automaticSplitt, numCores=1, allErrors=False, jobids=None, onlyCounts=False,
+                  normalizeErrors=False):
+    """ Go once over the jobs in the status cache (a StatusCacheTable, or the {jobid: info} dictionary)
+        and collect everything which is printed by crab status, so that printOverview, printErrors,
+        printDetails, printSummary and makeStatusReturnDict only have to format it:
+            - jobsPerStatus, jobList, numJobs, numFinished (non probe jobs), numProbes, numUnpublishable
+            - states, statesPJ, statesTJ: number of main, probe and tail jobs per status
+            - errors: {(exitCode, errorMessage): number of jobs} of the failed jobs (only tail jobs for
+              automatic splitting, unless allErrors), with normalizeErrors the messages which differ only
+              by file names and numbers count together; errorExamples: the first job id for each of them;
+              unknownErrors and numFailed
+            - sites: runtime, waste and number of jobs per state for each site, siteHistoryRetrieved
+            - details: the rows of the extended job status table for each job (or for the jobs in
+              jobids), clusterIds and the memory/runtime/cpu metrics of those jobs
+        With onlyCounts only the number of jobs per status are collected.
+    """
+    table = statusCache if isinstance(statusCache, StatusCacheTable) else StatusCacheTable(statusCache)
+    stateNames = table.stateNames
+    jobsPerStatus = {}
+    states = {}
+    statesPJ = {}
+    statesTJ = {}
+    failedProcessing = 0
+    numFinished = 0
+    # the number of jobs of each kind in each state, in the order they appear in status_cache
+    for (kind, code), count in Counter(zip(table.kinds, table.states)).items():
+        rawState = stateNames[code]
+        jobsPerStatus[rawState] = jobsPerStatus.get(rawState, 0) + count
+        jobStatus = rawState if rawState != 'cooloff' else 'toRetry'
+        kindStates = {PROBE: statesPJ, TAIL: statesTJ, MAIN: states}[kind]
+        kindStates[jobStatus] = kindStates.get(jobStatus, 0) + count
+        if kind == MAIN and jobStatus == 'failed':
+            failedProcessing += count
+        if kind != PROBE and rawState == 'finished':
+            numFinished += count
+    numProbes = sum(statesPJ.values())
+    summary = {'jobsPerStatus': jobsPerStatus, 'numJobs': len(table),
+               'jobList': [[stateNames[code], jobid] for code, jobid in zip(table.states, table.jobids)],
+               'numFinished': numFinished, 'numProbes': numProbes,
+               'numUnpublishable': failedProcessing if numProbes > 0 else 0,
+               'states': states, 'statesPJ': statesPJ, 'statesTJ': statesTJ}
+    if onlyCounts:
+        return summary
+
+    # Errors, counted per exit code and (normalized) error message.
+    errorKeys = table.errorValues
+    if normalizeErrors:
+        errorKeys = [(ec, normalizeErrorMessage(em)) for ec, em in errorKeys]
+    errors = Counter()
+    errorExamples = {}
+    unknownErrors = 0
+    numFailed = 0
+    failed = table.stateCode('failed')
+    sortKeys = table.sortKeys if failed >= 0 else None
+    for i, code in enumerate(table.states):
+        if code == failed and (allErrors or not automaticSplitt or table.kinds[i] == TAIL):
+            numFailed += 1
+            if table.errors[i] >= 0:
+                errorKey = errorKeys[table.errors[i]]
+                errors[errorKey] += 1
+                jobid = table.jobids[i]
+                if errorKey not in errorExamples or sortKeys[jobid] < sortKeys[errorExamples[errorKey]]:
+                    errorExamples[errorKey] = jobid
+            else:
+                unknownErrors += 1
+
+    # Jobs on each site, including retries.
+    sites = {}
+    siteNames = table.siteNames
+    siteSummaries = [None] * len(siteNames)
+    def siteSummary(site):
+        if siteSummaries[site] is None:
+            siteSummaries[site] = sites[siteNames[site]] = dict(SITE_SUMMARY_DEFAULT)
+        return siteSummaries[site]
+    prevOffsets = table.prevOffsets
+    for i, site in enumerate(table.sites):
+        if site < 0:
+            continue
+        curInfo = siteSummary(site)
+        for prev in range(prevOffsets[i], prevOffsets[i+1]):
+            siteInfo = siteSummary(table.prevSites[prev])
+            siteInfo['Failed'] += 1
+            siteInfo['Waste'] += table.prevWalls[prev]
+        rawState = stateNames[table.states[i]]
+        wall = max(table.walls[i], 0)
+        if rawState in ['failed', 'cooloff', 'held', 'killed'] or (rawState == 'idle' and siteNames[site] != 'Unknown'):
+            curInfo['Failed'] += 1
+            curInfo['Waste'] += wall
+        elif rawState == 'transferring':
+            curInfo['Stageout'] += 1
+            curInfo['Runtime'] += wall
+        elif rawState == 'running':
+            curInfo['Running'] += 1
+            curInfo['Runtime'] += wall
+        elif rawState == 'finished':
+            curInfo['Success'] += 1
+            curInfo['Runtime'] += wall
+
+    # Metrics of the jobs in the extended job status table.
+    if jobids:
+        index = table.index
+        indexes = sorted(index[str(jobid)] for jobid in set(jobids))
+    else:
+        indexes = range(len(table))
+    # the state shown in the table for each kind of job and status_cache state
+    detailStates = dict((key, detailStateName(key[0], stateNames[key[1]], automaticSplitt))
+                        for key in set(zip(table.kinds, table.states)))
+    mem_cnt, mem_min, mem_max, mem_sum = 0, -1, 0, 0
+    run_cnt, run_min, run_max, run_sum = 0, -1, 0, 0
+    cpu_min, cpu_max, cpu_sum = -1, 0, 0
+    wall_sum = 0
+    runtimes = array('d')
+    for i in indexes:
+        kind = table.kinds[i]
+        state = detailStates[(kind, table.states[i])]
+        # exclude not-run and probe jobs from metric
+        jobForMetrics = state not in ['idle', 'running', 'unsubmitted'] and kind != PROBE
+        wall = table.walls[i]
+        if wall >= 0:
+            if run_min == -1 or wall < run_min:
+                run_min = wall
+            if jobForMetrics and wall > run_max:
+                run_max = wall
+        else:
+            wall = 0
+        if jobForMetrics:
+            run_sum += wall
+            run_cnt += 1
+            if table.walls[i] >= 0:
+                runtimes.append(wall)
+            wall_sum += table.wastes[i] + wall
+        if table.rss[i] >= 0:
+            mem = table.rss[i]/1024
+            if mem_min == -1 or mem < mem_min:
+                mem_min = mem
+            if jobForMetrics:
+                if mem > mem_max:
+                    mem_max = mem
+                mem_sum += mem
+                mem_cnt += 1
+        if state in ['toRetry', 'failed', 'finished'] and not wall:
+            if cpu_min == -1 or 0 < cpu_min:
+                cpu_min = 0
+        elif wall and table.cpuTimes[i] >= 0 and jobForMetrics:
+            cpu_sum += table.cpuTimes[i] / float(numCores)
+            cpu = cpuPercentage(state, wall, table.cpuTimes[i], numCores)
+            if cpu_min == -1 or cpu < cpu_min:
+                cpu_min = cpu
+            if cpu > cpu_max:
+                cpu_max = cpu
+
+    # the cluster id table follows the order of the jobids given by the user
+    clusterIds = [(str(jobid), table.clusterIds[table.index[str(jobid)]]) for jobid in jobids] if jobids else \
+                 list(zip(table.jobids, table.clusterIds))
+    summary.update({'errors': errors, 'errorExamples': errorExamples, 'unknownErrors': unknownErrors, 'numFailed': numFailed,
+                    'sites': sites, 'siteHistoryRetrieved': bool(sites),
+                    'details': JobDetails(table, indexes, automaticSplitt, numCores), 'clusterIds': clusterIds,
+                    'metrics': {'mem_cnt': mem_cnt, 'mem_min': mem_min, 'mem_max': mem_max, 'mem_sum': mem_sum,
+                                'run_cnt': run_cnt, 'run_min': run_min, 'run_max': run_max, 'run_sum': run_sum,
+                                'cpu_min': cpu_min, 'cpu_max': cpu_max, 'cpu_sum': cpu_sum, 'wall_sum': wall_sum,
+                                'runtimes': runtimes}})
+    return summary
+
+def percentile(values, fraction):
+    """ the fraction (between 0 and 1) percentile of the sorted values, interpolated between
+        the two closest values, None if there are no values
+    """
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+def analyzeSites(table, numCores=1):
+    """ Distributions of the job metrics on each site, from the StatusCacheTable table.
+        Every run of a job counts on its site: the previous retries as failed, the last
+        one from the state of the job. For each site returns
+            runs, running: the ended runs and the jobs running now
+            failed, failureRate: the failed runs, and their fraction of the ended runs
+            exitCodes: {exit code: number of jobs} of the failed jobs which last ran on the site
+            exitCodeRates: {exit code: fraction of the ended runs} for the same jobs
+            wallP50, wallP90 (s), cpuEffP50 (%), memoryP50, memoryP90 (MB): median and 90th
+            percentile of the ended runs, None when unknown
+        as {site: {...}}, without the 'Unknown' site.
+    """
+    # jobs back in idle state after running on a site failed there
+    failedCodes = set(table.stateCode(state) for state in SITE_FAILED_STATES + ['idle'])
+    endedCodes = failedCodes | set(table.stateCode(state) for state in SITE_SUCCESS_STATES)
+    runningCode = table.stateCode('running')
+
+    runs, failed, running = Counter(), Counter(), Counter()
+    exitCodes = {}
+    # the indexes of the ended runs of each site, in the job columns and in the previous retries columns
+    lastRuns, prevRuns = {}, {}
+    for i, site in enumerate(table.prevSites):
+        runs[site] += 1
+        failed[site] += 1
+        prevRuns.setdefault(site, []).append(i)
+    for i, site in enumerate(table.sites):
+        if site < 0:
+            continue
+        code = table.states[i]
+        if code == runningCode:
+            running[site] += 1
+        elif code in endedCodes:
+            runs[site] += 1
+            lastRuns.setdefault(site, []).append(i)
+            if code in failedCodes:
+                failed[site] += 1
+                if table.errors[i] >= 0:
+                    exitCode = table.errorValues[table.errors[i]][0]
+                    siteExitCodes = exitCodes.setdefault(site, Counter())
+                    siteExitCodes[exitCode] += 1
+
+    result = {}
+    for site, siteName in enumerate(table.siteNames):
+        if siteName == 'Unknown' or not (runs[site] or running[site]):
+            continue
+        walls, cpuEffs, memories = [], [], []
+        for columns, indexes in [((table.walls, table.cpuTimes, table.rss), lastRuns.get(site, [])),
+                                 ((table.prevWalls, table.prevCpuTimes, table.prevRss), prevRuns.get(site, []))]:
+            siteWalls, siteCpuTimes, siteRss = columns
+            for i in indexes:
+                wall, cpuTime, rss = siteWalls[i], siteCpuTimes[i], siteRss[i]
+                if wall >= 0:
+                    walls.append(wall)
+                if wall > 0 and cpuTime >= 0:
+                    cpuEffs.append(100. / numCores * cpuTime / wall)
+                if rss >= 0:
+                    memories.append(rss / 1024.)
+        walls.sort()
+        cpuEffs.sort()
+        memories.sort()
+        siteExitCodes = exitCodes.get(site, {})
+        result[siteName] = {'runs': runs[site], 'running': running[site], 'failed': failed[site],
+                            'failureRate': failed[site] / float(runs[site]) if runs[site] else None,
+                            'exitCodes': dict(siteExitCodes),
+                            'exitCodeRates': dict((exitCode, count / float(runs[site]))
+                                                  for exitCode, count in siteExitCodes.items()),
+                            'wallP50': percentile(walls, 0.5), 'wallP90': percentile(walls, 0.9),
+                            'cpuEffP50': percentile(cpuEffs, 0.5),
+                            'memoryP50': percentile(memories, 0.5), 'memoryP90': percentile(memories, 0.9)}
+    return result
+
 def to_hms(val):
     s = val % 60
     val -= s
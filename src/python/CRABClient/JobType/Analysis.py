@@ -162,7 +162,10 @@ class Analysis(BasicJobType):
         with UserTarball(name=tarFilename, logger=self.logger, config=self.config,
                          crabserver=self.crabserver, s3tester=self.s3tester) as tb:
             inputFiles = [re.sub(r'^file:', '', f) for f in getattr(self.config.JobType, 'inputFiles', [])]
-            tb.addFiles(userFiles=inputFiles, cfgOutputName=cfgOutputName)
+            ## The same sandbox may have been uploaded already, e.g. by a multicrab script
+            ## submitting the same code with other datasets
+            if not tb.reuseCachedSandbox(userFiles=inputFiles, cfgOutputName=cfgOutputName, filecacheurl=filecacheurl):
+                tb.addFiles(userFiles=inputFiles, cfgOutputName=cfgOutputName)
             try:
                 uploadResult = tb.upload(filecacheurl = filecacheurl)
             except HTTPException as hte:
@@ -4,6 +4,7 @@ Conventions:
  1) the plug-in file name has to be equal to the plug-in class
  2) a plug-in needs to implement mainly the run method
 """
+import bisect
 from ast import literal_eval
 
 try:
@@ -106,3 +107,116 @@ class BasicJobType(object):
             doubleLumis.update(set((run, lumi) for lumi in lumis if (run, lumi) in seen or seen.add((run, lumi))))
         doubleLumis = LumiList(lumis=doubleLumis)
         return doubleLumis.getCompactList()
+
+
+class LumiRangeAccumulator(object):
+    """
+    Collects run/lumi information as lumi ranges rather than as lists of single
+    lumis, so that memory stays proportional to the number of ranges. Lumis can be
+    added in any order and more than once.
+    getCompactList() returns the same format as LumiList.getCompactList():
+        {'1': [[1, 33], [35, 35]], '2': [[1, 45]]}
+    """
+
+    def __init__(self):
+        self.ranges = {}
+        self.compactSize = {}
+
+    def addLumis(self, run, lumis):
+        """
+        add a list of (possibly unsorted, possibly repeated) lumis for a run
+        """
+        ranges = self.ranges.setdefault(str(run), [])
+        for lumi in sorted(int(lumi) for lumi in lumis):
+            if ranges and ranges[-1][0] <= lumi <= ranges[-1][1] + 1:
+                ranges[-1][1] = max(ranges[-1][1], lumi)
+            else:
+                ranges.append([lumi, lumi])
+        self._compactIfNeeded(str(run))
+
+    def addRanges(self, run, lumiRanges):
+        """
+        add a list of [first, last] lumi ranges for a run
+        """
+        ranges = self.ranges.setdefault(str(run), [])
+        for first, last in lumiRanges:
+            ranges.append([int(first), int(last)])
+        self._compactIfNeeded(str(run))
+
+    def addCompactList(self, compactList):
+        """
+        add a dictionary in compact list format
+        """
+        for run, lumiRanges in compactList.items():
+            self.addRanges(run, lumiRanges)
+
+    def _compactIfNeeded(self, run):
+        # records do not come sorted, so ranges for a run can grow past the compact size,
+        # merge them when they doubled since the last time
+        if len(self.ranges[run]) > 2 * self.compactSize.get(run, 0) + 100:
+            self._compact(run)
+
+    def _compact(self, run):
+        merged = []
+        for first, last in sorted(self.ranges[run]):
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], last)
+            else:
+                merged.append([first, last])
+        self.ranges[run] = merged
+        self.compactSize[run] = len(merged)
+
+    def getCompactList(self):
+        """
+        return the collected lumis as a compact list
+        """
+        compactList = {}
+        for run in list(self.ranges):
+            self._compact(run)
+            if self.ranges[run]:
+                compactList[run] = [list(lumiRange) for lumiRange in self.ranges[run]]
+        return compactList
+
+
+class LumiOverlapFinder(object):
+    """
+    Finds the run/lumis which appear in more than one of the lumi lists added to it,
+    e.g. lumis processed by more than one job. Only the merged ranges seen so far and
+    the overlapping ranges are kept in memory.
+    getCompactList() returns the duplicates in the same format as getDuplicateLumis()
+    """
+
+    def __init__(self):
+        self.seen = {}
+        self.duplicates = LumiRangeAccumulator()
+
+    def addCompactList(self, compactList):
+        """
+        add one lumi list in compact format, whose ranges must not overlap with each other
+        """
+        for run, lumiRanges in compactList.items():
+            seen = self.seen.setdefault(str(run), [])
+            for first, last in lumiRanges:
+                self._addRange(str(run), seen, int(first), int(last))
+
+    def _addRange(self, run, seen, first, last):
+        # seen is a sorted list of disjoint and not adjacent [first, last] ranges
+        i = bisect.bisect_left(seen, [first, first])
+        if i > 0 and seen[i-1][1] >= first - 1:
+            i -= 1
+        j = i
+        newFirst, newLast = first, last
+        while j < len(seen) and seen[j][0] <= last + 1:
+            overlapFirst, overlapLast = max(seen[j][0], first), min(seen[j][1], last)
+            if overlapFirst <= overlapLast:
+                self.duplicates.addRanges(run, [[overlapFirst, overlapLast]])
+            newFirst = min(newFirst, seen[j][0])
+            newLast = max(newLast, seen[j][1])
+            j += 1
+        seen[i:j] = [[newFirst, newLast]]
+
+    def getCompactList(self):
+        """
+        return the lumis found more than once as a compact list
+        """
+        return self.duplicates.getCompactList()
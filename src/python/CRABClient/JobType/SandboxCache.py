@@ -0,0 +1,158 @@
+"""
+Local cache of the user sandboxes uploaded to the CRAB cache, to reuse them when the same
+CMSSW area is submitted again, e.g. the same code with another dataset from a multicrab script.
+
+A sandbox is identified by the manifest of its content: (name in the tarball, size, mtime, mode)
+of every file and directory which would be added to it, plus the SHA-256 of the PSet files
+(whose mtime changes at each submission) and the URL of the CRAB cache. Each entry is kept in
+getCrabCacheDir('sandboxes') as
+    <key>.tgz    the archive
+    <key>.json   {'hashkey': name in the CRAB cache, 'uploaded': time of the upload, 'content': [[size, name], ...]}
+Entries are reused for SANDBOX_CACHE_LIFETIME after their upload, well before the CRAB cache
+removes the sandbox, and the least recently used ones are removed beyond SANDBOX_CACHE_ENTRIES
+entries or SANDBOX_CACHE_SIZE bytes.
+"""
+
+# pylint: disable=consider-using-f-string
+
+import os
+import json
+import time
+import stat
+import shutil
+import hashlib
+
+from CRABClient.ClientUtilities import getCrabCacheDir
+
+SANDBOX_CACHE_SUBDIR = 'sandboxes'
+SANDBOX_CACHE_ENTRIES = 10
+SANDBOX_CACHE_SIZE = 1024 * 1024 * 1024
+SANDBOX_CACHE_LIFETIME = 7 * 24 * 3600
+SANDBOX_MANIFEST_VERSION = 1
+
+
+def walkManifest(path, arcname, exclude=None, dereference=True):
+    """
+    the manifest entries [arcname, size, mtime, mode] of path and, if it is a directory, of
+    everything below it, as added by TarFile.add(path, arcname) with the same dereference.
+    exclude(arcname) is True for the names which are not added (with what is below them).
+    The directories are walked without recursion, a loop of symbolic links ends with an OSError.
+    """
+    entries = []
+    stack = [(path, arcname)]
+    while stack:
+        path, arcname = stack.pop()
+        if exclude and exclude(arcname):
+            continue
+        info = os.stat(path) if dereference else os.lstat(path)
+        entries.append([arcname, info.st_size if not stat.S_ISDIR(info.st_mode) else 0, info.st_mtime, info.st_mode])
+        if stat.S_ISDIR(info.st_mode):
+            stack.extend((os.path.join(path, name), os.path.join(arcname, name)) for name in os.listdir(path))
+    return entries
+
+
+def fileDigest(filename):
+    """ the SHA-256 of the content of filename """
+    hasher = hashlib.sha256()
+    with open(filename, 'rb') as fd:
+        while True:
+            buf = fd.read(1024 * 1024)
+            if not buf:
+                break
+            hasher.update(buf)
+    return hasher.hexdigest()
+
+
+def manifestKey(manifest, digests=None, location=None):
+    """
+    the key of a sandbox in the cache: the SHA-256 of its manifest (as given by walkManifest),
+    of the digests {arcname: fileDigest} of the files compared by content and of the location
+    (the URL of the CRAB cache) where it is uploaded
+    """
+    description = {'version': SANDBOX_MANIFEST_VERSION, 'manifest': sorted(manifest),
+                   'digests': digests or {}, 'location': location}
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def linkOrCopy(source, destination):
+    """ hard link source to destination, or copy it if that is not possible, replacing destination """
+    tmpDestination = "%s.%s" % (destination, os.getpid())
+    try:
+        os.link(source, tmpDestination)
+    except OSError:
+        shutil.copyfile(source, tmpDestination)
+    os.rename(tmpDestination, destination)
+
+
+class SandboxCache(object):
+    """
+    The sandboxes already uploaded to the CRAB cache, by manifest key, see manifestKey
+    """
+
+    def __init__(self, cacheDir=None, maxEntries=SANDBOX_CACHE_ENTRIES, maxSize=SANDBOX_CACHE_SIZE,
+                 lifetime=SANDBOX_CACHE_LIFETIME):
+        self.cacheDir = cacheDir or getCrabCacheDir(SANDBOX_CACHE_SUBDIR)
+        self.maxEntries = maxEntries
+        self.maxSize = maxSize
+        self.lifetime = lifetime
+
+    def _paths(self, key):
+        return os.path.join(self.cacheDir, key + '.json'), os.path.join(self.cacheDir, key + '.tgz')
+
+    def _remove(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, key):
+        """
+        the entry of key with the path of its archive as 'archive', or None if there is none
+        or it is too old. The entry is marked as used.
+        """
+        entryFile, archive = self._paths(key)
+        try:
+            with open(entryFile) as fd:
+                entry = json.load(fd)
+            if time.time() - entry['uploaded'] > self.lifetime or not os.path.isfile(archive):
+                self._remove(key)
+                return None
+            os.utime(entryFile, None)
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+        entry['archive'] = archive
+        return entry
+
+    def put(self, key, archiveName, hashkey, content):
+        """
+        add the archive archiveName, uploaded to the CRAB cache as hashkey, with its content
+        [(size, name), ...], then remove the least recently used entries over the limits
+        """
+        entryFile, archive = self._paths(key)
+        linkOrCopy(archiveName, archive)
+        tmpEntryFile = "%s.%s" % (entryFile, os.getpid())
+        with open(tmpEntryFile, 'w') as fd:
+            json.dump({'hashkey': hashkey, 'uploaded': time.time(), 'content': content}, fd)
+        os.rename(tmpEntryFile, entryFile)
+        self.evict()
+
+    def evict(self):
+        """ remove the entries too old, then the least recently used ones over the limits """
+        entries = []
+        for name in os.listdir(self.cacheDir):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            entryFile, archive = self._paths(key)
+            try:
+                entries.append((os.path.getmtime(entryFile), key, os.path.getsize(archive)))
+            except OSError:
+                self._remove(key)
+        numEntries, totalSize = 0, 0
+        for used, key, size in sorted(entries, reverse=True):
+            if numEntries == self.maxEntries or totalSize + size > self.maxSize or time.time() - used > self.lifetime:
+                self._remove(key)
+                continue
+            numEntries += 1
+            totalSize += size
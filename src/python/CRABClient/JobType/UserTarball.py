@@ -7,9 +7,14 @@
 from  __future__ import division   # make division work like in python3
 
 import os
+import sys
+import bz2
 import glob
 import math
 import tarfile
+import multiprocessing
+from collections import deque
+from multiprocessing.pool import ThreadPool
 import tempfile
 import shutil
 import hashlib
@@ -20,9 +25,14 @@ from ServerUtilities import uploadToS3
 
 from CRABClient.ClientMapping import configParametersInfo
 from CRABClient.JobType.ScramEnvironment import ScramEnvironment
+from CRABClient.JobType.SandboxCache import SandboxCache, walkManifest, fileDigest, manifestKey, linkOrCopy
 from CRABClient.ClientUtilities import colors, BOOTSTRAP_CFGFILE, BOOTSTRAP_CFGFILE_PKL
 from CRABClient.ClientExceptions import EnvironmentException, InputFileNotFoundException, SandboxTooBigException
-from CRABClient.ClientUtilities import execute_command
+
+# the sandbox is compressed in blocks of the size of a bzip2 block at level 9, each one by a thread
+BZ2_BLOCK_SIZE = 900 * 1000
+# at most this many threads, not to take all the cores of a shared login node
+MAX_COMPRESSION_THREADS = 8
 
 
 def calculateChecksum(tarfile_, exclude=None):
@@ -87,15 +97,147 @@ def calculateChecksum(tarfile_, exclude=None):
     return checksum
 
 
-def excludeFromTar(tarinfo):
+class ChecksumReader(object):
+    """
+    File object which passes on to hasher what is read from fileobj
+    """
+    def __init__(self, fileobj, hasher):
+        self.fileobj = fileobj
+        self.hasher = hasher
+
+    def read(self, size=-1):
+        buf = self.fileobj.read(size)
+        self.hasher.update(buf)
+        return buf
+
+
+class ChecksumTarFile(tarfile.TarFile):
+    """
+    TarFile which computes the same checksum as calculateChecksum while the members are added,
+    instead of extracting them again from the finished tarball: the names of the members not
+    listed in exclude and the content of those which are files, except the .pkl ones.
+    The content is hashed as it is copied into the tarball.
+    Open it with ChecksumTarFile.open(..., hasher=hasher, exclude=exclude), a tarball reopened
+    to append more members continues with the hasher of the first one.
+    """
+    def __init__(self, *args, **kwargs):
+        self.hasher = kwargs.pop('hasher', None) or hashlib.sha256()
+        self.exclude = kwargs.pop('exclude', None) or []
+        tarfile.TarFile.__init__(self, *args, **kwargs)
+
+    def addfile(self, tarinfo, fileobj=None):
+        if tarinfo.name not in self.exclude:
+            self.hasher.update(tarinfo.name.encode('utf-8'))
+            if fileobj is not None and tarinfo.isfile() and tarinfo.name.split('.')[-1] != 'pkl':
+                fileobj = ChecksumReader(fileobj, self.hasher)
+        return tarfile.TarFile.addfile(self, tarinfo, fileobj)
+
+    def checksum(self):
+        """ the checksum of the members added so far """
+        return self.hasher.hexdigest()
+
+
+def compressionThreads():
+    """
+    the number of threads used to compress the sandbox: the cores this process can run on,
+    up to MAX_COMPRESSION_THREADS. Only 1 in python2, whose tarfile module can not read
+    the multi-stream files written by ParallelBZ2File.
+    """
+    if sys.version_info < (3, 0):
+        return 1
+    try:
+        cores = len(os.sched_getaffinity(0))  # pylint: disable=no-member
+    except AttributeError:
+        cores = multiprocessing.cpu_count()
+    return max(1, min(cores, MAX_COMPRESSION_THREADS))
+
+
+class ParallelBZ2File(object):
+    """
+    Write-only file object which compresses what is written to it with bzip2 in a pool of threads,
+    like pbzip2: the data is cut in blocks of blockSize bytes which are compressed independently
+    (bz2.compress releases the GIL) and written in order, one bzip2 stream after the other.
+    The result is a standard multi-stream .bz2 file, read as a single one by bzip2, GNU tar
+    and the bz2 and tarfile modules of python3. With a single thread the data goes through
+    one BZ2Compressor instead, into a single stream as written by tarfile mode 'w:bz2'.
+    """
+    def __init__(self, name, threads=1, blockSize=BZ2_BLOCK_SIZE, compresslevel=9):
+        self.name = name
+        self.fileobj = open(name, 'wb')
+        self.threads = threads
+        self.blockSize = blockSize
+        self.compresslevel = compresslevel
+        self.buffer = []
+        self.bufferSize = 0
+        self.position = 0
+        self.pending = deque()
+        self.pool = ThreadPool(threads) if threads > 1 else None
+        self.compressor = bz2.BZ2Compressor(compresslevel) if threads <= 1 else None
+        self.closed = False
+
+    def write(self, data):
+        if self.compressor:
+            self.position += len(data)
+            self.fileobj.write(self.compressor.compress(data))
+            return
+        self.buffer.append(data)
+        self.bufferSize += len(data)
+        self.position += len(data)
+        if self.bufferSize >= self.blockSize:
+            data = b''.join(self.buffer)
+            end = len(data) - len(data) % self.blockSize
+            for start in range(0, end, self.blockSize):
+                self._compress(data[start:start+self.blockSize])
+            self.buffer = [data[end:]]
+            self.bufferSize = len(data) - end
+
+    def tell(self):
+        """ the number of (uncompressed) bytes written so far, as needed by TarFile """
+        return self.position
+
+    def _compress(self, block):
+        self.pending.append(self.pool.apply_async(bz2.compress, (block, self.compresslevel)))
+        # keep a bounded number of blocks in memory
+        while len(self.pending) > 2 * self.threads:
+            self.fileobj.write(self.pending.popleft().get())
+
+    def close(self):
+        """ compress what is left and close the file """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.compressor:
+                self.fileobj.write(self.compressor.flush())
+            if self.bufferSize:
+                self._compress(b''.join(self.buffer))
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().get())
+        finally:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+            self.fileobj.close()
+
+
+def excludedFromTar(name):
     """
     some files or directories should never go in the sandbox
        .git subdirectory https://github.com/dmwm/CRABClient/issues/5202
        scram pre-built objects used since CMSSW_13 https://github.com/dmwm/CRABClient/issues/5300
     """
-    if '.git' in tarinfo.name:
-        return None
-    if 'objs-base' in tarinfo.name or 'objs-full' in tarinfo.name:
+    if '.git' in name:
+        return True
+    if 'objs-base' in name or 'objs-full' in name:
+        return True
+    return False
+
+
+def excludeFromTar(tarinfo):
+    """
+    TarFile.add filter which leaves out the files and directories excludedFromTar
+    """
+    if excludedFromTar(tarinfo.name):
         return None
     return tarinfo
 
@@ -116,16 +258,32 @@ class UserTarball(object):
         self.logger = logger
         self.scram = ScramEnvironment(logger=self.logger)
         self.logger.debug("Making tarball in %s" % name)
-        self.tarfile = tarfile.open(name=name, mode=mode, dereference=True)
+        # bzip2 archives are compressed by several threads, see ParallelBZ2File
+        self.compressedFile = None
+        if mode == 'w:bz2':
+            threads = compressionThreads()
+            self.logger.debug("Compressing tarball with %d threads" % threads)
+            self.compressedFile = ParallelBZ2File(name, threads=threads)
+            name, mode = None, 'w'
+        # the checksum used as name of the sandbox in the CRAB cache is computed while adding the files
+        self.tarfile = ChecksumTarFile.open(name=name, mode=mode, fileobj=self.compressedFile, dereference=True,
+                                            exclude=NEW_USER_SANDBOX_EXCLUSIONS)
         self.checksum = None
         self.content = None
+        # set by reuseCachedSandbox
+        self.manifestKey = None
+        self.sandboxCache = None
+        self.reused = False
         self.crabserver = crabserver
         self.s3tester = s3tester
 
-    def addFiles(self, userFiles=None, cfgOutputName=None):
+    def getSources(self, userFiles=None, quiet=False):
         """
-        Add the necessary files to the tarball
+        The (path, arcname) of the directories and files of the CMSSW area and of the user
+        which addFiles adds recursively to the tarball, with the excludeFromTar filter.
+        With quiet, do not tell the user that the external directory is not sent.
         """
+        sources = []
 
         # Tar up whole directories in $CMSSW_BASE/
         directories = ['bin', 'python', 'cfipython', 'lib', 'biglib', 'module', 'config/SCRAM/hooks']
@@ -133,7 +291,7 @@ class UserTarball(object):
             externalDirPath = os.path.join(self.scram.getCmsswBase(), 'external')
             if os.path.exists(externalDirPath) and os.listdir(externalDirPath) != []:
                 directories.append('external')
-            else:
+            elif not quiet:
                 self.logger.info("The config.JobType.sendExternalFolder parameter is set to True but the external directory "\
                                   "doesn't exist or is empty, not adding to tarball. Path: %s" % externalDirPath)
 
@@ -141,10 +299,8 @@ class UserTarball(object):
             fullPath = os.path.join(self.scram.getCmsswBase(), directory)
             self.logger.debug("Checking directory %s" % fullPath)
             if os.path.exists(fullPath):
-                self.logger.debug("Adding directory %s to tarball" % fullPath)
-                self.checkdirectory(fullPath)
                 archiveDir = os.path.join(self.scram.getCmsswVersion(), directory)
-                self.tarfile.add(fullPath, archiveDir, recursive=True, filter=excludeFromTar)
+                sources.append((fullPath, archiveDir))
 
         # Recursively search for and add to tar some directories in $CMSSW_BASE/src/
         # Note that recursiveDirs are **only** looked-for under the $CMSSW_BASE/src/ folder!
@@ -162,10 +318,8 @@ class UserTarball(object):
         for root, _, _ in os.walk(srcPath):
             if os.path.basename(root) in recursiveDirs:
                 directory = root.replace(srcPath, 'src')
-                self.logger.debug("Adding directory %s to tarball" % root)
-                self.checkdirectory(root)
                 archiveDir = os.path.join(self.scram.getCmsswVersion(), directory)
-                self.tarfile.add(root, archiveDir, recursive=True, filter=excludeFromTar)
+                sources.append((root, archiveDir))
 
         # Tar up extra files the user needs
         userFiles = userFiles or []
@@ -174,9 +328,19 @@ class UserTarball(object):
             if not fileNames:
                 raise InputFileNotFoundException("The input file '%s' taken from parameter config.JobType.inputFiles cannot be found." % globName)
             for filename in fileNames:
-                self.logger.debug("Adding file %s to tarball" % filename)
-                self.checkdirectory(filename)
-                self.tarfile.add(filename, os.path.basename(filename), recursive=True, filter=excludeFromTar)
+                sources.append((filename, os.path.basename(filename)))
+
+        return sources
+
+    def addFiles(self, userFiles=None, cfgOutputName=None):
+        """
+        Add the necessary files to the tarball
+        """
+
+        for path, archiveDir in self.getSources(userFiles):
+            self.logger.debug("Adding %s to tarball" % path)
+            self.checkdirectory(path)
+            self.tarfile.add(path, archiveDir, recursive=True, filter=excludeFromTar)
 
         scriptExe = getattr(self.config.JobType, 'scriptExe', None)
         if scriptExe:
@@ -189,32 +353,72 @@ class UserTarball(object):
             self.tarfile.add(os.path.join(basedir, BOOTSTRAP_CFGFILE_PKL), arcname=BOOTSTRAP_CFGFILE_PKL)
             self.tarfile.add(os.path.join(basedir, BOOTSTRAP_CFGFILE_DUMP), arcname=BOOTSTRAP_CFGFILE_DUMP)
 
-    def addVenvDirectory(self, tarFile='sandbox.tgz'):
-        # adds CMSSW_BASE/venv directory to the (closed, compressed) sandbox
-        # venv directory is special because symbolic links have to be kept as such (no dereference)
-        # this requires tarfile to be closed and opened with a different dereference flag,
-        # but appending can only work on non-compressed tar files !
+    def getManifestKey(self, userFiles=None, cfgOutputName=None, filecacheurl=None):
+        """
+        The key of the sandbox in the SandboxCache: the manifest of all that addFiles and upload
+        would add to the tarball, with the content of the pset files except the pickle one
+        (which is not part of the checksum either), and the CRAB cache where it is uploaded.
+        """
+        manifest = []
+        for path, archiveDir in self.getSources(userFiles, quiet=True):
+            manifest.extend(walkManifest(path, archiveDir, exclude=excludedFromTar))
+        scriptExe = getattr(self.config.JobType, 'scriptExe', None)
+        if scriptExe:
+            manifest.extend(walkManifest(scriptExe, os.path.basename(scriptExe)))
+        if getattr(self.config.JobType, 'sendVenvFolder', configParametersInfo['JobType.sendVenvFolder']['default']):
+            venv = os.path.join(self.scram.getCmsswBase(), 'venv')
+            manifest.extend(walkManifest(venv, os.path.join(self.scram.getCmsswVersion(), 'venv'), dereference=False))
+        digests = {}
+        if cfgOutputName:
+            basedir = os.path.dirname(cfgOutputName)
+            digests[BOOTSTRAP_CFGFILE] = fileDigest(cfgOutputName)
+            digests[BOOTSTRAP_CFGFILE_DUMP] = fileDigest(os.path.join(basedir, BOOTSTRAP_CFGFILE_DUMP))
+        return manifestKey(manifest, digests, filecacheurl)
 
+    def reuseCachedSandbox(self, userFiles=None, cfgOutputName=None, filecacheurl=None):
+        """
+        Look in the SandboxCache for a sandbox with the same content already uploaded to filecacheurl.
+        If there is one, copy it in place of this tarball and return True: upload() will then
+        return its hashkey without uploading it again. Otherwise return False, addFiles has to
+        be called and upload() will add the sandbox to the cache.
+        """
+        try:
+            self.manifestKey = self.getManifestKey(userFiles, cfgOutputName, filecacheurl)
+            self.sandboxCache = SandboxCache()
+            entry = self.sandboxCache.get(self.manifestKey)
+        except (IOError, OSError) as ex:
+            # e.g. a loop of symbolic links, addFiles will tell
+            self.logger.debug("Can not look for the sandbox in the local cache: %s" % ex)
+            self.manifestKey = None
+            return False
+        if entry is None:
+            return False
+        self.tarfile.close()
+        if self.compressedFile:
+            self.compressedFile.close()
+        linkOrCopy(entry['archive'], self.tarfile.name)
+        self.checksum = entry['hashkey']
+        self.content = [tuple(item) for item in entry['content']]
+        self.reused = True
+        self.logger.info("The CMSSW area and input files did not change since the sandbox %s was uploaded, reusing it"
+                         % self.checksum)
+        return True
+
+    def addVenvDirectory(self):
+        """
+        Add the CMSSW_BASE/venv directory to the tarball. The venv directory is special because
+        its symbolic links have to be kept as such, while the rest of the sandbox is added with
+        dereference: TarFile.add follows the links only if dereference is set at the time a member
+        is added, so it is turned off while adding venv, in the same (compressed) stream.
+        """
         venv = os.path.join(self.scram.getCmsswBase(), 'venv')
-        # have to do some file renaming because bzip2 needs its onw extention
-        # this will be cleaner once we rename upstream sandbox.tgz to sandbox.tbz !)
-
-        # prepare names:
-        tarFileName = os.path.splitext(tarFile)[0]  # remove .tgz
-        uncompressed = tarFileName + '.tar'  # sandbox.tar
-        bzipped= uncompressed + '.bz2'  # sandbox.tar.bz2
-        # now do the work
-        cmd = 'mv %s %s' % (tarFile, bzipped)  # rename to what bunzip2 likes
-        cmd += '; bunzip2 ' + bzipped  # uncompress, creates sandbox.tar
-        execute_command(cmd, logger=self.logger)
-        # use python tarfile to append, so can rename file inside the archive
-        tar = tarfile.open(name=uncompressed, mode='a', dereference=False)
         archiveDir = os.path.join(self.scram.getCmsswVersion(), 'venv')
-        tar.add(name=venv, arcname=archiveDir)
-        tar.close()
-        cmd = 'bzip2 ' + uncompressed  # compress, creates sandbox.tar.bz2
-        cmd += "; mv %s %s" % (bzipped, tarFile)  # rename to sandbox.tgz
-        execute_command(cmd, logger=self.logger)
+        dereference = self.tarfile.dereference
+        self.tarfile.dereference = False
+        try:
+            self.tarfile.add(name=venv, arcname=archiveDir)
+        finally:
+            self.tarfile.dereference = dereference
 
     def addMonFiles(self):
         """
@@ -245,8 +449,13 @@ class UserTarball(object):
         """
         Calculate the checkum and close
         """
+        if self.reused:
+            # already closed and replaced by the archive of the cache, see reuseCachedSandbox
+            return
         self.writeContent()
-        return self.tarfile.close()
+        self.tarfile.close()
+        if self.compressedFile:
+            self.compressedFile.close()
 
     def printSortedContent(self, maxLines=None):
         """
@@ -272,13 +481,15 @@ class UserTarball(object):
         Upload the tarball to the File Cache
         """
 
-        self.close()
-        archiveName = self.tarfile.name
+        if self.reused:
+            self.logger.debug("Sandbox %s found in the local cache, not uploading it again" % self.checksum)
+            return self.checksum
 
-        # #CMSSW_BASE/venv is special, needs to be done here
-        # after all sing and dance is over and the tar is closed !
+        # CMSSW_BASE/venv is added last, with its symbolic links, see addVenvDirectory
         if getattr(self.config.JobType, 'sendVenvFolder', configParametersInfo['JobType.sendVenvFolder']['default']):
-            self.addVenvDirectory(tarFile=archiveName)
+            self.addVenvDirectory()
+        self.close()
+        archiveName = self.tarfile.name
 
         archiveSizeBytes = os.path.getsize(archiveName)
 
@@ -305,8 +516,9 @@ class UserTarball(object):
                (archiveName, archiveSize, filecacheurl))
         self.logger.debug(msg)
 
-        # generate a 32char hash like old UserFileCache used to do
-        hashkey = calculateChecksum(archiveName, exclude=NEW_USER_SANDBOX_EXCLUSIONS)
+        # generate a 32char hash like old UserFileCache used to do, computed while adding the files
+        # with the same algorithm as calculateChecksum(archiveName, exclude=NEW_USER_SANDBOX_EXCLUSIONS)
+        hashkey = self.checksum = self.tarfile.checksum()
         # the ".tar.gz" suffix here is forced by other places in the client which add it when
         # storing tarball name in task table. Not very elegant to need to hardcode in several places.
         cachename = "%s.tar.gz" % hashkey
@@ -314,6 +526,11 @@ class UserTarball(object):
         # next version of RESTCache will get username from cmsweb FE headers
         uploadToS3(crabserver=self.crabserver, objecttype='sandbox', filepath=archiveName,
                    tarballname=cachename, logger=self.logger)
+        if self.manifestKey:
+            try:
+                self.sandboxCache.put(self.manifestKey, archiveName, hashkey, self.content)
+            except (IOError, OSError) as ex:
+                self.logger.debug("Can not keep the sandbox in the local cache: %s" % ex)
         return hashkey
 
 
@@ -346,5 +563,7 @@ class UserTarball(object):
         Allow use as context manager
         """
         self.tarfile.close()
+        if self.compressedFile:
+            self.compressedFile.close()
         if excType:
             return False
@@ -98,9 +98,11 @@ class HTTPRequests(dict):
     """
 
     def __init__(self, hostname='localhost', localcert=None, localkey=None, contentType=None,
-                 retry=0, logger=None, version=__version__, verbose=False, userAgent=None):
+                 retry=0, logger=None, version=__version__, verbose=False, userAgent=None, minRetries=2):
         """
         Initialise an HTTP handler
+        minRetries: number of retries after any error, up to retry are done for the retriable ones.
+                    Callers which have a fallback for failed requests can set both to 0
         """
         dict.__init__(self)
         # set up defaults
@@ -121,6 +123,7 @@ class HTTPRequests(dict):
         self.setdefault("cert", localcert)
         self.setdefault("key", localkey)
         self.setdefault("retry", retry)
+        self.setdefault("minRetries", minRetries)
         self.setdefault("verbose", verbose)
         self.setdefault("userAgent", userAgent)
         self.setdefault("Content-type", contentType)
@@ -213,16 +216,16 @@ class HTTPRequests(dict):
             command += ' --capath "%s"' % caCertPath
             command += ' "%s" | tee /dev/stderr ' % url
 
-        # retries this up at least 3 times, or up to self['retry'] times for range of exit codes
-        # retries are counted AFTER 1st try, so call is made up to nRetries+1 times !
-        nRetries = max(2, self['retry'])
+        # retries this up at least self['minRetries'] (default 2) times, or up to self['retry'] times
+        # for range of exit codes. Retries are counted AFTER 1st try, so call is made up to nRetries+1 times !
+        nRetries = max(self['minRetries'], self['retry'])
         for i in range(nRetries + 1):
             curlLogger = self.logger if self['verbose'] else None
             stdout, stderr, curlExitCode = execute_command(command=command, logger=curlLogger)
             http_code, http_reason = parseResponseHeader(stderr)
 
             if curlExitCode != 0 or http_code != 200:
-                if (i < 2) or (retriableError(http_code, curlExitCode) and (i < self['retry'])):
+                if (i < self['minRetries']) or (retriableError(http_code, curlExitCode) and (i < self['retry'])):
                     sleeptime = 20 * (i + 1) + random.randint(-10, 10)
                     msg = "Sleeping %s seconds after HTTP error.\nError:\n:%s" % (sleeptime, stderr)
                     self.logger.debug(msg)
@@ -0,0 +1,137 @@
+"""
+Encoding and decoding of the status_cache files written by the task process on the schedd.
+
+status_cache.pkl is a pickle of the dictionary
+    {'nodes': {'DagStatus': {...}, jobid: {job info}, ...}}
+or {'bootstrapTime': {...}} while the task bootstraps. Unpickling is only safe for
+trusted content and needs the whole file decoded at once.
+
+status_cache.jsonl.gz has the same content as gzipped lines of JSON:
+    line 1   header {"format": "crab-status-cache", "version": 1, "jobs": N, "sha256": checksum}
+    line 2   the task record: the dictionary without 'nodes', plus 'DagStatus' if there is one
+    line 3-  one [jobid, {job info}] list per job
+where checksum is the SHA-256 of the (uncompressed) lines after the header. The jobs can
+be read one at a time and the file is checked while reading it: a truncated or altered
+file is rejected instead of showing a partial job table.
+Only JsonStatusCache.records() reads the jobs lazily, e.g. to fill a StatusCacheTable:
+JsonStatusCache.load() and decodeStatusCache() build the whole dictionary, as unpickling does.
+"""
+
+# pylint: disable=consider-using-f-string
+
+import gzip
+import hashlib
+import io
+import json
+import pickle
+
+JSON_STATUS_CACHE_FORMAT = 'crab-status-cache'
+JSON_STATUS_CACHE_VERSION = 1
+# the status_cache files which can be on the schedd, in the order they are tried: the task
+# process always writes status_cache.pkl, status_cache.jsonl.gz is only looked for without it
+STATUS_CACHE_FILES = [('status_cache.pkl', 'pickle'), ('status_cache.jsonl.gz', 'json')]
+
+
+class JsonStatusCache(object):
+    """ The content data of a status_cache.jsonl.gz file. The header and the task record
+        are read when created, the jobs only by records(), one line at a time.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        with self._open() as fd:
+            self.header = self._readHeader(fd)
+            self.task = json.loads(fd.readline().decode('utf-8'))
+
+    def _open(self):
+        return gzip.GzipFile(fileobj=io.BytesIO(self.data), mode='rb')
+
+    @staticmethod
+    def _readHeader(fd):
+        try:
+            header = json.loads(fd.readline().decode('utf-8'))
+        except ValueError:
+            header = None
+        if not isinstance(header, dict) or header.get('format') != JSON_STATUS_CACHE_FORMAT:
+            raise ValueError("not a %s file" % JSON_STATUS_CACHE_FORMAT)
+        if header.get('version') != JSON_STATUS_CACHE_VERSION:
+            raise ValueError("%s version %s is not supported" % (JSON_STATUS_CACHE_FORMAT, header.get('version')))
+        return header
+
+    def records(self):
+        """ generator of the (jobid, info) of all jobs. Raises ValueError at the end if
+            the number of jobs or the checksum are not the ones in the header.
+        """
+        checksum = hashlib.sha256()
+        numJobs = 0
+        with self._open() as fd:
+            self._readHeader(fd)
+            checksum.update(fd.readline())
+            for line in fd:
+                checksum.update(line)
+                jobid, info = json.loads(line.decode('utf-8'))
+                numJobs += 1
+                yield jobid, info
+        if numJobs != self.header.get('jobs') or checksum.hexdigest() != self.header.get('sha256'):
+            raise ValueError("%s checksum mismatch: the file is incomplete or corrupted" % JSON_STATUS_CACHE_FORMAT)
+
+    def load(self, table=None, maxJobs=None):
+        """ the whole status_cache dictionary, as unpickled from status_cache.pkl. The jobs
+            are also added to table (a StatusCacheTable) if given, while they are read.
+            With maxJobs, the jobs are only kept in the dictionary if there are at most maxJobs
+            of them, otherwise they are only added to table and 'nodes' has only DagStatus.
+        """
+        keepJobs = maxJobs is None or (self.header.get('jobs') or 0) <= maxJobs
+        statusCache = dict((key, value) for key, value in self.task.items() if key != 'DagStatus')
+        # a file written from a dictionary without 'nodes' (bootstrap) has neither DagStatus nor jobs
+        if 'DagStatus' in self.task or self.header.get('jobs'):
+            nodes = {'DagStatus': self.task['DagStatus']} if 'DagStatus' in self.task else {}
+            for jobid, info in self.records():
+                if keepJobs:
+                    nodes[jobid] = info
+                if table is not None:
+                    table.append(jobid, info)
+            statusCache['nodes'] = nodes
+        return statusCache
+
+
+def encodeJsonStatusCache(statusCache, compresslevel=6):
+    """ the content of status_cache.jsonl.gz for the status_cache dictionary """
+    task = dict((key, value) for key, value in statusCache.items() if key != 'nodes')
+    nodes = statusCache.get('nodes', {})
+    if 'DagStatus' in nodes:
+        task['DagStatus'] = nodes['DagStatus']
+    lines = [json.dumps(task).encode('utf-8') + b'\n']
+    lines.extend(json.dumps([jobid, info]).encode('utf-8') + b'\n'
+                 for jobid, info in nodes.items() if jobid != 'DagStatus')
+    checksum = hashlib.sha256()
+    for line in lines:
+        checksum.update(line)
+    header = {'format': JSON_STATUS_CACHE_FORMAT, 'version': JSON_STATUS_CACHE_VERSION,
+              'jobs': len(lines) - 1, 'sha256': checksum.hexdigest()}
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=compresslevel) as fd:
+        fd.write(json.dumps(header).encode('utf-8') + b'\n')
+        for line in lines:
+            fd.write(line)
+    return out.getvalue()
+
+
+def decodeStatusCache(data, fileFormat, table=None, maxJobs=None):
+    """ the status_cache dictionary from the content data of a status_cache file in fileFormat
+        ('json' or 'pickle', see STATUS_CACHE_FILES). The jobs are also added to table
+        (a StatusCacheTable) if given, one at a time while they are read for json.
+        With maxJobs (and table), the jobs are only kept in the dictionary if there are at
+        most maxJobs of them: the pickle is decoded in full, then reduced to DagStatus.
+    """
+    if fileFormat == 'json':
+        return JsonStatusCache(data).load(table, maxJobs)
+    statusCache = pickle.loads(data)
+    if table is not None:
+        nodes = statusCache.get('nodes', {})
+        for jobid, info in nodes.items():
+            if jobid != 'DagStatus':
+                table.append(jobid, info)
+        if maxJobs is not None and len(table) > maxJobs:
+            statusCache['nodes'] = dict((key, nodes[key]) for key in ['DagStatus'] if key in nodes)
+    return statusCache
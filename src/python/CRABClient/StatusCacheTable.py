@@ -0,0 +1,155 @@
+"""
+Compact, columnar, representation of the job table of the status_cache file
+written by the task process on the schedd.
+
+status_cache has one dictionary per job with lists for all the retries
+(WallDurations, ResidentSetSize, SiteHistory, ...). For tasks with 100k jobs
+and more this takes a lot of memory and every summary has to walk through
+those objects. StatusCacheTable keeps instead one array per quantity, with
+states, sites and error messages stored once and referred to by their index.
+"""
+
+# pylint: disable=consider-using-f-string
+
+from array import array
+
+from CRABClient.ClientUtilities import JobidSortKeys
+
+# kind of job: probe jobs (0-N) and tail jobs (N-M) in automatic splitting, the others
+MAIN, PROBE, TAIL = 0, 1, 2
+
+
+class StatusCacheTable(object):
+    """ The job table of status_cache as columns. For the job at position i:
+            jobids[i]        the job id, e.g. '3', '0-1', '12-4'
+            kinds[i]         MAIN, PROBE or TAIL
+            states[i]        index of its state in stateNames
+            sites[i]         index of its last site in siteNames, -1 without SiteHistory
+            walls[i]         wall time of the last retry, -1 without WallDurations
+            wastes[i]        wall time of the previous retries
+            rss[i]           resident set size of the last retry in KB, -1 if unknown
+            cpuTimes[i]      user + sys CPU time of the last retry, -1 if unknown
+            retries[i], restarts[i]
+            errors[i]        index of its (exit code, error message) in errorValues, -1 without Error
+            clusterIds[i]    HTCondor cluster id(s) as a string
+        The previous retries of job i, used for the per site summary, are
+        prevSites[prevOffsets[i]:prevOffsets[i+1]] with the wall times in prevWalls,
+        the resident set size in prevRss and the CPU time in prevCpuTimes (-1 if unknown).
+    """
+
+    def __init__(self, nodes):
+        """ nodes is the {jobid: info} dictionary of status_cache (the DagStatus record is ignored)
+        """
+        self.jobids = []
+        self.kinds = array('b')
+        self.states = array('h')
+        self.sites = array('h')
+        self.walls = array('d')
+        self.wastes = array('d')
+        self.rss = array('d')
+        self.cpuTimes = array('d')
+        self.retries = array('l')
+        self.restarts = array('l')
+        self.errors = array('l')
+        self.clusterIds = []
+        self.prevOffsets = array('l', [0])
+        self.prevSites = array('h')
+        self.prevWalls = array('d')
+        self.prevRss = array('d')
+        self.prevCpuTimes = array('d')
+        self.stateNames = []
+        self.siteNames = []
+        self.errorValues = []
+        self._stateCodes = {}
+        self._siteCodes = {}
+        self._errorCodes = {}
+        self._index = None
+        self._sortKeys = None
+        for jobid, info in nodes.items():
+            if jobid == 'DagStatus':
+                continue
+            self.append(jobid, info)
+
+    def append(self, jobid, info):
+        """ Add the job jobid, described by the status_cache dictionary info
+        """
+        self.jobids.append(jobid)
+        if jobid.startswith('0-'):
+            self.kinds.append(PROBE)
+        elif '-' in jobid:
+            self.kinds.append(TAIL)
+        else:
+            self.kinds.append(MAIN)
+        self.states.append(self._code(self._stateCodes, self.stateNames, info['State']))
+        walls = info.get('WallDurations') or []
+        self.walls.append(walls[-1] if walls else -1)
+        self.wastes.append(sum(walls[:-1]))
+        rss = info.get('ResidentSetSize') or []
+        self.rss.append(rss[-1] if rss else -1)
+        sysCpu = info.get('TotalSysCpuTimeHistory') or []
+        userCpu = info.get('TotalUserCpuTimeHistory') or []
+        self.cpuTimes.append(sysCpu[-1] + userCpu[-1] if sysCpu and userCpu else -1)
+        siteHistory = info.get('SiteHistory')
+        if siteHistory:
+            self.sites.append(self._code(self._siteCodes, self.siteNames, siteHistory[-1]))
+            for retry, (site, wall) in enumerate(zip(siteHistory[:-1], walls[:-1])):
+                self.prevSites.append(self._code(self._siteCodes, self.siteNames, site))
+                self.prevWalls.append(wall)
+                self.prevRss.append(rss[retry] if retry < len(rss) else -1)
+                self.prevCpuTimes.append(sysCpu[retry] + userCpu[retry]
+                                         if retry < len(sysCpu) and retry < len(userCpu) else -1)
+        else:
+            self.sites.append(-1)
+        self.prevOffsets.append(len(self.prevSites))
+        self.retries.append(info.get('Retries', 0))
+        self.restarts.append(info.get('Restarts', 0))
+        if 'Error' in info:
+            self.errors.append(self._code(self._errorCodes, self.errorValues, (info['Error'][0], info['Error'][1])))
+        else:
+            self.errors.append(-1)
+        self.clusterIds.append(str(info.get('JobIds', 'Unknown')))
+        self._index = None
+        self._sortKeys = None
+
+    @staticmethod
+    def _code(codes, values, value):
+        """ the index of value in values, adding it if needed """
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+
+    def __len__(self):
+        return len(self.jobids)
+
+    def __contains__(self, jobid):
+        return jobid in self.index
+
+    @property
+    def index(self):
+        """ {jobid: position in the table}, built on first use """
+        if self._index is None:
+            self._index = dict((jobid, i) for i, jobid in enumerate(self.jobids))
+        return self._index
+
+    @property
+    def sortKeys(self):
+        """ JobidSortKeys of all the jobs, built on first use. The kinds column tells
+            which job ids have to be split, the main jobs only need int()
+        """
+        if self._sortKeys is None:
+            sortKeys = JobidSortKeys()
+            for jobid, kind in zip(self.jobids, self.kinds):
+                if kind == MAIN:
+                    sortKeys[jobid] = (1, int(jobid), 0)
+                else:
+                    first, second = jobid.split('-')
+                    sortKeys[jobid] = (0 if kind == PROBE else 2, int(first), int(second))
+            self._sortKeys = sortKeys
+        return self._sortKeys
+
+    def stateCode(self, state):
+        """ the index of state in stateNames, -1 if no job is in this state """
+        return self._stateCodes.get(state, -1)
+
@@ -0,0 +1,137 @@
+"""
+Export of the job table of a task as a flat table, one row per job, for analysis
+with other tools (pandas, ROOT, spreadsheets, ...).
+
+The rows are made directly from the columns of the StatusCacheTable, not from the
+text printed by crab status nor from its --json output. The table is written as CSV,
+or as Parquet or Arrow (Feather) files when pyarrow is available.
+"""
+
+# pylint: disable=consider-using-f-string
+
+import os
+import sys
+import csv
+
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from CRABClient.ClientExceptions import ClientException
+from CRABClient.StatusCacheTable import PROBE, TAIL
+
+# the columns of the exported table: name and pyarrow type. Values which are not
+# known (e.g. the site of a job which never ran) are empty in CSV and null otherwise.
+#   wallTime, cpuTime in seconds and rss in KB, of the last retry of the job
+#   wastedWallTime the wall time of the previous retries
+#   retry, only with the per-retry history, the retry of the row (0 for the first one)
+EXPORT_COLUMNS = [('jobid', 'string'), ('type', 'string'), ('state', 'string'), ('site', 'string'),
+                  ('wallTime', 'float64'), ('wastedWallTime', 'float64'), ('rss', 'float64'),
+                  ('cpuTime', 'float64'), ('retries', 'int64'), ('restarts', 'int64'),
+                  ('exitCode', 'int64'), ('error', 'string'), ('clusterId', 'string')]
+EXPORT_RETRY_COLUMN = ('retry', 'int64')
+# format of the file from its extension, CSV for the others
+EXPORT_FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow'}
+
+JOB_TYPES = {PROBE: 'probe', TAIL: 'tail'}
+
+
+def exportFormat(filename):
+    """ the format (csv, parquet or arrow) in which filename is written """
+    return EXPORT_FORMATS.get(os.path.splitext(filename)[1].lower(), 'csv')
+
+
+def canExport(filename):
+    """ True if the modules needed to write filename are available """
+    return exportFormat(filename) == 'csv' or pyarrow is not None
+
+
+def exportColumns(table, retries=False):
+    """ {column name: list of values} of the job table, with None for unknown values.
+        With retries there is also one row for each previous retry of the jobs, after
+        the rows of the jobs: these only have jobid, type, site, wallTime, rss and cpuTime.
+    """
+    def known(values):
+        return [value if value >= 0 else None for value in values]
+
+    def names(codes, values):
+        return [values[code] if code >= 0 else None for code in codes]
+
+    errors = names(table.errors, table.errorValues)
+    columns = {'jobid': list(table.jobids),
+               'type': [JOB_TYPES.get(kind, 'processing') for kind in table.kinds],
+               'state': names(table.states, table.stateNames),
+               'site': names(table.sites, table.siteNames),
+               'wallTime': known(table.walls),
+               'wastedWallTime': list(table.wastes),
+               'rss': known(table.rss),
+               'cpuTime': known(table.cpuTimes),
+               'retries': list(table.retries),
+               'restarts': list(table.restarts),
+               'exitCode': [error[0] if error else None for error in errors],
+               'error': [error[1] if error else None for error in errors],
+               'clusterId': list(table.clusterIds)}
+    if not retries:
+        return columns
+    offsets = table.prevOffsets
+    numJobs, numPrev = len(table), len(table.prevSites)
+    # the retry of each row: the last one for the job rows, then the previous retries job by job
+    retryColumn = [offsets[i+1] - offsets[i] for i in range(numJobs)]
+    prevJobs = []
+    for i in range(numJobs):
+        prevJobs.extend([i] * (offsets[i+1] - offsets[i]))
+        retryColumn.extend(range(offsets[i+1] - offsets[i]))
+    columns['retry'] = retryColumn
+    columns['jobid'].extend(table.jobids[i] for i in prevJobs)
+    columns['type'].extend(columns['type'][i] for i in prevJobs)
+    columns['site'].extend(names(table.prevSites, table.siteNames))
+    columns['wallTime'].extend(known(table.prevWalls))
+    columns['rss'].extend(known(table.prevRss))
+    columns['cpuTime'].extend(known(table.prevCpuTimes))
+    for name, _ in EXPORT_COLUMNS:
+        if len(columns[name]) == numJobs:
+            columns[name].extend([None] * numPrev)
+    return columns
+
+
+def writeCSV(columns, names, fd):
+    """ write the columns (as given by exportColumns) to the open file fd, in the order of names """
+    writer = csv.writer(fd)
+    writer.writerow(names)
+    # None is written as an empty field
+    writer.writerows(zip(*[columns[name] for name in names]))
+
+
+def exportStatusTable(table, filename, retries=False):
+    """ Write the StatusCacheTable table to filename, in the format given by its extension
+        (see exportFormat), with the previous retries of the jobs if retries is True.
+        The file is written under a temporary name and renamed when complete.
+        Return the number of rows written.
+    """
+    fmt = exportFormat(filename)
+    if fmt != 'csv' and pyarrow is None:
+        raise ClientException("Writing %s requires the pyarrow python module, which is not available."
+                              " Use a .csv file instead." % filename)
+    columns = exportColumns(table, retries)
+    schema = EXPORT_COLUMNS + ([EXPORT_RETRY_COLUMN] if retries else [])
+    names = [name for name, _ in schema]
+    tmpFilename = filename + '.tmp'
+    if fmt == 'csv':
+        if sys.version_info < (3, 0):
+            fd = open(tmpFilename, 'wb')
+        else:
+            fd = open(tmpFilename, 'w', newline='')  # pylint: disable=unexpected-keyword-arg
+        with fd:
+            writeCSV(columns, names, fd)
+    else:
+        arrowTable = pyarrow.Table.from_arrays(
+            [pyarrow.array(columns[name], type=pyarrow.type_for_alias(typ)) for name, typ in schema], names=names)
+        if fmt == 'parquet':
+            pyarrow.parquet.write_table(arrowTable, tmpFilename)
+        else:
+            pyarrow.feather.write_feather(arrowTable, tmpFilename)
+    os.rename(tmpFilename, filename)
+    return len(columns['jobid'])
@@ -0,0 +1,175 @@
+"""
+History of the status of a task, kept in its project directory by crab status.
+
+Each crab status which reads the status_cache file appends one fixed size record
+with the time, the number of jobs in each state and the wall and CPU time used so
+far. Appending is a single write at the end of the file, reading the last record a
+single seek, so the cost does not grow with the age of the task. From the records
+crab status computes how many jobs finish per hour and when the task should end.
+"""
+
+# pylint: disable=consider-using-f-string
+
+import os
+import struct
+from collections import Counter
+
+# the job states counted in each record, the states not listed here are counted as 'other'
+HISTORY_STATES = ['unsubmitted', 'idle', 'running', 'transferring', 'cooloff', 'finished',
+                  'failed', 'held', 'killed', 'other']
+# the first line of the file is this followed by the comma separated states counted in its records
+HISTORY_HEADER = "CRAB status history v1 "
+# the job throughput is computed from the records of the last 6 hours
+HISTORY_RATE_WINDOW = 6 * 3600
+# and only if the history covers at least 10 minutes
+HISTORY_MIN_SPAN = 600
+
+
+class StatusRecord(object):
+    """ The status of a task at one time: time in seconds since the Epoch, {state: number of jobs},
+        wall and CPU time in seconds used by all the jobs, including the retries
+    """
+    __slots__ = ['time', 'counts', 'wallTime', 'cpuTime']
+
+    def __init__(self, time, counts, wallTime, cpuTime):
+        self.time = time
+        self.counts = counts
+        self.wallTime = wallTime
+        self.cpuTime = cpuTime
+
+    @classmethod
+    def fromTable(cls, table, time):
+        """ the record of the jobs in the StatusCacheTable table at time. The CPU time
+            is the one of the last retry of each job, the wall time the one of all retries.
+        """
+        counts = dict((table.stateNames[code], count) for code, count in Counter(table.states).items())
+        wallTime = sum(wall for wall in table.walls if wall > 0) + sum(table.wastes)
+        cpuTime = sum(cpu for cpu in table.cpuTimes if cpu > 0)
+        return cls(time, counts, wallTime, cpuTime)
+
+    @property
+    def numJobs(self):
+        """ total number of jobs """
+        return sum(self.counts.values())
+
+    @property
+    def numDone(self):
+        """ number of jobs which are not going to run anymore """
+        return self.counts.get('finished', 0) + self.counts.get('failed', 0) + self.counts.get('killed', 0)
+
+    def sameAs(self, other):
+        """ True if other has the same counts and times, whatever its time """
+        return other is not None and (self.counts, self.wallTime, self.cpuTime) == \
+                                     (other.counts, other.wallTime, other.cpuTime)
+
+
+class StatusHistory(object):
+    """ The append-only file of StatusRecords of a task """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.states = HISTORY_STATES
+
+    def _format(self):
+        """ struct format of one record: time, one count per state, wall and CPU time """
+        return '<d%dIdd' % len(self.states)
+
+    def _readHeader(self, fd):
+        """ read the header of the file and set the states of its records, return its length """
+        line = fd.readline()
+        prefix = HISTORY_HEADER.encode()
+        if not line.startswith(prefix) or not line.endswith(b'\n'):
+            raise ValueError("%s is not a status history file" % self.filename)
+        self.states = line[len(prefix):].decode().strip().split(',')
+        return len(line)
+
+    def append(self, record):
+        """ add record at the end of the file, unless it is the same as the last one """
+        if record.sameAs(self.last()):
+            return False
+        counts = [0] * len(self.states)
+        other = self.states.index('other')
+        for state, count in record.counts.items():
+            counts[self.states.index(state) if state in self.states else other] += count
+        data = struct.pack(self._format(), record.time, *(counts + [record.wallTime, record.cpuTime]))
+        if not os.path.isfile(self.filename) or os.path.getsize(self.filename) == 0:
+            data = (HISTORY_HEADER + ",".join(self.states) + "\n").encode() + data
+        # one write in append mode, records of concurrent crab status do not mix
+        with open(self.filename, 'ab') as fd:
+            fd.write(data)
+        return True
+
+    def _unpack(self, data):
+        values = struct.unpack(self._format(), data)
+        counts = dict((state, count) for state, count in zip(self.states, values[1:-2]) if count)
+        return StatusRecord(values[0], counts, values[-2], values[-1])
+
+    def last(self):
+        """ the last StatusRecord, None if there is none """
+        records = self.records(last=1)
+        return records[-1] if records else None
+
+    def records(self, since=None, last=None):
+        """ the list of StatusRecords, or only the last ones, or the ones which tell the status from
+            the time since on: a record is only added when the status changes, so this includes the
+            last one before since. Records are in time order, since is found with a binary search.
+        """
+        if not os.path.isfile(self.filename):
+            return []
+        with open(self.filename, 'rb') as fd:
+            headerSize = self._readHeader(fd)
+            size = struct.calcsize(self._format())
+            fd.seek(0, os.SEEK_END)
+            # an incomplete record at the end (interrupted write) is ignored
+            numRecords = (fd.tell() - headerSize) // size
+            first = 0
+            if last is not None:
+                first = max(numRecords - last, 0)
+            elif since is not None:
+                low, high = 0, numRecords
+                while low < high:
+                    middle = (low + high) // 2
+                    fd.seek(headerSize + middle * size)
+                    if struct.unpack('<d', fd.read(8))[0] < since:
+                        low = middle + 1
+                    else:
+                        high = middle
+                first = max(low - 1, 0)
+            fd.seek(headerSize + first * size)
+            data = fd.read((numRecords - first) * size)
+        return [self._unpack(data[i:i+size]) for i in range(0, len(data), size)]
+
+
+def estimateProgress(records, now, runtime=None, window=HISTORY_RATE_WINDOW):
+    """ From the StatusRecords of a task (the last one being the current status at time now)
+        return (throughput, eta): the jobs done per hour in the last window seconds, and the
+        seconds until all jobs are done. The ETA comes from the throughput or, if no job ended
+        in that window, from runtime (the median runtime of the ended jobs) and the jobs running now,
+        as if the remaining jobs ran in waves of that many jobs, each wave taking runtime.
+        Either is None if it can not be estimated.
+    """
+    if not records:
+        return None, None
+    current = records[-1]
+    remaining = current.numJobs - current.numDone
+    # records are only added when something changes: the status at the start of the
+    # window is the one of the last record before it
+    start = max(records[0].time, now - window)
+    baseline = records[0]
+    for record in records:
+        if record.time > start:
+            break
+        baseline = record
+    throughput = None
+    if now - start >= HISTORY_MIN_SPAN:
+        throughput = max(current.numDone - baseline.numDone, 0) * 3600. / (now - start)
+    if not remaining:
+        return throughput, 0
+    if throughput:
+        return throughput, remaining * 3600. / throughput
+    running = current.counts.get('running', 0)
+    if runtime and running:
+        # as many jobs as running now run in parallel, each taking the median runtime
+        waves = (remaining + running - 1) // running
+        return throughput, waves * runtime
+    return throughput, None
@@ -6,8 +6,23 @@ This module contains the utility methods available for users.
 # pylint: disable=consider-using-f-string, unspecified-encoding, raise-missing-from
 
 import os
+import sys
+import time
+import pickle
 import logging
+import tempfile
 import json
+import hashlib
+import ssl
+import threading
+
+if sys.version_info >= (3, 0):
+    from urllib.parse import urlencode, urlsplit  # pylint: disable=E0611
+    import http.client as httpClient
+if sys.version_info < (3, 0):
+    from urllib import urlencode
+    from urlparse import urlsplit
+    import httplib as httpClient
 
 try:
     from FWCore.PythonUtilities.LumiList import LumiList
@@ -17,9 +32,12 @@ except Exception:  # pylint: disable=broad-except
 
 ## CRAB dependencies
 from CRABClient.ClientUtilities import LOGLEVEL_MUTE, colors
-from CRABClient.ClientUtilities import execute_command
+from CRABClient.ClientUtilities import execute_command, runInThreadPool, getCrabCacheDir
+from CRABClient.ClientUtilities import getWorkArea, PKL_R_MODE
 from CRABClient.ClientExceptions import ClientException
 from CRABClient.ClientUtilities import getUsernameFromCRIC_wrapped
+from CRABClient.RestInterfaces import getDbsREST
+from CRABClient.JobType.BasicJobType import LumiRangeAccumulator
 from WMCore.Configuration import Configuration
 
 def config():
@@ -104,16 +122,286 @@ def curlGetFileFromURL(url, filename = None, proxyfilename = None, logger=None):
     return httpCode
 
 
-def getLumiListInValidFiles(dataset, dbsurl='phys03'):
+WEBDIR_FETCH_MAX_SIZE = 512 * 1024 * 1024
+WEBDIR_FETCH_TIMEOUT = 300
+
+class WebDirFetcher(object):
+    """
+    Read files from the (proxied) webdir of a task directly into memory, for the callers which
+    only parse their content (status_cache, log files), without running curl and going through
+    a temporary file. The HTTPS connections, authenticated with the X509 proxy like curl does,
+    are kept open and reused by the next requests to the same host, also from other threads.
+    Use curlGetFileFromURL to save real downloads into files.
+    """
+
+    def __init__(self, proxyfilename=None, maxSize=WEBDIR_FETCH_MAX_SIZE, timeout=WEBDIR_FETCH_TIMEOUT):
+        self.proxyfilename = proxyfilename
+        self.maxSize = maxSize
+        self.timeout = timeout
+        self._sslContext = None
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _newConnection(self, scheme, netloc):
+        if scheme == 'http':
+            return httpClient.HTTPConnection(netloc, timeout=self.timeout)
+        if self._sslContext is None:
+            capath = os.environ['X509_CERT_DIR'] if 'X509_CERT_DIR' in os.environ else "/etc/grid-security/certificates"
+            context = ssl.create_default_context(capath=capath if os.path.isdir(capath) else None)
+            if self.proxyfilename:
+                context.load_cert_chain(self.proxyfilename, self.proxyfilename)
+            self._sslContext = context
+        return httpClient.HTTPSConnection(netloc, timeout=self.timeout, context=self._sslContext)
+
+    def get(self, url, headers=None, maxSize=None, logger=None):
+        """
+        GET url with the extra request headers, e.g. If-None-Match
+        returns: (httpCode, content, responseHeaders) with the content as bytes (the error page, cut
+                 at maxSize, for codes other than 200) and the response headers in a dictionary with
+                 lower case names
+        raises: ClientException if the file is larger than maxSize (default self.maxSize) bytes,
+                the exceptions of httplib and ssl if the request can not be done
+        """
+        maxSize = maxSize or self.maxSize
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        key = (parts.scheme, parts.netloc)
+        with self._lock:
+            idle = self._idle.get(key)
+            connection = idle.pop() if idle else None
+        reused = connection is not None
+        if logger:
+            logger.debug("Retrieving %s%s", url, " (reusing connection)" if reused else "")
+        while True:
+            if connection is None:
+                connection = self._newConnection(parts.scheme, parts.netloc)
+            try:
+                connection.request('GET', path, headers=headers or {})
+                response = connection.getresponse()
+            except (httpClient.HTTPException, ssl.SSLError, IOError):
+                connection.close()
+                connection = None
+                if not reused:
+                    raise
+                # the server closed the connection kept open, try once with a new one
+                reused = False
+                continue
+            break
+        responseHeaders = dict((name.lower(), value) for name, value in response.getheaders())
+        length = responseHeaders.get('content-length')
+        if response.status == 200 and length and int(length) > maxSize:
+            connection.close()
+            raise ClientException("%s is larger than %d bytes (%s)" % (url, maxSize, length))
+        content = response.read(maxSize + 1)
+        if len(content) > maxSize:
+            connection.close()
+            if response.status == 200:
+                raise ClientException("%s is larger than %d bytes" % (url, maxSize))
+            content = content[:maxSize]
+        elif response.will_close:
+            connection.close()
+        else:
+            with self._lock:
+                self._idle.setdefault(key, []).append(connection)
+        if logger and response.status not in (200, 304):
+            logger.debug("HTTP code %s for %s: %s", response.status, url, content[:1000])
+        return response.status, content, responseHeaders
+
+    def getIfModified(self, url, filename, maxSize=None, logger=None):
+        """
+        Get url through filename, a local copy kept with the Last-Modified and ETag values of
+        the previous download (in filename.headers.json): they are sent as If-Modified-Since and
+        If-None-Match, so the file is only downloaded again if it changed. A new copy is written
+        to a temporary file and renamed, so filename is never partial.
+        returns: (httpCode, content) with httpCode 200 if the file was downloaded and 304 if the
+                 local copy is still good, in both cases content is the content of the file
+        """
+        metaFilename = filename + '.headers.json'
+        meta = {}
+        if os.path.isfile(filename) and os.path.isfile(metaFilename):
+            try:
+                with open(metaFilename) as fd:
+                    meta = json.load(fd)
+            except ValueError:
+                meta = {}
+            if meta.get('url') != url:
+                meta = {}
+        headers = {}
+        if meta.get('lastModified'):
+            headers['If-Modified-Since'] = meta['lastModified']
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        httpCode, content, responseHeaders = self.get(url, headers, maxSize, logger)
+        if httpCode == 304:
+            with open(filename, 'rb') as fd:
+                content = fd.read()
+        elif httpCode == 200:
+            # write the new copy next to the old one and rename, so filename is never partial
+            fh, tmpFilename = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)),
+                                               prefix=os.path.basename(filename) + '.')
+            with os.fdopen(fh, 'wb') as fd:
+                fd.write(content)
+            os.rename(tmpFilename, filename)
+            meta = {'url': url, 'lastModified': responseHeaders.get('last-modified'),
+                    'etag': responseHeaders.get('etag')}
+            with open(metaFilename + '.tmp', 'w') as fd:
+                json.dump(meta, fd)
+            os.rename(metaFilename + '.tmp', metaFilename)
+        return httpCode, content
+
+    def close(self):
+        """ close the connections kept open """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+WEBDIR_FETCHERS = {}
+
+def getWebDirFetcher(proxyfilename=None):
+    """
+    the WebDirFetcher for this proxy, shared by all the commands of this process so
+    that the connections to the webdir are reused
     """
-    Get the runs/lumis in the valid files of a given dataset via dasgoclient
+    if proxyfilename not in WEBDIR_FETCHERS:
+        WEBDIR_FETCHERS[proxyfilename] = WebDirFetcher(proxyfilename)
+    return WEBDIR_FETCHERS[proxyfilename]
+
+
+# the lumis of the valid files of a dataset are read again from DBS after this time,
+# even if DBS says that nothing changed
+VALID_FILES_LUMIS_CACHE_LIFETIME = 24 * 3600
+
+def getLumiListInValidFiles(dataset, dbsurl='phys03', proxyfilename=None, logger=None, useCache=True):
+    """
+    Get the runs/lumis in the valid files of a given dataset
 
     dataset: the dataset name as published in DBS
     dbsurl: the DBS URL or DBS prod instance
-
+    proxyfilename: the x509 proxy used to talk with DBS, defaults to the one in the environment
+    logger: a logger object to use for messages, if missing, it will report to standard logger
+    useCache: reuse the result of a previous call for same dataset if DBS says that the
+              dataset did not change since: same last modification date of dataset and blocks
+              and same summary (number of files, lumis, events, bytes) of the valid files.
+              Results older than VALID_FILES_LUMIS_CACHE_LIFETIME are not reused anyhow
+
+    The file-level run/lumi information is read in bulk from DBS, with one
+    filelumis call per block. The DBS requests are tried only once, if DBS can
+    not be used, fall back to one dasgoclient query per valid file, run concurrently.
     Returns a LumiList object.
     """
 
+    if not logger:
+        logger = logging.getLogger()
+    if not proxyfilename:
+        proxyfilename = os.environ.get('X509_USER_PROXY', '/tmp/x509up_u%d' % os.getuid())
+
+    compactList = None
+    lastModified = None
+    validFiles = None
+    dbsReader = None
+    if os.path.isfile(proxyfilename):
+        instance = dbsurl if dbsurl.startswith('https://') else 'prod/' + dbsurl
+        try:
+            dbsReader, _ = getDbsREST(instance=instance, logger=logger,
+                                      cert=proxyfilename, key=proxyfilename)
+            # dasgoclient is there as fallback, do not wait for retries
+            dbsReader['retry'] = 0
+            dbsReader['minRetries'] = 0
+            lastModified, validFiles, blocks = _getDatasetBlocksFromDBS(dbsReader, dataset)
+        except Exception as ex:  # pylint: disable=broad-except
+            logger.debug("Can not get dataset information from DBS, will use dasgoclient: %s", ex)
+            dbsReader = None
+    else:
+        logger.debug("No proxy found in %s, will use dasgoclient", proxyfilename)
+
+    cacheFile = None
+    if useCache and lastModified:
+        cacheKey = hashlib.sha1(("%s %s" % (dbsurl, dataset)).encode('utf-8')).hexdigest()
+        cacheFile = os.path.join(getCrabCacheDir('validFilesLumis'), cacheKey + '.json')
+        try:
+            with open(cacheFile) as fd:
+                cached = json.load(fd)
+            if cached['dataset'] == dataset and cached['lastModified'] == lastModified and \
+               cached['validFiles'] == validFiles and \
+               time.time() - cached['created'] < VALID_FILES_LUMIS_CACHE_LIFETIME:
+                logger.debug("Using lumis of valid files from cache file %s", cacheFile)
+                return LumiList(compactList=cached['lumis'])
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+    if dbsReader:
+        try:
+            compactList = _getValidFilesLumisFromDBS(dbsReader, blocks)
+        except Exception as ex:  # pylint: disable=broad-except
+            logger.debug("Can not get file lumis from DBS, will use dasgoclient: %s", ex)
+    if compactList is None:
+        compactList = _getValidFilesLumisFromDAS(dataset, dbsurl)
+
+    if cacheFile:
+        tmpFile = "%s.%s" % (cacheFile, os.getpid())
+        with open(tmpFile, 'w') as fd:
+            json.dump({'dataset': dataset, 'lastModified': lastModified, 'validFiles': validFiles,
+                       'created': time.time(), 'lumis': compactList}, fd)
+        os.rename(tmpFile, cacheFile)
+
+    return LumiList(compactList=compactList)
+
+
+def _getDatasetBlocksFromDBS(dbsReader, dataset):
+    """
+    returns the most recent modification date among the dataset and its blocks,
+    the summary of the valid files of the dataset and the list of block names.
+    Files made (in)valid do not change the modification dates, but change the summary
+    """
+    query = {'dataset': dataset, 'dataset_access_type': '*', 'detail': True}
+    datasets, _, _ = dbsReader.get(uri='datasets', data=urlencode(query))
+    if not datasets:
+        raise ClientException("Dataset %s not found in DBS" % dataset)
+    lastModified = datasets[0].get('last_modification_date') or 0
+    query = {'dataset': dataset, 'detail': True}
+    blocks, _, _ = dbsReader.get(uri='blocks', data=urlencode(query))
+    for block in blocks:
+        lastModified = max(lastModified, block.get('last_modification_date') or 0)
+    query = {'dataset': dataset, 'validFileOnly': 1}
+    summaries, _, _ = dbsReader.get(uri='filesummaries', data=urlencode(query))
+    validFiles = [summaries[0].get(key) for key in ['num_file', 'num_lumi', 'num_event', 'file_size']] if summaries else []
+    return lastModified, validFiles, [block['block_name'] for block in blocks]
+
+
+def _getValidFilesLumisFromDBS(dbsReader, blocks):
+    """
+    get the run/lumis of the valid files in a list of blocks with one
+    DBS filelumis call per block. Returns a compact list
+    """
+
+    def getBlockLumis(block):
+        query = {'block_name': block, 'validFileOnly': 1}
+        result, _, _ = dbsReader.get(uri='filelumis', data=urlencode(query))
+        return result
+
+    runLumis = LumiRangeAccumulator()
+    for result in runInThreadPool(getBlockLumis, [(block,) for block in blocks]):
+        # one record per file and run. Depending on DBS version lumi_section_num
+        # is a single lumi or the list of lumis of that file in that run
+        for record in result:
+            lumis = record['lumi_section_num']
+            if not isinstance(lumis, list):
+                lumis = [lumis]
+            runLumis.addLumis(record['run_num'], lumis)
+    return runLumis.getCompactList()
+
+
+def _getValidFilesLumisFromDAS(dataset, dbsurl):
+    """
+    get the run/lumis of the valid files of a dataset via dasgoclient.
+    Returns a compact list
+    """
+
     def complain(cmd, stdout, stderr, returncode):
         """ factor out a bit or distracting code """
         msg = 'Failed executing %s. Exitcode is %s' % (cmd, returncode)
@@ -150,30 +438,27 @@ def getLumiListInValidFiles(dataset, dbsurl='phys03'):
             if file['is_file_valid']:
                 validFiles.append(file['name'])
 
-    # get (run,lumi) pair list from each valid file
-    runLumiPairs = []
-    for file in validFiles:
+    def getFileLumis(file):
         query = "lumi file=%s" % file
         cmd = dasCmd % query
         stdout, stderr, returncode = execute_command(command=cmd)
         if returncode or not stdout:
             complain(cmd, stdout, stderr, returncode)
-        else:
-            result = json.loads(stdout)
-            # returns a list of dictionaries, one per lumi, with keys 'das', 'qhash' and 'lumi'
-            # valud of 'lumi' is a list of dictionaries with only 1 element and
-            # keys: 'event_count', 'file', 'lumi_section_num', 'nevents', 'number', 'run.run_number', 'run_number'
-            # upon inspection run.run_number is always 0
-            for lumiInfo in result:
-                lumiDict = lumiInfo['lumi'][0]
-                run = lumiDict['run_number']
-                lumi = lumiDict['lumi_section_num']
-                runLumiPairs.append((run, lumi))
+        return stdout
 
-    # transform into a LumiList object
-    lumiList = LumiList(lumis=runLumiPairs)
+    # get (run,lumi) pair list from each valid file, running the queries concurrently
+    runLumis = LumiRangeAccumulator()
+    for stdout in runInThreadPool(getFileLumis, [(file,) for file in validFiles]):
+        result = json.loads(stdout)
+        # returns a list of dictionaries, one per lumi, with keys 'das', 'qhash' and 'lumi'
+        # valud of 'lumi' is a list of dictionaries with only 1 element and
+        # keys: 'event_count', 'file', 'lumi_section_num', 'nevents', 'number', 'run.run_number', 'run_number'
+        # upon inspection run.run_number is always 0
+        for lumiInfo in result:
+            lumiDict = lumiInfo['lumi'][0]
+            runLumis.addLumis(lumiDict['run_number'], [lumiDict['lumi_section_num']])
 
-    return lumiList
+    return runLumis.getCompactList()
 
 
 def getLoggers():
@@ -193,23 +478,75 @@ def setConsoleLogLevel(lvl):
         for h in logging.getLogger('CRAB3.all').handlers:
             h.setLevel(lvl)
 
-def getMutedStatusInfo(logger=None, proxy=None, projdir=None):
+# status information already computed in this process, see getStatusInfo
+STATUS_INFO = {}
+# the status_cache file on the schedd is not refreshed more often than every few minutes,
+# older results are recomputed
+STATUS_INFO_MAX_AGE = 300
+
+
+def _statusInfoKey(projdir):
     """
-    Mute the status console output before calling status and change it back to normal afterwards.
+    key (project directory, task name) for the STATUS_INFO memo, None if the
+    project directory has no readable .requestcache
     """
+    if not projdir:
+        return None
+    requestarea, _ = getWorkArea(projdir)
+    try:
+        with open(os.path.join(requestarea, '.requestcache'), PKL_R_MODE) as fd:
+            requestName = pickle.load(fd)['RequestName']
+    except Exception:  # pylint: disable=broad-except
+        return None
+    return (os.path.realpath(requestarea), requestName)
+
+
+def getStatusInfo(logger=None, proxy=None, projdir=None, instance=None, maxAge=STATUS_INFO_MAX_AGE):
+    """
+    Return the dictionary returned by the status command for the task in projdir, computing it
+    only once per process: later calls for the same project directory and task get (a copy of)
+    the same result as long as it is not older than maxAge seconds (None means no limit).
+    The copy is shallow: the values (jobList, jobs, jobsPerStatus, ...) are shared by all the
+    callers and must not be modified, callers which need to change them must copy them first
+    (a deep copy of 'jobs' takes seconds for large tasks).
+    The status command runs without printing tables and summaries, callers which
+    want it silent need to mute the logger.
+    """
+    key = _statusInfoKey(projdir)
+    if key in STATUS_INFO:
+        computedAt, statusDict = STATUS_INFO[key]
+        if maxAge is None or time.time() - computedAt <= maxAge:
+            if logger:
+                logger.debug("Reusing status information for task %s from %d seconds ago" % (key[1], time.time() - computedAt))
+            return dict(statusDict)
     mod = __import__('CRABClient.Commands.status', fromlist='status')
     cmdargs = []
     if proxy:
         cmdargs.append("--proxy")
         cmdargs.append(proxy)
+    if instance:
+        cmdargs.append("--instance")
+        cmdargs.append(instance)
     if projdir:
         cmdargs.append("-d")
         cmdargs.append(projdir)
-    cmdobj = getattr(mod, 'status')(logger=logger, cmdargs=cmdargs)
+    cmdobj = getattr(mod, 'status')(logger=logger, cmdargs=cmdargs, renderOutput=False)
+    statusDict = cmdobj.__call__()
+    if key and statusDict.get('commandStatus') == 'SUCCESS' and not statusDict.get('statusFailureMsg'):
+        STATUS_INFO[key] = (time.time(), statusDict)
+    return dict(statusDict)
+
+
+def getMutedStatusInfo(logger=None, proxy=None, projdir=None, maxAge=STATUS_INFO_MAX_AGE):
+    """
+    Mute the status console output before calling status and change it back to normal afterwards.
+    """
     loglevel = getConsoleLogLevel()
     setConsoleLogLevel(LOGLEVEL_MUTE)
-    statusDict = cmdobj.__call__()
-    setConsoleLogLevel(loglevel)
+    try:
+        statusDict = getStatusInfo(logger=logger, proxy=proxy, projdir=projdir, maxAge=maxAge)
+    finally:
+        setConsoleLogLevel(loglevel)
 
     if statusDict['statusFailureMsg']:
         # If something happens during status execution we still want to print it
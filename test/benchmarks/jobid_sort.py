@@ -0,0 +1,92 @@
+#! /usr/bin/env python
+"""
+Time the sorting of 10^5 to 10^6 job ids as done by crab status, with the job ids
+of a task with automatic splitting (probe jobs 0-N, processing jobs, tail jobs N-M), e.g.
+    python test/benchmarks/jobid_sort.py --sizes 100000,1000000
+compares the comparison function used before (through cmp_to_key) with jobidSortKey,
+with a JobidSortKeys cache and with the key table of the StatusCacheTable.
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import random
+import time
+from functools import cmp_to_key
+from optparse import OptionParser
+
+from CRABClient.ClientUtilities import jobidSortKey, JobidSortKeys, sortJobids
+from CRABClient.StatusCacheTable import StatusCacheTable
+
+
+def splitCompareJobids(a, b):
+    """ the comparison function of job ids crab status used to sort with """
+    aa = [int(x) for x in a.split('-')]
+    bb = [int(x) for x in b.split('-')]
+    if len(aa) < len(bb):
+        if bb[0] == 0:
+            return 1
+        return -1
+    elif len(aa) > len(bb):
+        if aa[0] == 0:
+            return -1
+        return 1
+    elif aa[0] == bb[0]:
+        if aa[1] == bb[1]:
+            return 0
+        else:
+            return 1 if aa[1] > bb[1] else -1
+    return 1 if aa[0] > bb[0] else -1
+
+
+def makeJobids(numJobs, seed=1, numProbes=5, tailFraction=0.1, tailsPerJob=4):
+    """ numJobs job ids in random order: numProbes probe jobs, processing jobs and, for
+        tailFraction of the processing jobs, tailsPerJob tail jobs
+    """
+    rand = random.Random(seed)
+    jobids = ['0-%d' % (i + 1) for i in range(numProbes)]
+    numMain = int((numJobs - numProbes) / (1 + tailFraction * tailsPerJob))
+    jobids += [str(i + 1) for i in range(numMain)]
+    rescheduled = rand.sample(range(1, numMain + 1), min(numMain, (numJobs - len(jobids)) // tailsPerJob + 1))
+    for jobid in rescheduled:
+        for tail in range(tailsPerJob):
+            if len(jobids) == numJobs:
+                break
+            jobids.append('%d-%d' % (jobid, tail + 1))
+    rand.shuffle(jobids)
+    return jobids
+
+
+def timeit(function):
+    """ (result, seconds) of function() """
+    start = time.time()
+    result = function()
+    return result, time.time() - start
+
+
+def main():
+    parser = OptionParser(usage="%prog [--sizes N,M,...] [--repeat R]")
+    parser.add_option('--sizes', default='100000,300000,1000000')
+    parser.add_option('--repeat', type='int', default=3,
+                      help="number of sorts of the same job ids, as done by crab status --long --sort")
+    (options, _) = parser.parse_args()
+
+    print("%10s %12s %12s %12s %12s %12s" % ("jobs", "cmp (s)", "key (s)", "cached (s)", "table (s)", "keys (s)"))
+    for numJobs in [int(size) for size in options.sizes.split(',')]:
+        jobids = makeJobids(numJobs)
+        expected, cmpTime = timeit(lambda: [sorted(jobids, key=cmp_to_key(splitCompareJobids))
+                                            for _ in range(options.repeat)][-1])
+        result, keyTime = timeit(lambda: [sorted(jobids, key=jobidSortKey) for _ in range(options.repeat)][-1])
+        assert result == expected
+        sortKeys = JobidSortKeys()
+        result, cachedTime = timeit(lambda: [sortJobids(jobids, sortKeys) for _ in range(options.repeat)][-1])
+        assert result == expected
+        table = StatusCacheTable(dict((jobid, {'State': 'finished'}) for jobid in jobids))
+        _, keysTime = timeit(lambda: table.sortKeys)
+        result, tableTime = timeit(lambda: [sortJobids(jobids, table.sortKeys) for _ in range(options.repeat)][-1])
+        assert result == expected
+        print("%10d %12.3f %12.3f %12.3f %12.3f %12.3f" % (numJobs, cmpTime, keyTime, cachedTime, tableTime, keysTime))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+"""
+Time the compression of a synthetic sandbox of N MB, e.g.
+    python test/benchmarks/sandbox_compression.py --size 200 --threads 1,4,8
+compares tarfile.open(mode='w:bz2'), single threaded, with ParallelBZ2File and the given
+numbers of threads, and checks that each file is read back the same by the tarfile module
+and, if available, by bzip2 -t and tar.
+The content mixes incompressible data, as in shared libraries, with repetitive text.
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import random
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+from optparse import OptionParser
+
+from CRABClient.JobType.UserTarball import ParallelBZ2File, compressionThreads
+
+
+def makeArea(directory, sizeMB):
+    """ sizeMB of files of 1 MB in directory, a tenth of each random bytes """
+    generator = random.Random(1)
+    for i in range(sizeMB):
+        with open(os.path.join(directory, 'lib%d.so' % i), 'wb') as fd:
+            fd.write(bytearray(generator.getrandbits(8) for _ in range(100000)))
+            fd.write(('line %d of some text\n' % i).encode('utf-8') * 40000)
+
+
+def compress(area, tarName, threads):
+    """ seconds to write area to tarName, with tarfile (threads None) or ParallelBZ2File """
+    start = time.time()
+    if threads is None:
+        tar = tarfile.open(tarName, mode='w:bz2')
+        tar.add(area, arcname='lib')
+        tar.close()
+    else:
+        compressedFile = ParallelBZ2File(tarName, threads=threads)
+        tar = tarfile.open(mode='w', fileobj=compressedFile)
+        tar.add(area, arcname='lib')
+        tar.close()
+        compressedFile.close()
+    return time.time() - start
+
+
+def check(tarName, names):
+    """ 'ok' if tarName has the files names, read by the tarfile module and the command line tools """
+    with tarfile.open(tarName, mode='r:bz2') as tar:
+        if sorted(member.name for member in tar if member.isfile()) != names:
+            return 'FAILED'
+    for command in (['bzip2', '-t', tarName], ['tar', 'tjf', tarName]):
+        try:
+            with open(os.devnull, 'w') as devnull:
+                failed = subprocess.call(command, stdout=devnull, stderr=devnull)
+        except OSError:
+            # the command is not available
+            continue
+        if failed:
+            return 'FAILED (%s)' % command[0]
+    return 'ok'
+
+
+def main():
+    parser = OptionParser(usage="%prog [--size MB] [--threads N,M,...]")
+    parser.add_option('--size', type='int', default=50, help="size of the sandbox content in MB")
+    parser.add_option('--threads', default=None,
+                      help="numbers of threads to try, by default 1 and the one used by crab submit")
+    (options, _) = parser.parse_args()
+    threadsList = [int(threads) for threads in options.threads.split(',')] if options.threads \
+                  else sorted(set([1, compressionThreads()]))
+
+    workDir = tempfile.mkdtemp()
+    try:
+        area = os.path.join(workDir, 'lib')
+        os.makedirs(area)
+        makeArea(area, options.size)
+        names = sorted('lib/%s' % name for name in os.listdir(area))
+        print("%d MB, %d cores" % (options.size, compressionThreads()))
+        print("%-20s %10s %10s %8s" % ("compression", "time (s)", "size (MB)", "check"))
+        for threads in [None] + threadsList:
+            tarName = os.path.join(workDir, 'sandbox.tgz')
+            elapsed = compress(area, tarName, threads)
+            label = 'tarfile w:bz2' if threads is None else 'parallel %d threads' % threads
+            print("%-20s %10.2f %10.2f %8s" % (label, elapsed, os.path.getsize(tarName) / 1e6, check(tarName, names)))
+            os.remove(tarName)
+    finally:
+        shutil.rmtree(workDir)
+
+
+if __name__ == '__main__':
+    main()
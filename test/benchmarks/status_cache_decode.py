@@ -0,0 +1,77 @@
+#! /usr/bin/env python
+"""
+Time the decoding of synthetic status_cache files of 10^3 to 10^6 jobs, e.g.
+    python test/benchmarks/status_cache_decode.py --sizes 10000,100000
+compares status_cache.pkl (pickle.loads of the whole file) with status_cache.jsonl.gz:
+the whole dictionary as given by JsonStatusCache.load(), and the StatusCacheTable built
+from the jobs read one at a time, without the dictionary. With --memory (python3) also
+print the peak memory of each.
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import gc
+import pickle
+import time
+from optparse import OptionParser
+
+from CRABClient.StatusCacheFile import JsonStatusCache, encodeJsonStatusCache
+from CRABClient.StatusCacheTable import StatusCacheTable
+
+from status_summary import makeStatusCache
+
+
+def measure(function, memory):
+    """ (seconds, peak memory in bytes or None) of function() """
+    gc.collect()
+    if memory:
+        import tracemalloc  # pylint: disable=import-outside-toplevel
+        tracemalloc.start()
+    start = time.time()
+    result = function()
+    elapsed = time.time() - start
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    del result
+    return elapsed, peak
+
+
+def buildTable(data):
+    """ the StatusCacheTable of the jobs of a status_cache.jsonl.gz file, read one at a time """
+    jsonCache = JsonStatusCache(data)
+    table = StatusCacheTable({})
+    for jobid, info in jsonCache.records():
+        table.append(jobid, info)
+    return table
+
+
+def main():
+    parser = OptionParser(usage="%prog [--sizes N,M,...] [--memory]")
+    parser.add_option('--sizes', default='1000,10000,100000')
+    parser.add_option('--memory', action='store_true', default=False,
+                      help="measure the peak memory of the decoding (python3, slower)")
+    (options, _) = parser.parse_args()
+
+    print("%10s %10s %10s %10s %10s %10s %12s %12s %12s" %
+          ("jobs", "pkl (MB)", "json (MB)", "pkl (s)", "json (s)", "table (s)", "pkl peak", "json peak", "table peak"))
+    for numJobs in [int(size) for size in options.sizes.split(',')]:
+        nodes = makeStatusCache(numJobs, numInfos=numJobs)
+        nodes['DagStatus'] = {'DagStatus': 1, 'Timestamp': 0}
+        statusCache = {'nodes': nodes}
+        pklData = pickle.dumps(statusCache, protocol=2)
+        jsonData = encodeJsonStatusCache(statusCache)
+        assert JsonStatusCache(jsonData).load() == statusCache
+        del nodes, statusCache
+        pklTime, pklPeak = measure(lambda: pickle.loads(pklData), options.memory)
+        jsonTime, jsonPeak = measure(lambda: JsonStatusCache(jsonData).load(), options.memory)
+        tableTime, tablePeak = measure(lambda: buildTable(jsonData), options.memory)
+        peaks = ["%12.1f" % (peak / 1e6) if peak is not None else "%12s" % '-' for peak in (pklPeak, jsonPeak, tablePeak)]
+        print("%10d %10.2f %10.2f %10.3f %10.3f %10.3f %s" %
+              (numJobs, len(pklData) / 1e6, len(jsonData) / 1e6, pklTime, jsonTime, tableTime, " ".join(peaks)))
+
+
+if __name__ == '__main__':
+    main()
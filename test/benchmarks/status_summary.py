@@ -0,0 +1,134 @@
+#! /usr/bin/env python
+"""
+Time the aggregation and formatting done by crab status on synthetic status_cache
+job tables of 10^3 to 10^6 jobs, e.g.
+    python test/benchmarks/status_summary.py --sizes 1000,100000 --long --sort site,-memory
+With --memory (python3) also compare the memory taken by the job table as a dictionary
+and as a StatusCacheTable.
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import gc
+import logging
+import pickle
+import random
+import time
+from optparse import OptionParser
+
+from CRABClient.Commands.status import status, summarizeJobs
+from CRABClient.StatusCacheTable import StatusCacheTable
+
+STATES = ['finished'] * 6 + ['running'] * 2 + ['failed', 'idle', 'cooloff', 'transferring', 'held']
+SITES = ['T1_DE_KIT', 'T2_CH_CERN', 'T2_US_MIT', 'T2_IT_Pisa', 'Unknown']
+ERRORS = [[50664, 'Job killed because of too much wall clock'], [8021, 'FileReadError'],
+          [60324, 'Stageout failure'], [8001, 'Other CMS exception']]
+
+
+def makeJobInfos(numInfos, seed=1):
+    """ a pool of per job dictionaries, shared between the jobs to bound the memory of big tables """
+    rand = random.Random(seed)
+    infos = []
+    for _ in range(numInfos):
+        retries = rand.randint(0, 3)
+        state = rand.choice(STATES)
+        info = {'State': state, 'Retries': retries, 'Restarts': rand.randint(0, 1),
+                'SiteHistory': [rand.choice(SITES) for _ in range(retries + 1)],
+                'WallDurations': [rand.randint(60, 40000) for _ in range(retries + 1)],
+                'ResidentSetSize': [rand.randint(100000, 3000000) for _ in range(retries + 1)],
+                'TotalSysCpuTimeHistory': [rand.randint(0, 2000)],
+                'TotalUserCpuTimeHistory': [rand.randint(0, 30000)],
+                'JobIds': ['%d.0' % rand.randint(1, 9999)]}
+        if state == 'failed':
+            info['Error'] = rand.choice(ERRORS)
+        infos.append(info)
+    return infos
+
+
+def makeStatusCache(numJobs, automatic=False, seed=1, numInfos=1000):
+    """ {jobid: info} for numJobs jobs, with probe and tail jobs for automatic splitting """
+    infos = makeJobInfos(numInfos, seed)
+    statusCache = {}
+    for i in range(numJobs):
+        if automatic and i < 5:
+            jobid = '0-%d' % (i + 1)
+        elif automatic and i % 10 == 0:
+            jobid = '%d-%d' % (i // 10 + 1, i % 7 + 1)
+        else:
+            jobid = str(i + 1)
+        statusCache[jobid] = infos[i % len(infos)]
+    return statusCache
+
+
+def measureMemory(numJobs, automatic):
+    """ memory in bytes of the job table decoded from status_cache, and of its StatusCacheTable """
+    import tracemalloc  # pylint: disable=import-outside-toplevel
+    data = pickle.dumps(makeStatusCache(numJobs, automatic, numInfos=numJobs), protocol=2)
+    gc.collect()
+    tracemalloc.start()
+    statusCache = pickle.loads(data)
+    dictSize = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tracemalloc.start()
+    table = StatusCacheTable(statusCache)
+    tableSize = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del table, statusCache
+    return dictSize, tableSize, len(data)
+
+
+def main():
+    parser = OptionParser(usage="%prog [--sizes N,M,...] [--automatic] [--long]")
+    parser.add_option('--sizes', default='1000,10000,100000,1000000')
+    parser.add_option('--automatic', action='store_true', default=False)
+    parser.add_option('--long', action='store_true', default=False,
+                      help="also format the extended job table and the error summary")
+    parser.add_option('--sort', default=None,
+                      help="also time crab status --sort with these keys, e.g. runtime or site,-memory")
+    parser.add_option('--memory', action='store_true', default=False,
+                      help="measure the memory of the job table (slow, needs one dictionary per job)")
+    (options, _) = parser.parse_args()
+
+    logger = logging.getLogger('benchmark')
+    logger.addHandler(logging.NullHandler())
+    command = status.__new__(status)
+    command.logger = logger
+    command.options = type('Options', (object,), {'sort': None, 'verboseErrors': True, 'long': options.long,
+                                                  'columns': None})()
+
+    sizes = [int(size) for size in options.sizes.split(',')]
+    print("%10s %12s %12s %12s %12s %12s" % ("jobs", "table (s)", "counts (s)", "summary (s)", "format (s)", "sort (s)"))
+    for numJobs in sizes:
+        statusCache = makeStatusCache(numJobs, options.automatic)
+        gc.collect()
+        start = time.time()
+        table = StatusCacheTable(statusCache)
+        conversion = time.time() - start
+        start = time.time()
+        summarizeJobs(table, options.automatic, onlyCounts=True)
+        counts = time.time() - start
+        start = time.time()
+        jobsSummary = summarizeJobs(table, options.automatic, allErrors=options.long)
+        summary = time.time() - start
+        start = time.time()
+        command.printErrors(jobsSummary)
+        command.printSummary(jobsSummary)
+        sortdict = command.printDetails(jobsSummary, options.automatic, quiet=not options.long)
+        formatting = time.time() - start
+        start = time.time()
+        if options.sort:
+            command.printSort(sortdict, options.sort)
+        sorting = time.time() - start
+        print("%10d %12.3f %12.3f %12.3f %12.3f %12.3f" % (numJobs, conversion, counts, summary, formatting, sorting))
+        del statusCache, table, jobsSummary
+
+    if options.memory:
+        print("\n%10s %14s %14s %14s" % ("jobs", "dict (MB)", "table (MB)", "pickle (MB)"))
+        for numJobs in sizes:
+            dictSize, tableSize, pickleSize = measureMemory(numJobs, options.automatic)
+            print("%10d %14.1f %14.1f %14.1f" % (numJobs, dictSize/1e6, tableSize/1e6, pickleSize/1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+#! /usr/bin/env python
+
+"""
+_report_t_
+
+Unittests for the report command, using the fake dasgoclient in test/data
+"""
+
+import gzip
+import io
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from CRABClient.Commands import report as reportModule
+from CRABClient.Commands.report import report, iterJSONArray, IncrementalJSONWriter, writeJSONArtifacts
+from CRABClient.JobType.BasicJobType import LumiRangeAccumulator
+
+FAKE_DASGOCLIENT_DIR = os.path.join(os.path.dirname(__file__), '../../../data')
+
+
+def makeReportData(numJobs, resultsDir):
+    """
+    create the tarballs with lumis and files to process for numJobs jobs in resultsDir
+    and return the reportData that collectReportData would return for such a task
+    where odd jobs are finished and even ones failed. Job 1 processed again the
+    lumis of job 3, to have some duplicates.
+    """
+    def addToTar(tar, name, content):
+        content = content.encode('utf-8')
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+
+    runsAndLumis = {}
+    jobStatus = {}
+    lumisTar = tarfile.open(os.path.join(resultsDir, 'run_and_lumis.tar.gz'), 'w:gz')
+    filesTar = tarfile.open(os.path.join(resultsDir, 'input_files.tar.gz'), 'w:gz')
+    for job in range(1, numJobs + 1):
+        jobid = str(job)
+        first, last = 10 * job + 1, 10 * job + 10
+        lfn = '/store/data/Run1/file%d.root' % job
+        addToTar(lumisTar, 'job_lumis_%s.json' % jobid, json.dumps({'1': [[first, last]]}))
+        addToTar(filesTar, 'job_input_file_list_%s.txt' % jobid, json.dumps([lfn]))
+        jobStatus[jobid] = 'finished' if job % 2 else 'failed'
+        if job % 2:
+            lumis = list(range(first, last + 1))
+            if job == 1:
+                lumis += list(range(31, 41))
+            runsAndLumis[jobid] = [
+                {'type': 'POOLIN', 'lfn': lfn + '_' + jobid, 'events': 100,
+                 'runlumi': str({1: [str(lumi) for lumi in lumis]})},
+                {'type': 'EDM', 'lfn': '/store/user/out_%s.root' % jobid, 'events': 50, 'runlumi': '{}'},
+            ]
+    lumisTar.close()
+    filesTar.close()
+    return {'runsAndLumis': runsAndLumis, 'jobStatus': jobStatus}
+
+
+class reportTest(unittest.TestCase):
+    """
+    unittest for the report command methods which do not need a CRAB server
+    """
+
+    logger = logging.getLogger('UNITTEST')
+    logger.setLevel(logging.DEBUG)
+
+    def setUp(self):
+        self.oldEnv = dict(os.environ)
+        os.environ['PATH'] = os.path.abspath(FAKE_DASGOCLIENT_DIR) + os.pathsep + os.environ['PATH']
+        os.environ['FAKE_DASGOCLIENT_FILES'] = '20'
+        os.environ['FAKE_DASGOCLIENT_RUNS'] = '2'
+        os.environ['FAKE_DASGOCLIENT_LUMIS'] = '4'
+        # avoid running SubCommand.__init__ which needs a proxy and a CRAB server
+        self.report = report.__new__(report)
+        self.report.logger = self.logger
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.oldEnv)
+
+    def testIterJSONArray(self):
+        """
+        Test that records are decoded one by one
+        """
+        text = ' [{"a": [1, 2]}, {"b": "]"} ,{}]\n'
+        self.assertEqual(list(iterJSONArray(text)), [{'a': [1, 2]}, {'b': ']'}, {}])
+        self.assertEqual(list(iterJSONArray('[]')), [])
+
+    def testLumiRangeAccumulator(self):
+        """
+        Test that ranges are merged regardless of the order lumis are added in
+        """
+        acc = LumiRangeAccumulator()
+        acc.addLumis(1, [5, 3, 4])
+        acc.addLumis('1', [1, 2, 2, 9])
+        acc.addRanges(2, [[10, 20], [15, 30]])
+        self.assertEqual(acc.getCompactList(), {'1': [[1, 5], [9, 9]], '2': [[10, 30]]})
+
+    def testPublicationInfo(self):
+        """
+        Test lumis and events from dasgoclient for two datasets
+        """
+        datasets = ['/A/user-a/USER', '/B/user-b/USER']
+        res = self.report.getDBSPublicationInfo_viaDasGoclient(datasets)
+        for dataset in datasets:
+            info = res['outputDatasets'][dataset]
+            self.assertEqual(info['numEvents'], 20 * 4 * 10)
+            # even files in run 1, odd files in run 2, 4 lumis per file
+            self.assertEqual(len(info['lumis']['1']), 10)
+            self.assertEqual(info['lumis']['2'][0], [5, 8])
+
+    def testPublicationInfoConcurrent(self):
+        """
+        Test that the dasgoclient queries overlap
+        """
+        os.environ['FAKE_DASGOCLIENT_DELAY'] = '1'
+        start = time.time()
+        self.report.getDBSPublicationInfo_viaDasGoclient(['/A/user-a/USER', '/B/user-b/USER'])
+        self.assertTrue(time.time() - start < 3)
+
+    def _processJobs(self, numJobs):
+        """ run the report pipeline on a task with numJobs jobs """
+        import tracemalloc  # python3 only
+        resultsDir = tempfile.mkdtemp()
+        self.tmpDirs.append(resultsDir)
+        self.report.resultsDir = resultsDir
+        self.report.options = type('Options', (object,), {'recovery': 'failed'})()
+        reportData = makeReportData(numJobs, resultsDir)
+        fileWriters = dict((name, IncrementalJSONWriter(os.path.join(resultsDir, name + '.json')))
+                           for name in ['filesToProcess', 'processedFiles', 'failedFiles'])
+        tracemalloc.start()
+        jobsData = self.report.processJobs(reportData, fileWriters)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        for writer in fileWriters.values():
+            writer.commit()
+        return jobsData, peak
+
+    def testProcessJobs(self):
+        """
+        Test the content of the report produced by the streaming pipeline
+        """
+        self.tmpDirs = []
+        try:
+            jobsData, _ = self._processJobs(10)
+            self.assertEqual(jobsData['numFinishedJobs'], 5)
+            self.assertEqual(jobsData['numFilesProcessed'], 5)
+            self.assertEqual(jobsData['numEventsRead'], 500)
+            self.assertEqual(jobsData['numEventsWritten'], {'EDM': 250, 'TFile': 0, 'FAKE': 0})
+            self.assertEqual(jobsData['lumisToProcess'], {'1': [[11, 110]]})
+            self.assertEqual(jobsData['processedLumis']['1'][:2], [[11, 20], [31, 40]])
+            self.assertEqual(jobsData['outputFilesDuplicateLumis'], {'1': [[31, 40]]})
+            self.assertEqual(len(jobsData['failedLumisToProcess']['1']), 5)
+            with open(os.path.join(self.report.resultsDir, 'processedFiles.json')) as fd:
+                processedFiles = json.load(fd)
+            self.assertEqual(sorted(processedFiles), ['1', '3', '5', '7', '9'])
+            with open(os.path.join(self.report.resultsDir, 'filesToProcess.json')) as fd:
+                self.assertEqual(len(json.load(fd)), 10)
+        finally:
+            for tmpDir in self.tmpDirs:
+                shutil.rmtree(tmpDir)
+
+    def testProcessJobsMemory(self):
+        """
+        Memory regression test: the memory used by the report pipeline, on top of the
+        report2 information it is given, must only grow with the size of the results
+        (distinct input files, lumi ranges), not hold per-job file and lumi lists
+        """
+        try:
+            import tracemalloc  # pylint: disable=unused-import
+        except ImportError:
+            self.skipTest("tracemalloc is not available in python2")
+        self.tmpDirs = []
+        try:
+            _, peakSmall = self._processJobs(1000)
+            _, peakLarge = self._processJobs(10000)
+        finally:
+            for tmpDir in self.tmpDirs:
+                shutil.rmtree(tmpDir)
+        # in this task every finished job adds one input file name and one lumi range
+        # to the results, a few hundred bytes. Keeping the per-job dictionaries costs KBs
+        perJob = (peakLarge - peakSmall) / 9000.
+        self.assertTrue(perJob < 1024, "peak memory grows by %d bytes per job" % perJob)
+
+    def testWriteJSONArtifacts(self):
+        """
+        Test that report files written in parallel are complete and that no temporary
+        file is left behind, also for the gzipped per-job file lists
+        """
+        outDir = tempfile.mkdtemp()
+        try:
+            artifacts = [('lumis%d.json' % i, {'1': [[i, i + 10]]}) for i in range(10)]
+            writeJSONArtifacts(outDir, artifacts, self.logger)
+            for filename, data in artifacts:
+                with open(os.path.join(outDir, filename)) as fd:
+                    self.assertEqual(json.load(fd), data)
+            writer = IncrementalJSONWriter(os.path.join(outDir, 'processedFiles.json'), compress=True)
+            writer.add(1, ['/store/a.root'])
+            writer.add('2', ['/store/b.root', '/store/c.root'])
+            writer.commit()
+            with gzip.open(os.path.join(outDir, 'processedFiles.json.gz'), 'rt') as fd:
+                self.assertEqual(json.load(fd), {'1': ['/store/a.root'], '2': ['/store/b.root', '/store/c.root']})
+            self.assertEqual(len(os.listdir(outDir)), 11)
+        finally:
+            shutil.rmtree(outDir)
+
+    def testNoTemporaryFilesOnFailure(self):
+        """
+        Test that a failure after the jobs were streamed leaves no temporary file in the output directory
+        """
+        self.tmpDirs = []
+        try:
+            resultsDir = tempfile.mkdtemp()
+            self.tmpDirs.append(resultsDir)
+            reportData = makeReportData(10, resultsDir)
+            reportData.update({'publication': False, 'outputDatasets': [],
+                               'inputDatasetLumis': {}, 'inputDatasetDuplicateLumis': {}})
+            self.report.collectReportData = lambda: reportData
+            self.report.resultsDir = resultsDir
+            self.report.taskInfo = {'splitting': 'LumiBased'}
+            self.report.options = type('Options', (object,), {'recovery': 'notFinished', 'outdir': None, 'compress': False})()
+            before = sorted(os.listdir(resultsDir))
+            with mock.patch.object(reportModule, 'writeJSONArtifacts', side_effect=IOError('disk full')):
+                self.assertRaises(IOError, self.report)
+            self.assertEqual(sorted(os.listdir(resultsDir)), before)
+        finally:
+            for tmpDir in self.tmpDirs:
+                shutil.rmtree(tmpDir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+
+"""
+_resubmit_t_
+
+Unittests for crab resubmit --auto-tune, without a CRAB server
+"""
+
+import logging
+import unittest
+
+from CRABClient.StatusCacheTable import StatusCacheTable
+from CRABClient.Commands.resubmit import resubmit, recommendResubmitParameters, getTaskSiteBlacklist, getTaskParameter
+
+
+def makeJobs(numJobs=40):
+    """ a job table where the jobs finished on T2_A and T2_B within 1 hour and 1500 MB, except
+        for the 2 jobs which failed for too much memory, and where most runs on T2_C failed
+    """
+    jobs = {}
+    for i in range(numJobs):
+        site = ['T2_A', 'T2_B'][i % 2]
+        jobs[str(i + 1)] = {'State': 'finished', 'SiteHistory': ['T2_C', site], 'WallDurations': [600, 1800 + 30 * i],
+                            'ResidentSetSize': [500000, 1000000 + 10000 * i]}
+    for jobid in ['1', '2']:
+        jobs[jobid].update({'State': 'failed', 'Error': [50660, 'Memory'], 'ResidentSetSize': [500000, 2048000]})
+    return jobs
+
+
+class resubmitTest(unittest.TestCase):
+    """
+    unittest for the parameters recommended by crab resubmit --auto-tune
+    """
+
+    logger = logging.getLogger('UNITTEST')
+
+    def testRecommendResubmitParameters(self):
+        """
+        Test memory and runtime from the percentiles of the runs, and the blacklist of the failing site
+        """
+        table = StatusCacheTable(makeJobs())
+        tuning = recommendResubmitParameters(table, ['3', '4'], 4000, 1315)
+        self.assertEqual(tuning['numRuns'], 80)
+        # 99% of the runs below 2000 MB plus 20%
+        self.assertEqual(tuning['maxmemory'], 2400)
+        # 99% of the runs within 3000 s plus 20%: 60 minutes, the minimum
+        self.assertEqual(tuning['maxjobruntime'], 60)
+        self.assertEqual(tuning['siteblacklist'], ['T2_C'])
+        self.assertEqual([option for option, _ in tuning['reasons']], ['maxmemory', 'maxjobruntime', 'siteblacklist'])
+        # jobs which ran out of memory get more, the blacklist of the task is kept
+        tuning = recommendResubmitParameters(table, ['1', '2'], 2000, 60, taskSiteBlacklist=['T1_X_Y'])
+        self.assertEqual(tuning['maxmemory'], 3000)
+        self.assertIsNone(tuning['maxjobruntime'])
+        self.assertEqual(tuning['siteblacklist'], ['T1_X_Y', 'T2_C'])
+        # no site is blacklisted if all of them are bad
+        table = StatusCacheTable({'1': {'State': 'failed', 'SiteHistory': ['T2_C'] * 20, 'WallDurations': [10] * 20}})
+        self.assertIsNone(recommendResubmitParameters(table, ['1'], 2000, 1315)['siteblacklist'])
+
+    def testAutoTune(self):
+        """
+        Test that the recommended values are used, but not instead of the ones given by the user
+        """
+        command = resubmit.__new__(resubmit)
+        command.logger = self.logger
+        command.jobids = ['1', '2']
+        command.maxMemory, command.maxJobRuntime, command.numCores = 2000, 1315, 1
+        command.taskSiteBlacklist = None
+        command.siteblacklist = None
+        command.options = type('Options', (object,), {'maxmemory': None, 'maxjobruntime': 1000, 'siteblacklist': None,
+                                                      'apply': False})()
+        tuning = command.autoTune(makeJobs())
+        self.assertEqual(command.options.maxmemory, tuning['maxmemory'])
+        self.assertEqual(command.options.maxjobruntime, 1000)
+        self.assertEqual(command.siteblacklist, ['T2_C'])
+
+    def testGetTaskSiteBlacklist(self):
+        """
+        Test the site blacklist read from the task information
+        """
+        def crabDBInfo(value):
+            return {'desc': {'columns': ['tm_site_blacklist']}, 'result': [value]}
+        self.assertEqual(getTaskSiteBlacklist(crabDBInfo("['T2_A', 'T2_B']")), ['T2_A', 'T2_B'])
+        self.assertEqual(getTaskSiteBlacklist(crabDBInfo('None')), [])
+        self.assertIsNone(getTaskSiteBlacklist({'desc': {'columns': []}, 'result': []}))
+
+    def testGetTaskParameter(self):
+        """
+        Test the task parameters read for --auto-tune, with the default when they are not set
+        """
+        crabDBInfo = {'desc': {'columns': ['tm_maxmemory', 'tm_numcores']}, 'result': ['2500', 'None']}
+        self.assertEqual(getTaskParameter(crabDBInfo, 'tm_maxmemory', 'maxmemory'), 2500)
+        self.assertEqual(getTaskParameter(crabDBInfo, 'tm_numcores', 'numcores'), 1)
+        self.assertEqual(getTaskParameter(crabDBInfo, 'tm_maxjobruntime', 'maxjobruntime'), 1250)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,373 @@
+#! /usr/bin/env python
+
+"""
+_status_t_
+
+Unittests for the status command methods which do not need a CRAB server
+"""
+
+import io
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from CRABClient.ClientUtilities import JobidSortKeys, BackgroundCalls
+from CRABClient.StatusHistory import StatusHistory, StatusRecord
+from CRABClient.StatusCacheFile import encodeJsonStatusCache
+from CRABClient.StatusCacheTable import StatusCacheTable
+from CRABClient.Commands.status import (status, expandProjdirPatterns, summarizeJobs, parseSortOption,
+                                        normalizeErrorMessage, analyzeSites, percentile, splitOptionValues,
+                                        parseTxtStatusCache)
+
+
+def makeStatusCache(states):
+    """ a status_cache job table with the given {jobid: state} """
+    return dict((jobid, {'State': state}) for jobid, state in states.items())
+
+
+class statusTest(unittest.TestCase):
+    """
+    unittest for crab status --watch
+    """
+
+    logger = logging.getLogger('UNITTEST')
+
+    def setUp(self):
+        # avoid running SubCommand.__init__ which needs a proxy and a CRAB server
+        self.status = status.__new__(status)
+        self.status.logger = self.logger
+        self.status.proxiedWebDir = 'https://webdir'
+        self.status.jobidSortKeys = JobidSortKeys()
+        self.status.requestarea = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.status.requestarea)
+        self.status.options = type('Options', (object,), {'watch': 60, 'columns': None})()
+
+    def printed(self, function, *args):
+        """ what function(*args) logs with the logger of the command """
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        self.logger.addHandler(handler)
+        self.logger.setLevel(logging.INFO)
+        try:
+            function(*args)
+        finally:
+            self.logger.removeHandler(handler)
+        return stream.getvalue()
+
+    def testDiffJobStates(self):
+        """
+        Test that only jobs which changed state are reported, grouped by transition
+        """
+        previous = makeStatusCache({'1': 'running', '2': 'running', '3': 'idle', '4': 'failed'})
+        current = makeStatusCache({'1': 'finished', '2': 'finished', '3': 'running', '4': 'failed', '0-1': 'idle'})
+        current['DagStatus'] = {'DagStatus': 1}
+        transitions = status.diffJobStates(previous, current)
+        self.assertEqual(transitions, {('running', 'finished'): ['1', '2'], ('idle', 'running'): ['3'],
+                                       ('new', 'idle'): ['0-1']})
+
+    def testWatchStatus(self):
+        """
+        Test the update loop: back off while the status_cache does not change, go back
+        to the initial interval when it does, stop when the task is completed
+        """
+        jobs = makeStatusCache({'1': 'running', '2': 'idle'})
+        self.status.showStatus = lambda: {'dagStatus': 'SUBMITTED', 'status': 'SUBMITTED', 'dbStatus': 'SUBMITTED',
+                                          'jobs': jobs, 'jobsPerStatus': {}, 'jobList': []}
+        updates = [(304, {}),
+                   (304, {}),
+                   (200, {'nodes': dict(makeStatusCache({'1': 'finished', '2': 'running'}), DagStatus={'DagStatus': 1})}),
+                   (200, {'nodes': dict(makeStatusCache({'1': 'finished', '2': 'finished'}), DagStatus={'DagStatus': 5})})]
+        self.status.retrieveStatusCache = lambda: updates.pop(0)
+        with mock.patch('CRABClient.Commands.status.time.sleep') as sleep:
+            statusDict = self.status.watchStatus()
+        self.assertEqual([call[0][0] for call in sleep.call_args_list], [60, 90, 135, 60])
+        self.assertEqual(statusDict['dagStatus'], 'COMPLETED')
+        self.assertEqual(statusDict['jobsPerStatus'], {'finished': 2})
+        history = StatusHistory(os.path.join(self.status.requestarea, '.status_history')).records()
+        self.assertEqual([record.counts for record in history], [{'finished': 1, 'running': 1}, {'finished': 2}])
+
+    def testExpandProjdirPatterns(self):
+        """
+        Test that a quoted -d pattern becomes one -d value plus arguments
+        """
+        workArea = tempfile.mkdtemp()
+        try:
+            for name in ['crab_b', 'crab_a', 'other']:
+                os.mkdir(os.path.join(workArea, name))
+            pattern = os.path.join(workArea, 'crab_*')
+            self.assertEqual(expandProjdirPatterns(['-d', pattern, '--json']),
+                             ['--dir', os.path.join(workArea, 'crab_a'), '--json', os.path.join(workArea, 'crab_b')])
+            self.assertEqual(expandProjdirPatterns(['--dir=' + pattern]),
+                             ['--dir', os.path.join(workArea, 'crab_a'), os.path.join(workArea, 'crab_b')])
+            self.assertEqual(expandProjdirPatterns(['-d', 'crab_x']), ['-d', 'crab_x'])
+        finally:
+            shutil.rmtree(workArea)
+
+    def testMultiStatus(self):
+        """
+        Test that all tasks are summarized, and that one failing task does not stop the others
+        """
+        workArea = tempfile.mkdtemp()
+        try:
+            projdirs = []
+            for i in range(12):
+                projdir = os.path.join(workArea, 'crab_%d' % i)
+                os.mkdir(projdir)
+                with open(os.path.join(projdir, '.requestcache'), 'wb') as fd:
+                    pickle.dump({'RequestName': 'task_%d' % i, 'Server': 'server', 'Port': '', 'instance': 'prod'}, fd)
+                projdirs.append(projdir)
+            self.status.projdirs = projdirs
+            self.status.serverurl, self.status.instance, self.status.crabserver = 'server', 'prod', object()
+            self.status.options.json = False
+
+            def getTaskSummary(server, projdir, requestarea, taskname):  # pylint: disable=unused-argument
+                if taskname == 'task_3':
+                    raise Exception("Connection refused")
+                return {'projdir': projdir, 'taskname': taskname, 'dbStatus': 'SUBMITTED', 'dagStatus': 'SUBMITTED',
+                        'jobsPerStatus': {'running': 2, 'finished': 1}, 'error': ''}
+            self.status.getTaskSummary = getTaskSummary
+            result = self.status.showMultiStatus()
+            self.assertEqual(result['commandStatus'], 'FAILED')
+            self.assertEqual([task['taskname'] for task in result['tasks']], ['task_%d' % i for i in range(12)])
+            self.assertEqual(result['tasks'][3]['error'], 'Connection refused')
+        finally:
+            shutil.rmtree(workArea)
+
+
+    def testSummarizeJobs(self):
+        """
+        Test that one pass over the status_cache collects the counts, errors, sites and job table
+        """
+        jobs = makeStatusCache({'0-1': 'finished', '0-2': 'failed', '1': 'failed', '2': 'finished',
+                                '1-1': 'failed', '1-2': 'cooloff', '3': 'running'})
+        jobs['1']['Error'] = [50664, 'Too much wall clock']
+        jobs['1-1']['Error'] = [50664, 'Too much wall clock']
+        jobs['1-1'].update({'SiteHistory': ['T2_CH_CERN', 'T1_DE_KIT'], 'WallDurations': [100, 200],
+                            'ResidentSetSize': [2048000, 1024000], 'Retries': 1})
+        jobs['2'].update({'SiteHistory': ['T1_DE_KIT'], 'WallDurations': [300], 'ResidentSetSize': [512000],
+                          'TotalSysCpuTimeHistory': [30], 'TotalUserCpuTimeHistory': [120]})
+
+        counts = summarizeJobs(jobs, True, onlyCounts=True)
+        self.assertEqual(counts['jobsPerStatus'], {'finished': 2, 'failed': 3, 'cooloff': 1, 'running': 1})
+        self.assertEqual((counts['numProbes'], counts['numUnpublishable'], counts['numFinished']), (2, 1, 1))
+        self.assertEqual(counts['statesTJ'], {'failed': 1, 'toRetry': 1})
+        self.assertNotIn('details', counts)
+
+        summary = summarizeJobs(jobs, True)
+        # with automatic splitting only the errors of the tail jobs are shown
+        self.assertEqual(summary['errors'], {(50664, 'Too much wall clock'): 1})
+        self.assertEqual(summary['errorExamples'], {(50664, 'Too much wall clock'): '1-1'})
+        self.assertEqual(summarizeJobs(jobs, True, allErrors=True)['numFailed'], 3)
+        self.assertEqual(summary['sites']['T1_DE_KIT']['Failed'], 1)
+        self.assertEqual(summary['sites']['T1_DE_KIT']['Success'], 1)
+        self.assertEqual(summary['sites']['T2_CH_CERN']['Waste'], 100)
+        self.assertEqual(summary['details']['1']['state'], 'rescheduled')
+        self.assertEqual(summary['details']['2']['cpu'], '50')
+        self.assertEqual(summary['details']['1-1']['exitcode'], '50664')
+        self.assertEqual((summary['metrics']['mem_min'], summary['metrics']['mem_max']), (500, 1000))
+        self.assertEqual(summary['metrics']['wall_sum'], 600)
+
+        restricted = summarizeJobs(jobs, False, jobids=['3', '1'])
+        self.assertEqual(sorted(restricted['details']), ['1', '3'])
+        self.assertEqual([jobid for jobid, _ in restricted['clusterIds']], ['3', '1'])
+
+    def testPrintSort(self):
+        """
+        Test sorting by several keys, in decreasing order and printing only the first jobs
+        """
+        jobs = makeStatusCache({'1': 'finished', '2': 'finished', '3': 'failed', '10': 'finished', '11': 'idle'})
+        for jobid, site, rss in [('1', 'T2_US_MIT', 2048000), ('2', 'T1_DE_KIT', 1024000),
+                                 ('3', 'T2_US_MIT', 4096000), ('10', 'T1_DE_KIT', 3072000)]:
+            jobs[jobid].update({'SiteHistory': [site], 'WallDurations': [3600], 'ResidentSetSize': [rss]})
+        details = summarizeJobs(jobs, False)['details']
+        self.assertEqual(parseSortOption('site, -memory'), [('site', False), ('memory', True)])
+
+        def printed(sortby, top=None):
+            return self.printed(self.status.printSort, details, sortby, top)
+
+        lines = printed('site,-memory').split('\n')
+        self.assertEqual([line.split()[0] for line in lines[4:9]], ['10', '2', '3', '1', '11'])
+        self.assertEqual(lines[4].split(), ['10', 'T1_DE_KIT', '3000'])
+        lines = printed('memory').split('\n')
+        # jobs without the information go last
+        self.assertEqual([line.split()[1] for line in lines[3:8]], ['2', '1', '10', '3', '11'])
+        output = printed('-memory', top=2)
+        self.assertEqual([line.split()[1] for line in output.split('\n')[3:5]], ['3', '10'])
+        self.assertIn("Showing the first 2 of 5 jobs.", output)
+
+    def testNormalizeErrors(self):
+        """
+        Test that error messages which differ only by file names and numbers are counted together
+        """
+        self.assertEqual(normalizeErrorMessage("Failed to open root://eos.cern.ch//store/user/a/out_12.root after 3 tries"),
+                         "Failed to open <URL> after <N> tries")
+        self.assertEqual(normalizeErrorMessage("File /store/mc/RunIII/x.root not found in CMSSW_13_0_2"),
+                         "File <FILE> not found in CMSSW_13_0_2")
+        jobs = makeStatusCache({'1': 'failed', '2': 'failed', '3': 'failed', '10': 'failed'})
+        jobs['10']['Error'] = [8021, 'FileReadError: /store/data/A/file1.root at event 1042']
+        jobs['2']['Error'] = [8021, 'FileReadError: /store/data/B/file7.root at event 12']
+        jobs['3']['Error'] = [8021, 'Another error']
+        jobs['1']['Error'] = [8021, 'Another error']
+        summary = summarizeJobs(jobs, False, normalizeErrors=True)
+        self.assertEqual(summary['errors'], {(8021, 'FileReadError: <FILE> at event <N>'): 2, (8021, 'Another error'): 2})
+        self.assertEqual(summary['errorExamples'][(8021, 'FileReadError: <FILE> at event <N>')], '2')
+        self.assertEqual(summary['errorExamples'][(8021, 'Another error')], '1')
+        self.assertEqual(len(summarizeJobs(jobs, False)['errors']), 3)
+
+    def testPrefetchedPublication(self):
+        """
+        Test that the publication status started in background is the one used, and that
+        a failure is ignored when the publication status is not needed
+        """
+        self.status.renderOutput = False
+        calls = []
+        def publicationStatus(workflow, user):  # pylint: disable=unused-argument
+            calls.append(workflow)
+            if workflow == 'unused':
+                raise Exception("Connection refused")
+            return {'status': {'published': 2}}
+        self.status.publicationStatus = publicationStatus
+        with BackgroundCalls() as prefetch:
+            pending = prefetch.start(self.status.publicationStatus, 'task', 'user')
+            pubStatus = self.status.printPublication(True, {'jobsPerStatus': {'finished': 2}, 'numProbes': 0, 'numUnpublishable': 0,
+                                                            'numFinished': 2}, 'task', 'user', {}, pendingPubStatus=pending)
+            self.assertEqual(pubStatus, {'status': {'published': 2}})
+            pending = prefetch.start(self.status.publicationStatus, 'unused', 'user')
+            pubStatus = self.status.printPublication(True, {'jobsPerStatus': {'running': 2}, 'numProbes': 0, 'numUnpublishable': 0,
+                                                            'numFinished': 0}, 'unused', 'user', {}, pendingPubStatus=pending)
+            self.assertEqual(pubStatus, {})
+            self.assertRaises(Exception, pending.get)
+        self.assertEqual(calls, ['task', 'unused'])
+
+    def testAnalyzeSites(self):
+        """
+        Test the percentiles, failure rates and exit codes of each site, with the retries
+        """
+        self.assertEqual(percentile([1, 2, 3, 4], 0.5), 2.5)
+        self.assertEqual(percentile([10], 0.9), 10)
+        self.assertIsNone(percentile([], 0.5))
+        nodes = {'1': {'State': 'finished', 'SiteHistory': ['T2_A', 'T2_B'], 'WallDurations': [100, 1000],
+                       'ResidentSetSize': [1024000, 2048000],
+                       'TotalSysCpuTimeHistory': [0, 100], 'TotalUserCpuTimeHistory': [50, 700]},
+                 '2': {'State': 'failed', 'Error': [50664, 'Too much wall clock'], 'SiteHistory': ['T2_A'],
+                       'WallDurations': [300], 'ResidentSetSize': [512000]},
+                 '3': {'State': 'running', 'SiteHistory': ['T2_B'], 'WallDurations': [10]},
+                 '4': {'State': 'finished', 'SiteHistory': ['T2_B'], 'WallDurations': [2000],
+                       'TotalSysCpuTimeHistory': [0], 'TotalUserCpuTimeHistory': [1000]},
+                 '5': {'State': 'idle'}, '6': {'State': 'idle', 'SiteHistory': ['Unknown']}}
+        analytics = analyzeSites(StatusCacheTable(nodes))
+        self.assertEqual(sorted(analytics), ['T2_A', 'T2_B'])
+        siteA, siteB = analytics['T2_A'], analytics['T2_B']
+        self.assertEqual((siteA['runs'], siteA['running'], siteA['failed'], siteA['failureRate']), (2, 0, 2, 1.0))
+        self.assertEqual(siteA['exitCodes'], {50664: 1})
+        self.assertEqual(siteA['exitCodeRates'], {50664: 0.5})
+        self.assertEqual(siteB['exitCodeRates'], {})
+        self.assertEqual((siteA['wallP50'], siteA['memoryP50']), (200, 750))
+        self.assertEqual((siteB['runs'], siteB['running'], siteB['failed'], siteB['failureRate']), (2, 1, 0, 0))
+        self.assertEqual((siteB['wallP50'], siteB['wallP90']), (1500, 1900))
+        self.assertEqual((siteB['cpuEffP50'], siteB['memoryP50'], siteB['memoryP90']), (65, 2000, 2000))
+        # the CPU time of job 2 is not known
+        self.assertEqual(siteA['cpuEffP50'], 50)
+        output = self.printed(self.status.printSiteAnalytics, analytics)
+        self.assertIn('T2_A', output)
+        self.assertIn('50664 (1, 50%)', output)
+
+    def testPrintProgress(self):
+        """
+        Test that the time to completion, when no job ended recently, comes from the median runtime
+        """
+        nodes = dict((str(job), {'State': 'finished', 'SiteHistory': ['T2_A'], 'WallDurations': [wall]})
+                     for job, wall in enumerate([100, 100, 100, 10000], 1))
+        nodes.update({'5': {'State': 'running', 'SiteHistory': ['T2_A']}, '6': {'State': 'running'},
+                      '7': {'State': 'idle'}, '8': {'State': 'idle'}})
+        jobsSummary = summarizeJobs(StatusCacheTable(nodes), False, 1)
+        self.assertEqual(sorted(jobsSummary['metrics']['runtimes']), [100, 100, 100, 10000])
+        records = [StatusRecord(time.time(), {'finished': 4, 'running': 2, 'idle': 2}, 0, 0)]
+        output = self.printed(self.status.printProgress, records, jobsSummary)
+        # 4 jobs left, 2 at a time, 100 s each
+        self.assertIn("Estimated time to completion:\t0:03:20 (from the median job runtime", output)
+
+    def testSplitOptionValues(self):
+        """
+        Test that --summary=sites and --watch=60, as given by crabCommand, are split in two arguments
+        """
+        self.assertEqual(splitOptionValues(['--summary=sites', '--watch=60', '--sort=site', '--summary']),
+                         ['--summary', 'sites', '--watch', '60', '--sort=site', '--summary'])
+        self.assertIsNone(splitOptionValues(None))
+
+    def testRetrieveStatusCache(self):
+        """
+        Test that status_cache.pkl is tried first, that status_cache.jsonl.gz is used if it is
+        missing or corrupted, and that the format of the local copy is tried first next time
+        """
+        statusCache = {'nodes': {'DagStatus': {'DagStatus': 1}, '1': {'State': 'idle'}}}
+        files = {'status_cache.pkl': pickle.dumps(statusCache)}
+        urls = []
+        def getIfModified(url, filename, logger=None):  # pylint: disable=unused-argument
+            urls.append(url.split('/')[-1])
+            if urls[-1] not in files:
+                return 404, b'Not Found'
+            with open(filename, 'wb') as fd:
+                fd.write(files[urls[-1]])
+            return 200, files[urls[-1]]
+        fetcher = mock.Mock(getIfModified=getIfModified)
+        with mock.patch('CRABClient.Commands.status.getWebDirFetcher', return_value=fetcher):
+            self.status.proxyfilename = None
+            self.assertEqual(self.status.retrieveStatusCache(), (200, statusCache))
+            self.assertEqual(urls, ['status_cache.pkl'])
+            # a corrupted file is removed and the next format used
+            files['status_cache.pkl'] = b'garbage'
+            files['status_cache.jsonl.gz'] = encodeJsonStatusCache(statusCache)
+            del urls[:]
+            httpCode, result, table = self.status.retrieveStatusCache(withTable=True)
+            self.assertEqual((httpCode, result, table.jobids), (200, statusCache, ['1']))
+            self.assertEqual(urls, ['status_cache.pkl', 'status_cache.jsonl.gz'])
+            self.assertFalse(os.path.exists(os.path.join(self.status.requestarea, '.status_cache.pkl')))
+            # only status_cache.jsonl.gz is asked for once it was found
+            del files['status_cache.pkl']
+            del urls[:]
+            self.assertEqual(self.status.retrieveStatusCache()[1], statusCache)
+            self.assertEqual(urls, ['status_cache.jsonl.gz'])
+            files.clear()
+            self.assertRaises(Exception, self.status.retrieveStatusCache)
+
+    def testParseTxtStatusCache(self):
+        """
+        Test the text status_cache of python2, also while the task bootstraps and there is no job table
+        """
+        info, bootstrapMsg, bootingTime = parseTxtStatusCache(
+            "# Task bootstrapped at 2021-03-22 16:23:54 UTC\n1616430956\n{}\n")
+        self.assertIsNone(info)
+        self.assertTrue(bootstrapMsg.startswith("Task bootstrapped at 2021-03-22 16:23:54 UTC. "))
+        self.assertTrue(bootingTime > 300)
+        nodes = {'DagStatus': {'DagStatus': 1}, '1': {'State': 'idle'}}
+        self.assertEqual(parseTxtStatusCache("checkpoint\ncheckpoint\n%r\n" % nodes), (nodes, None, None))
+
+    def testPrintDetailsColumns(self):
+        """
+        Test that --columns selects the columns of the extended job table, and that the
+        table is logged a page of rows at a time
+        """
+        jobs = makeStatusCache(dict((str(i), 'finished') for i in range(1, 2501)))
+        jobs['7']['ResidentSetSize'] = [2048000]
+        jobsSummary = summarizeJobs(jobs, False)
+        self.status.options.columns = 'memory,state'
+        with mock.patch.object(self.logger, 'log', wraps=self.logger.log) as log:
+            lines = self.printed(self.status.printDetails, jobsSummary, False).split('\n')
+        self.assertEqual(lines[1:4], ['Extended Job Status Table:', '', ' Job  Mem (MB) State       '])
+        self.assertEqual(lines[4:6], ['   1   Unknown finished    ', '   2   Unknown finished    '])
+        self.assertEqual(lines[10].split(), ['7', '2000', 'finished'])
+        self.assertEqual(len([line for line in lines if line.endswith('finished    ')]), 2500)
+        self.assertEqual(len([call for call in log.call_args_list if call[0][0] == logging.INFO]), 3)
+
+if __name__ == '__main__':
+    unittest.main()
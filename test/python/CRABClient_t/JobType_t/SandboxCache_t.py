@@ -0,0 +1,92 @@
+#! /usr/bin/env python
+
+"""
+_SandboxCache_t_
+
+Unittests for the SandboxCache module
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from CRABClient.JobType.SandboxCache import SandboxCache, walkManifest, manifestKey
+
+
+class SandboxCacheTest(unittest.TestCase):
+    """
+    unittest for the manifest of the sandbox content and the local cache of the uploaded sandboxes
+    """
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir)
+
+    def makeFile(self, name, content=b'data'):
+        path = os.path.join(self.workDir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as fd:
+            fd.write(content)
+        return path
+
+    def testManifest(self):
+        """
+        Test that the manifest follows what is added to the sandbox and changes with the files
+        """
+        self.makeFile('area/python/module.py')
+        self.makeFile('area/python/.git/HEAD')
+        os.symlink('module.py', os.path.join(self.workDir, 'area/python/link.py'))
+        area = os.path.join(self.workDir, 'area')
+        manifest = walkManifest(area, 'CMSSW_X', exclude=lambda name: '.git' in name)
+        self.assertEqual(sorted(entry[0] for entry in manifest),
+                         ['CMSSW_X', 'CMSSW_X/python', 'CMSSW_X/python/link.py', 'CMSSW_X/python/module.py'])
+        sizes = dict((entry[0], entry[1]) for entry in manifest)
+        self.assertEqual(sizes['CMSSW_X/python/link.py'], 4)
+        links = dict((entry[0], entry[1]) for entry in walkManifest(area, 'CMSSW_X', dereference=False))
+        self.assertEqual(links['CMSSW_X/python/link.py'], len('module.py'))
+        key = manifestKey(manifest, {'PSet.py': 'abc'}, 'https://cache')
+        self.assertEqual(key, manifestKey(list(reversed(manifest)), {'PSet.py': 'abc'}, 'https://cache'))
+        self.assertNotEqual(key, manifestKey(manifest, {'PSet.py': 'abd'}, 'https://cache'))
+        self.assertNotEqual(key, manifestKey(manifest, {'PSet.py': 'abc'}, 'https://other'))
+        self.makeFile('area/python/module.py', b'other data')
+        self.assertNotEqual(key, manifestKey(walkManifest(area, 'CMSSW_X', exclude=lambda name: '.git' in name),
+                                             {'PSet.py': 'abc'}, 'https://cache'))
+
+    def testCache(self):
+        """
+        Test adding, reusing and evicting the least recently used sandboxes
+        """
+        cache = SandboxCache(cacheDir=os.path.join(self.workDir, 'cache'), maxEntries=2, maxSize=100)
+        os.makedirs(cache.cacheDir)
+        self.assertIsNone(cache.get('a'))
+        for key in ['a', 'b']:
+            cache.put(key, self.makeFile(key + '.tgz', b'x' * 40), key * 32, [[40, 'file']])
+        entry = cache.get('a')
+        self.assertEqual(entry['hashkey'], 'a' * 32)
+        self.assertEqual(entry['content'], [[40, 'file']])
+        with open(entry['archive'], 'rb') as fd:
+            self.assertEqual(fd.read(), b'x' * 40)
+        # b was used before a, it is removed first
+        usedBefore = time.time() - 10
+        os.utime(os.path.join(cache.cacheDir, 'b.json'), (usedBefore, usedBefore))
+        cache.put('c', self.makeFile('c.tgz', b'x' * 40), 'c' * 32, [])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(sorted(os.listdir(cache.cacheDir)), ['a.json', 'a.tgz', 'c.json', 'c.tgz'])
+        # too big for the cache, together with a
+        cache.put('d', self.makeFile('d.tgz', b'x' * 70), 'd' * 32, [])
+        self.assertIsNotNone(cache.get('d'))
+        self.assertIsNone(cache.get('a'))
+        # sandboxes uploaded too long ago are not reused
+        cache.lifetime = 0
+        time.sleep(0.01)
+        self.assertIsNone(cache.get('d'))
+        self.assertFalse(os.path.exists(os.path.join(cache.cacheDir, 'd.tgz')))
+
+
+if __name__ == '__main__':
+    unittest.main()
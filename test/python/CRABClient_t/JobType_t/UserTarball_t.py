@@ -6,14 +6,26 @@ _ScramEnvironment_t_
 Unittests for ScramEnvironment module
 """
 
+import bz2
 import logging
 import os
+import random
+import shutil
 import subprocess
+import sys
 import tarfile
+import tempfile
 import unittest
 
-from CRABClient.JobType.UserTarball import UserTarball
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from CRABClient.JobType.UserTarball import (UserTarball, ChecksumTarFile, ParallelBZ2File, calculateChecksum,
+                                            compressionThreads)
 from WMCore.Configuration import Configuration
+from ServerUtilities import NEW_USER_SANDBOX_EXCLUSIONS
 from CRABClient.ClientExceptions import InputFileNotFoundException
 
 testWMConfig = Configuration()
@@ -178,6 +190,141 @@ class UserTarballTest(unittest.TestCase):
             pass
 
 
+    def testChecksum(self):
+        """
+        Test that the checksum computed while adding the files is the one calculateChecksum
+        computes from the tarball, also with the venv directory added without dereferencing links
+        """
+        workDir = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(workDir, 'src/data'))
+            for name, content in [('src/data/file.txt', b'some data' * 1000), ('src/empty.txt', b''),
+                                  ('PSet.pkl', b'not hashed'), ('tmp', b'excluded')]:
+                with open(os.path.join(workDir, name), 'wb') as fd:
+                    fd.write(content)
+            os.symlink('data/file.txt', os.path.join(workDir, 'src/link.txt'))
+            tarName = os.path.join(workDir, 'sandbox.tgz')
+            exclude = ['tmp']
+            tar = ChecksumTarFile.open(name=tarName, mode='w:bz2', dereference=True, exclude=exclude)
+            for name in ['src', 'PSet.pkl', 'tmp']:
+                tar.add(os.path.join(workDir, name), arcname=name)
+            tar.close()
+            self.assertEqual(tar.checksum(), calculateChecksum(tarName, exclude=exclude))
+            # a file with other content or name gives another checksum, a .pkl one does not
+            with open(os.path.join(workDir, 'PSet.pkl'), 'wb') as fd:
+                fd.write(b'changed')
+            other = ChecksumTarFile.open(name=os.path.join(workDir, 'other.tgz'), mode='w:bz2', dereference=True,
+                                         exclude=exclude)
+            other.add(os.path.join(workDir, 'src'), arcname='src')
+            other.add(os.path.join(workDir, 'PSet.pkl'), arcname='PSet.pkl')
+            other.close()
+            self.assertEqual(other.checksum(), tar.checksum())
+        finally:
+            shutil.rmtree(workDir)
+        # the venv directory is added without dereferencing its links, in the same tarball
+        os.makedirs(os.path.join(self.base, 'venv/bin'))
+        os.symlink('/usr/bin/python3', os.path.join(self.base, 'venv/bin/python'))
+        with UserTarball(name='default.tgz', logger=self.logger, config=testWMConfig) as tb:
+            self.tarBalls.append(tb.name)
+            tb.addFiles()
+            tb.addVenvDirectory()
+        self.assertEqual(tb.tarfile.checksum(), calculateChecksum('default.tgz', exclude=NEW_USER_SANDBOX_EXCLUSIONS))
+
+
+    def testVenv(self):
+        """
+        Test that the venv directory keeps its symbolic links, in the same tarball as the
+        other directories where the links are followed
+        """
+        os.makedirs(os.path.join(self.base, 'venv/bin'))
+        os.symlink('/usr/bin/python3', os.path.join(self.base, 'venv/bin/python'))
+        os.symlink('libSomething.so', os.path.join(self.base, 'lib', self.arch, 'libLink.so'))
+        with UserTarball(name='default.tgz', logger=self.logger, config=testWMConfig) as tb:
+            self.tarBalls.append(tb.name)
+            tb.addFiles()
+            tb.addVenvDirectory()
+            self.assertTrue(tb.dereference)
+            members = dict((member.name, member) for member in tb.getmembers())
+        self.assertTrue(members[os.path.join(self.version, 'lib', self.arch, 'libLink.so')].isfile())
+        self.assertTrue(members[os.path.join(self.version, 'venv/bin/python')].issym())
+
+
+    def testParallelCompression(self):
+        """
+        Test that the tarball compressed in several bzip2 streams is read back as a single one
+        """
+        workDir = tempfile.mkdtemp()
+        try:
+            generator = random.Random(1)
+            content = b''.join(generator.choice([b'abc', b'de', b'f']) for _ in range(100000))
+            fileName = os.path.join(workDir, 'file.txt')
+            with open(fileName, 'wb') as fd:
+                fd.write(content)
+            tarName = os.path.join(workDir, 'sandbox.tgz')
+            compressedFile = ParallelBZ2File(tarName, threads=3, blockSize=10000)
+            tar = ChecksumTarFile.open(mode='w', fileobj=compressedFile, dereference=True)
+            tar.add(fileName, arcname='file.txt')
+            tar.close()
+            compressedFile.close()
+            with open(tarName, 'rb') as fd:
+                data = fd.read()
+            self.assertTrue(data.count(b'BZh9') > 10)
+            with tarfile.open(tarName, mode='r:bz2') as tar:
+                self.assertEqual(tar.extractfile('file.txt').read(), content)
+            self.assertEqual(len(bz2.decompress(data)), compressedFile.tell())
+            self.assertEqual(tar.name, os.path.abspath(tarName))
+            # a single thread writes a single stream, which python2 can read
+            compressedFile = ParallelBZ2File(tarName, threads=1, blockSize=10000)
+            tar = ChecksumTarFile.open(mode='w', fileobj=compressedFile, dereference=True)
+            tar.add(fileName, arcname='file.txt')
+            tar.close()
+            compressedFile.close()
+            decompressor = bz2.BZ2Decompressor()
+            with open(tarName, 'rb') as fd:
+                decompressed = decompressor.decompress(fd.read())
+            self.assertEqual(decompressor.unused_data, b'')
+            self.assertEqual(len(decompressed), compressedFile.tell())
+            with mock.patch.object(sys, 'version_info', (2, 7, 18)):
+                self.assertEqual(compressionThreads(), 1)
+        finally:
+            shutil.rmtree(workDir)
+
+
+    def testReuseCachedSandbox(self):
+        """
+        Test that a sandbox with the same content is reused from the local cache, without uploading
+        it, and that another one is made when a file changes
+        """
+        cacheDir = tempfile.mkdtemp()
+        os.environ['CRAB3_CACHE_DIR'] = cacheDir
+        try:
+            tb = UserTarball(name='default.tgz', logger=self.logger, config=testWMConfig)
+            self.tarBalls.append(tb.name)
+            self.assertFalse(tb.reuseCachedSandbox(filecacheurl='https://cache'))
+            tb.addFiles()
+            tb.close()
+            # as done by upload() after uploading it
+            tb.sandboxCache.put(tb.manifestKey, tb.name, tb.tarfile.checksum(), tb.content)
+
+            with UserTarball(name='reused.tgz', logger=self.logger, config=testWMConfig) as reused:
+                self.tarBalls.append(reused.name)
+                self.assertTrue(reused.reuseCachedSandbox(filecacheurl='https://cache'))
+                self.assertEqual(reused.upload(), tb.tarfile.checksum())
+                self.assertEqual(reused.content, tb.content)
+            with tarfile.open(reused.name) as tar:
+                self.assertEqual(sorted(tar.getnames()), sorted(name for _, name in tb.content))
+
+            with UserTarball(name='other.tgz', logger=self.logger, config=testWMConfig) as other:
+                self.tarBalls.append(other.name)
+                self.assertFalse(other.reuseCachedSandbox(filecacheurl='https://other'))
+                with open('%s/src/Module/Submodule/data/datafile.txt' % self.base, 'w') as fd:
+                    fd.write('changed')
+                self.assertFalse(other.reuseCachedSandbox(filecacheurl='https://cache'))
+        finally:
+            del os.environ['CRAB3_CACHE_DIR']
+            shutil.rmtree(cacheDir)
+
+
     def testUpload(self):
         """
         Test uploading to a crab server
@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+
+"""
+_StatusCacheFile_t_
+
+Unittests for the StatusCacheFile module
+"""
+
+import gzip
+import io
+import pickle
+import unittest
+
+from CRABClient.StatusCacheTable import StatusCacheTable
+from CRABClient.StatusCacheFile import JsonStatusCache, encodeJsonStatusCache, decodeStatusCache
+
+
+STATUS_CACHE = {'nodes': {'DagStatus': {'DagStatus': 1, 'Timestamp': 1700000000},
+                          '1': {'State': 'failed', 'Error': [50664, 'Too much wall clock'], 'Retries': 1,
+                                'WallDurations': [100, 400], 'SiteHistory': ['T1_DE_KIT', 'T2_CH_CERN']},
+                          '2': {'State': 'idle'}}}
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=io.BytesIO(data), mode='rb').read()
+
+
+def regzip(content):
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb') as fd:
+        fd.write(content)
+    return out.getvalue()
+
+
+class StatusCacheFileTest(unittest.TestCase):
+    """
+    unittest for the JSON lines status_cache file
+    """
+
+    def testRoundTrip(self):
+        """
+        Test that the JSON file gives back the same dictionary as the pickle, and the jobs one by one
+        """
+        data = encodeJsonStatusCache(STATUS_CACHE)
+        jsonCache = JsonStatusCache(data)
+        self.assertEqual(jsonCache.header['jobs'], 2)
+        self.assertEqual(jsonCache.task, {'DagStatus': STATUS_CACHE['nodes']['DagStatus']})
+        self.assertEqual(sorted(jsonCache.records()), [('1', STATUS_CACHE['nodes']['1']), ('2', {'State': 'idle'})])
+        self.assertEqual(jsonCache.load(), STATUS_CACHE)
+        self.assertEqual(decodeStatusCache(data, 'json'), STATUS_CACHE)
+        self.assertEqual(decodeStatusCache(pickle.dumps(STATUS_CACHE), 'pickle'), STATUS_CACHE)
+        # the job table is filled while the jobs are read
+        for content, fileFormat in [(data, 'json'), (pickle.dumps(STATUS_CACHE), 'pickle')]:
+            table = StatusCacheTable({})
+            decodeStatusCache(content, fileFormat, table)
+            self.assertEqual(sorted(table.jobids), ['1', '2'])
+            self.assertEqual(table.walls[table.index['1']], 400)
+            # only in the table when there are too many jobs
+            table = StatusCacheTable({})
+            self.assertEqual(decodeStatusCache(content, fileFormat, table, maxJobs=1), {'nodes': {'DagStatus': STATUS_CACHE['nodes']['DagStatus']}})
+            self.assertEqual(len(table), 2)
+            self.assertEqual(decodeStatusCache(content, fileFormat, StatusCacheTable({}), maxJobs=2), STATUS_CACHE)
+        bootstrap = {'bootstrapTime': {'date': '2024-01-01 00:00:00 UTC', 'fromEpoch': 1704067200}}
+        self.assertEqual(JsonStatusCache(encodeJsonStatusCache(bootstrap)).load(), bootstrap)
+        # jobs without a DagStatus record
+        noDagStatus = {'nodes': {'1': {'State': 'running'}}}
+        self.assertEqual(decodeStatusCache(encodeJsonStatusCache(noDagStatus), 'json'), noDagStatus)
+        self.assertEqual(decodeStatusCache(pickle.dumps(noDagStatus), 'pickle'), noDagStatus)
+
+    def testIntegrity(self):
+        """
+        Test that truncated or modified files and other formats are rejected
+        """
+        content = gunzip(encodeJsonStatusCache(STATUS_CACHE))
+        truncated = JsonStatusCache(regzip(content[:content.rindex(b'[')]))
+        self.assertRaises(ValueError, truncated.load)
+        modified = JsonStatusCache(regzip(content.replace(b'"idle"', b'"done"')))
+        self.assertRaises(ValueError, list, modified.records())
+        self.assertRaises(ValueError, JsonStatusCache, regzip(b'{"format": "other"}\n{}\n'))
+        self.assertRaises(Exception, decodeStatusCache, pickle.dumps(STATUS_CACHE), 'json')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#! /usr/bin/env python
+
+"""
+_StatusCacheTable_t_
+
+Unittests for the StatusCacheTable module
+"""
+
+import unittest
+from functools import cmp_to_key
+
+from CRABClient.ClientUtilities import compareJobids, jobidSortKey, sortJobids
+from CRABClient.StatusCacheTable import StatusCacheTable, MAIN, PROBE, TAIL
+
+
+NODES = {'DagStatus': {'DagStatus': 1},
+         '0-1': {'State': 'finished', 'WallDurations': [300], 'SiteHistory': ['T2_CH_CERN'],
+                 'ResidentSetSize': [102400], 'JobIds': ['10.0']},
+         '1': {'State': 'failed', 'Error': [50664, 'Too much wall clock'], 'Retries': 2,
+               'WallDurations': [100, 200, 400], 'SiteHistory': ['T1_DE_KIT', 'T2_CH_CERN', 'T1_DE_KIT'],
+               'TotalSysCpuTimeHistory': [10, 20, 30], 'TotalUserCpuTimeHistory': [50, 60, 70]},
+         '1-1': {'State': 'failed', 'Error': [50664, 'Too much wall clock']},
+         '2': {'State': 'idle'}}
+
+
+class StatusCacheTableTest(unittest.TestCase):
+    """
+    unittest for the columnar status_cache job table
+    """
+
+    def testColumns(self):
+        """
+        Test that each job gets the right values, with states, sites and errors stored once
+        """
+        table = StatusCacheTable(NODES)
+        self.assertEqual(len(table), 4)
+        self.assertNotIn('DagStatus', table)
+        i = table.index['1']
+        self.assertEqual(table.kinds[i], MAIN)
+        self.assertEqual(table.kinds[table.index['0-1']], PROBE)
+        self.assertEqual(table.kinds[table.index['1-1']], TAIL)
+        self.assertEqual(table.stateNames[table.states[i]], 'failed')
+        self.assertEqual(table.siteNames[table.sites[i]], 'T1_DE_KIT')
+        self.assertEqual((table.walls[i], table.wastes[i], table.cpuTimes[i], table.retries[i]), (400, 300, 100, 2))
+        self.assertEqual(table.errors[i], table.errors[table.index['1-1']])
+        self.assertEqual(table.errorValues, [(50664, 'Too much wall clock')])
+        prev = range(table.prevOffsets[i], table.prevOffsets[i+1])
+        self.assertEqual([table.siteNames[table.prevSites[p]] for p in prev], ['T1_DE_KIT', 'T2_CH_CERN'])
+        self.assertEqual([table.prevWalls[p] for p in prev], [100, 200])
+        j = table.index['2']
+        self.assertEqual((table.sites[j], table.walls[j], table.rss[j], table.cpuTimes[j], table.errors[j]),
+                         (-1, -1, -1, -1, -1))
+        self.assertEqual(table.clusterIds[j], 'Unknown')
+        self.assertEqual(table.stateCode('running'), -1)
+
+    def testSortKeys(self):
+        """
+        Test that the job id keys of the table sort probe, processing and tail jobs as compareJobids
+        """
+        jobids = ['12-2', '3', '0-10', '12-10', '100', '0-2', '2-1', '12']
+        table = StatusCacheTable(dict((jobid, {'State': 'idle'}) for jobid in jobids))
+        expected = ['0-2', '0-10', '3', '12', '100', '2-1', '12-2', '12-10']
+        self.assertEqual(sorted(jobids, key=cmp_to_key(compareJobids)), expected)
+        self.assertEqual(sorted(jobids, key=jobidSortKey), expected)
+        self.assertEqual(sortJobids(jobids, table.sortKeys), expected)
+        self.assertEqual(dict(table.sortKeys), dict((jobid, jobidSortKey(jobid)) for jobid in jobids))
+
+
+if __name__ == '__main__':
+    unittest.main()
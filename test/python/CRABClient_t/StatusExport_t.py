@@ -0,0 +1,83 @@
+#! /usr/bin/env python
+
+"""
+_StatusExport_t_
+
+Unittests for the StatusExport module
+"""
+
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+from CRABClient.StatusCacheTable import StatusCacheTable
+from CRABClient.StatusExport import exportColumns, exportFormat, exportStatusTable
+
+
+NODES = {'DagStatus': {'DagStatus': 1},
+         '0-1': {'State': 'finished', 'WallDurations': [300], 'SiteHistory': ['T2_CH_CERN'],
+                 'ResidentSetSize': [102400], 'JobIds': ['10.0']},
+         '1': {'State': 'failed', 'Error': [50664, 'Too much wall clock'], 'Retries': 2,
+               'WallDurations': [100, 200, 400], 'SiteHistory': ['T1_DE_KIT', 'T2_CH_CERN', 'T1_DE_KIT'],
+               'ResidentSetSize': [1000, 2000, 3000],
+               'TotalSysCpuTimeHistory': [10, 20, 30], 'TotalUserCpuTimeHistory': [50, 60, 70]},
+         '2': {'State': 'idle'}}
+
+
+class StatusExportTest(unittest.TestCase):
+    """
+    unittest for the export of the job table of a task
+    """
+
+    def setUp(self):
+        self.workArea = tempfile.mkdtemp()
+        self.table = StatusCacheTable(NODES)
+
+    def tearDown(self):
+        shutil.rmtree(self.workArea)
+
+    def testColumns(self):
+        """
+        Test the values of the jobs and of their previous retries
+        """
+        columns = exportColumns(self.table)
+        rows = dict((jobid, i) for i, jobid in enumerate(columns['jobid']))
+        i = rows['1']
+        self.assertEqual([columns[name][i] for name in ['type', 'state', 'site', 'wallTime', 'wastedWallTime',
+                                                        'rss', 'cpuTime', 'retries', 'exitCode', 'error']],
+                         ['processing', 'failed', 'T1_DE_KIT', 400, 300, 3000, 100, 2, 50664, 'Too much wall clock'])
+        j = rows['2']
+        self.assertEqual([columns[name][j] for name in ['site', 'wallTime', 'rss', 'cpuTime', 'exitCode']],
+                         [None, None, None, None, None])
+        self.assertEqual(columns['type'][rows['0-1']], 'probe')
+        self.assertNotIn('retry', columns)
+
+        columns = exportColumns(self.table, retries=True)
+        self.assertEqual(len(columns['jobid']), 5)
+        retries = sorted(zip(columns['jobid'], columns['retry'], columns['site'], columns['wallTime'],
+                             columns['rss'], columns['cpuTime'], columns['state']))
+        self.assertEqual([row for row in retries if row[0] == '1'],
+                         [('1', 0, 'T1_DE_KIT', 100, 1000, 60, None),
+                          ('1', 1, 'T2_CH_CERN', 200, 2000, 80, None),
+                          ('1', 2, 'T1_DE_KIT', 400, 3000, 100, 'failed')])
+
+    def testCSV(self):
+        """
+        Test that the CSV file has one row per job, with empty fields for the unknown values
+        """
+        filename = os.path.join(self.workArea, 'jobs.csv')
+        self.assertEqual(exportFormat(filename), 'csv')
+        self.assertEqual(exportFormat('jobs.parquet'), 'parquet')
+        self.assertEqual(exportStatusTable(self.table, filename), 3)
+        self.assertEqual(os.listdir(self.workArea), ['jobs.csv'])
+        with open(filename) as fd:
+            rows = dict((row['jobid'], row) for row in csv.DictReader(fd))
+        self.assertEqual(sorted(rows), ['0-1', '1', '2'])
+        self.assertEqual((rows['1']['state'], rows['1']['exitCode'], rows['1']['cpuTime']), ('failed', '50664', '100.0'))
+        self.assertEqual((rows['2']['site'], rows['2']['wallTime']), ('', ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#! /usr/bin/env python
+
+"""
+_StatusHistory_t_
+
+Unittests for the StatusHistory module
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from CRABClient.StatusHistory import StatusHistory, StatusRecord, estimateProgress
+
+
+class StatusHistoryTest(unittest.TestCase):
+    """
+    unittest for the status history file and the throughput and ETA computed from it
+    """
+
+    def setUp(self):
+        self.workArea = tempfile.mkdtemp()
+        self.filename = os.path.join(self.workArea, '.status_history')
+
+    def tearDown(self):
+        shutil.rmtree(self.workArea)
+
+    def testAppend(self):
+        """
+        Test that records are added only when the status changes, and read back from any time
+        """
+        history = StatusHistory(self.filename)
+        self.assertEqual(history.records(), [])
+        self.assertIsNone(history.last())
+        self.assertTrue(history.append(StatusRecord(1000, {'idle': 10}, 0, 0)))
+        self.assertFalse(history.append(StatusRecord(1100, {'idle': 10}, 0, 0)))
+        self.assertTrue(history.append(StatusRecord(1200, {'running': 4, 'idle': 6}, 360, 300)))
+        self.assertTrue(history.append(StatusRecord(1300, {'finished': 4, 'idle': 5, 'cooloff': 1, 'new': 1}, 900, 800)))
+        last = StatusHistory(self.filename).last()
+        self.assertEqual((last.time, last.counts, last.wallTime, last.cpuTime),
+                         (1300, {'finished': 4, 'idle': 5, 'cooloff': 1, 'other': 1}, 900, 800))
+        self.assertEqual([record.time for record in history.records()], [1000, 1200, 1300])
+        # the status at time 1250 is the one of the record at 1200
+        self.assertEqual([record.time for record in history.records(since=1250)], [1200, 1300])
+        self.assertEqual([record.time for record in history.records(since=1200)], [1000, 1200, 1300])
+        self.assertEqual([record.time for record in history.records(since=2000)], [1300])
+        # an interrupted write does not spoil the records before it
+        with open(self.filename, 'ab') as fd:
+            fd.write(b'\x00' * 5)
+        self.assertEqual(history.last().time, 1300)
+        self.assertEqual(len(history.records()), 3)
+
+    def testEstimateProgress(self):
+        """
+        Test the jobs done per hour and the time to completion
+        """
+        records = [StatusRecord(0, {'idle': 100}, 0, 0),
+                   StatusRecord(3600, {'running': 50, 'idle': 40, 'finished': 10}, 0, 0),
+                   StatusRecord(7200, {'running': 50, 'finished': 40, 'failed': 10}, 0, 0)]
+        throughput, eta = estimateProgress(records, 7200)
+        self.assertAlmostEqual(throughput, 25)
+        self.assertAlmostEqual(eta, 2 * 3600)
+        # only the last hour
+        throughput, eta = estimateProgress(records[1:], 7200, window=3600)
+        self.assertAlmostEqual(throughput, 40)
+        # nothing done yet: from the average runtime, 100 jobs 50 at a time
+        throughput, eta = estimateProgress([StatusRecord(0, {'running': 50, 'idle': 50}, 0, 0)], 3600, runtime=1000)
+        self.assertEqual((throughput, eta), (0, 2000))
+        self.assertEqual(estimateProgress([StatusRecord(0, {'running': 50, 'idle': 50}, 0, 0)], 60), (None, None))
+        self.assertEqual(estimateProgress([StatusRecord(0, {'finished': 5}, 0, 0)], 60), (None, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
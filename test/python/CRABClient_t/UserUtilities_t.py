@@ -0,0 +1,251 @@
+#! /usr/bin/env python
+
+"""
+_UserUtilities_t_
+
+Unittests for the UserUtilities module
+"""
+
+import functools
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from CRABClient import UserUtilities
+from CRABClient.Commands import status as statusModule
+
+FAKE_DASGOCLIENT_DIR = os.path.join(os.path.dirname(__file__), '../../data')
+
+
+class FakeDbsReader(dict):
+    """
+    answers the datasets, blocks, filesummaries and filelumis queries like DBS does,
+    for a dataset with three blocks, and filelumis with one record per lumi
+    """
+
+    def __init__(self):
+        dict.__init__(self)
+        self.calls = []
+        self.lastModified = 1000
+        self.numValidFiles = 3
+
+    def get(self, uri=None, data=None):
+        self.calls.append((uri, data))
+        if uri == 'datasets':
+            return [{'dataset': '/A/b-c/USER', 'last_modification_date': self.lastModified}], 200, 'OK'
+        if uri == 'blocks':
+            return [{'block_name': '/A/b-c/USER#%d' % i, 'last_modification_date': 0} for i in range(3)], 200, 'OK'
+        if uri == 'filesummaries':
+            return [{'num_file': self.numValidFiles, 'num_lumi': 30, 'num_event': 300, 'file_size': 3000}], 200, 'OK'
+        block = data.split('block_name=')[1].split('&')[0]
+        blockNumber = int(block[-1])
+        result = [{'logical_file_name': '/store/f%d.root' % blockNumber, 'run_num': 1,
+                   'lumi_section_num': lumi} for lumi in range(blockNumber*10 + 1, blockNumber*10 + 11)]
+        return result, 200, 'OK'
+
+
+class FakeStatus(object):
+    """
+    stands in for the status command, counting how many times it runs
+    """
+    calls = []
+
+    def __init__(self, logger, cmdargs=None, renderOutput=True):
+        self.cmdargs = cmdargs
+        self.renderOutput = renderOutput
+
+    def __call__(self):
+        FakeStatus.calls.append((self.cmdargs, self.renderOutput))
+        return {'commandStatus': 'SUCCESS', 'statusFailureMsg': '', 'jobList': [['finished', '1']]}
+
+
+class WebDirHandler(SimpleHTTPRequestHandler):
+    """
+    serves files like the schedd webdir, answering 304 to If-Modified-Since, and logs the requests
+    """
+    requests = []
+
+    def do_GET(self):
+        WebDirHandler.requests.append(self.headers.get('If-Modified-Since'))
+        SimpleHTTPRequestHandler.do_GET(self)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class KeepAliveWebDirHandler(WebDirHandler):
+    """
+    like WebDirHandler, keeping the connections open, and logs the client ports
+    """
+    protocol_version = 'HTTP/1.1'
+    ports = []
+
+    def do_GET(self):
+        KeepAliveWebDirHandler.ports.append(self.client_address[1])
+        WebDirHandler.do_GET(self)
+
+
+class UserUtilitiesTest(unittest.TestCase):
+    """
+    unittest for the getLumiListInValidFiles and getStatusInfo functions
+    """
+
+    logger = logging.getLogger('UNITTEST')
+
+    def setUp(self):
+        self.oldEnv = dict(os.environ)
+        os.environ['PATH'] = os.path.abspath(FAKE_DASGOCLIENT_DIR) + os.pathsep + os.environ['PATH']
+        os.environ['FAKE_DASGOCLIENT_FILES'] = '6'
+        os.environ['FAKE_DASGOCLIENT_RUNS'] = '1'
+        os.environ['FAKE_DASGOCLIENT_LUMIS'] = '3'
+        os.environ['FAKE_DASGOCLIENT_INVALID'] = '4'
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.oldEnv)
+
+    def testLumisFromDAS(self):
+        """
+        Test the dasgoclient path, used when there is no proxy to talk with DBS
+        """
+        lumiList = UserUtilities.getLumiListInValidFiles('/A/b-c/USER', proxyfilename='/no/such/proxy',
+                                                         logger=self.logger)
+        # files 0 and 4 are invalid
+        self.assertEqual(lumiList.getCompactList(), {'1': [[4, 12], [16, 18]]})
+
+    def testLumisFromDBS(self):
+        """
+        Test the bulk path, with one filelumis call per block
+        """
+        dbsReader = FakeDbsReader()
+        blocks = ['/A/b-c/USER#%d' % i for i in range(3)]
+        compactList = UserUtilities._getValidFilesLumisFromDBS(dbsReader, blocks)  # pylint: disable=protected-access
+        self.assertEqual(compactList, {'1': [[1, 30]]})
+        self.assertEqual(len(dbsReader.calls), 3)
+        self.assertTrue(all('validFileOnly=1' in data for _, data in dbsReader.calls))
+
+    def testLumisCache(self):
+        """
+        Test that the lumis are reused until the dataset is modified or files change validity
+        """
+        cacheDir = tempfile.mkdtemp()
+        proxy = os.path.join(cacheDir, 'proxy')
+        with open(proxy, 'w') as fd:
+            fd.write('proxy')
+        dbsReader = FakeDbsReader()
+
+        def getLumis():
+            return UserUtilities.getLumiListInValidFiles('/A/b-c/USER', proxyfilename=proxy,
+                                                         logger=self.logger).getCompactList()
+
+        def getFileLumisCalls():
+            numCalls = len([uri for uri, _ in dbsReader.calls if uri == 'filelumis'])
+            del dbsReader.calls[:]
+            return numCalls
+
+        try:
+            with mock.patch.object(UserUtilities, 'getDbsREST', return_value=(dbsReader, None)), \
+                 mock.patch.object(UserUtilities, 'getCrabCacheDir', return_value=cacheDir):
+                self.assertEqual(getLumis(), {'1': [[1, 30]]})
+                self.assertEqual(getFileLumisCalls(), 3)
+                self.assertEqual(dbsReader['minRetries'], 0)
+                # nothing changed: cache hit
+                self.assertEqual(getLumis(), {'1': [[1, 30]]})
+                self.assertEqual(getFileLumisCalls(), 0)
+                # a file was invalidated, the modification dates stay the same
+                dbsReader.numValidFiles = 2
+                getLumis()
+                self.assertEqual(getFileLumisCalls(), 3)
+                getLumis()
+                self.assertEqual(getFileLumisCalls(), 0)
+                # the dataset was modified
+                dbsReader.lastModified += 1
+                getLumis()
+                self.assertEqual(getFileLumisCalls(), 3)
+                # the cached result is too old
+                with mock.patch.object(UserUtilities, 'VALID_FILES_LUMIS_CACHE_LIFETIME', 0):
+                    getLumis()
+                self.assertEqual(getFileLumisCalls(), 3)
+                # no cache asked
+                UserUtilities.getLumiListInValidFiles('/A/b-c/USER', proxyfilename=proxy, logger=self.logger,
+                                                      useCache=False)
+                self.assertEqual(getFileLumisCalls(), 3)
+        finally:
+            shutil.rmtree(cacheDir)
+
+    def testStatusInfoMemo(self):
+        """
+        Test that status runs once per task, without rendering, and again when the
+        result is too old
+        """
+        projDir = tempfile.mkdtemp()
+        realStatus = statusModule.status
+        statusModule.status = FakeStatus
+        FakeStatus.calls = []
+        try:
+            with open(os.path.join(projDir, '.requestcache'), 'wb') as fd:
+                pickle.dump({'RequestName': 'task_1'}, fd)
+            statusDict = UserUtilities.getStatusInfo(logger=self.logger, projdir=projDir)
+            statusDict['step'] = 'status'
+            statusDict = UserUtilities.getStatusInfo(logger=self.logger, projdir=projDir + '/')
+            self.assertEqual(statusDict['jobList'], [['finished', '1']])
+            self.assertNotIn('step', statusDict)
+            self.assertEqual(FakeStatus.calls, [(['-d', projDir], False)])
+            UserUtilities.getStatusInfo(logger=self.logger, projdir=projDir, maxAge=-1)
+            self.assertEqual(len(FakeStatus.calls), 2)
+        finally:
+            statusModule.status = realStatus
+            UserUtilities.STATUS_INFO.clear()
+            shutil.rmtree(projDir)
+
+    def testWebDirFetcher(self):
+        """
+        Test that files are read into memory over one connection, with a size limit and a local copy
+        """
+        webDir = tempfile.mkdtemp()
+        projDir = tempfile.mkdtemp()
+        server = HTTPServer(('127.0.0.1', 0), functools.partial(KeepAliveWebDirHandler, directory=webDir))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        WebDirHandler.requests = []
+        KeepAliveWebDirHandler.ports = []
+        fetcher = UserUtilities.WebDirFetcher(maxSize=100)
+        try:
+            url = 'http://127.0.0.1:%d/' % server.server_address[1]
+            for i in range(3):
+                with open(os.path.join(webDir, 'job_out.1.%d.txt' % i), 'w') as fd:
+                    fd.write('log of retry %d' % i)
+            with open(os.path.join(webDir, 'big.txt'), 'w') as fd:
+                fd.write('x' * 101)
+            for i in range(3):
+                httpCode, content, _ = fetcher.get(url + 'job_out.1.%d.txt' % i, logger=self.logger)
+                self.assertEqual((httpCode, content), (200, ('log of retry %d' % i).encode()))
+            self.assertEqual(fetcher.get(url + 'job_out.1.3.txt')[0], 404)
+            self.assertEqual(len(set(KeepAliveWebDirHandler.ports)), 1)
+            self.assertRaises(UserUtilities.ClientException, fetcher.get, url + 'big.txt')
+            localCopy = os.path.join(projDir, '.job_out.1.0.txt')
+            os.utime(os.path.join(webDir, 'job_out.1.0.txt'), (time.time() - 100, time.time() - 100))
+            self.assertEqual(fetcher.getIfModified(url + 'job_out.1.0.txt', localCopy), (200, b'log of retry 0'))
+            self.assertEqual(fetcher.getIfModified(url + 'job_out.1.0.txt', localCopy), (304, b'log of retry 0'))
+            self.assertTrue(WebDirHandler.requests[-1])
+        finally:
+            fetcher.close()
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            shutil.rmtree(webDir)
+            shutil.rmtree(projDir)
+
+
+if __name__ == '__main__':
+    unittest.main()